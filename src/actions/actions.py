@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+# Load modules from $CHARM_DIR/lib
+_path = os.path.dirname(os.path.realpath(__file__))
+_lib = os.path.abspath(os.path.join(_path, '../lib'))
+
+
+def _add_path(path):
+    if path not in sys.path:
+        sys.path.insert(1, path)
+
+
+_add_path(_lib)
+
+import charmhelpers.core.hookenv as hookenv
+import charms_openstack.bus
+import charms_openstack.charm as charm
+
+import charm.openstack.backend_check as backend_check
+import charm.openstack.hook_metrics as hook_metrics
+
+
+def hook_metrics_summary(*args):
+    """Report the slowest handlers and commands over the last N hooks."""
+    params = hookenv.action_get()
+    summary = hook_metrics.summarise(hook_metrics.read_records(),
+                                     hooks=params['hooks'],
+                                     limit=params['limit'])
+    if not summary:
+        hookenv.action_set({'output': 'No hook metrics have been recorded'})
+        return
+    hookenv.action_set(hook_metrics.format_summary(summary))
+
+
+def check_backends(*args):
+    """Check every DNS backend answers on its rndc and DNS ports."""
+    params = hookenv.action_get()
+    # load the release selector and charm classes the handlers register
+    charms_openstack.bus.discover()
+    with charm.provide_charm_instance() as instance:
+        targets = instance.backend_targets()
+    if not targets:
+        hookenv.action_set({'output': 'No DNS backends are configured'})
+        return
+    results = backend_check.check_targets(
+        targets, zone=params['zone'], concurrency=params['concurrency'],
+        timeout=params['timeout'])
+    failed = [r['name'] for r in results if not r['ok']]
+    hookenv.action_set({'output': backend_check.format_results(results),
+                        'unreachable': len(failed)})
+    if failed:
+        hookenv.action_fail("{} of {} DNS backends unreachable: {}".format(
+            len(failed), len(results), ', '.join(failed)))
+
+
+# Actions to function mapping, to allow for illegal python action names that
+# can map to a python function.
+ACTIONS = {
+    'check-backends': check_backends,
+    'hook-metrics-summary': hook_metrics_summary,
+}
+
+
+def main(args):
+    action_name = os.path.basename(args[0])
+    try:
+        action = ACTIONS[action_name]
+    except KeyError:
+        return "Action {} undefined".format(action_name)
+    else:
+        try:
+            action(args)
+        except Exception as e:
+            hookenv.action_fail(str(e))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
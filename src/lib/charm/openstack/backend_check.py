@@ -0,0 +1,197 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reachability checks of the DNS backends designate manages.
+
+Each target is checked with 'rndc status' against its rndc port, using the
+key file designate-worker uses, and with an SOA query against its DNS port.
+Targets are checked concurrently by a bounded pool of threads, and every
+check has its own timeout, so the time taken grows with the number of
+targets divided by the concurrency rather than with the number of targets.
+"""
+
+import concurrent.futures
+import random
+import socket
+import struct
+import subprocess
+import time
+
+RNDC_PORT = 953
+DNS_PORT = 53
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_CONCURRENCY = 20
+
+RCODES = {0: 'NOERROR', 1: 'FORMERR', 2: 'SERVFAIL', 3: 'NXDOMAIN',
+          4: 'NOTIMP', 5: 'REFUSED'}
+_SOA = 6
+_IN = 1
+
+
+class CheckError(Exception):
+    pass
+
+
+def soa_query(zone, query_id):
+    """Wire format of a non-recursive SOA query for zone
+
+    @param zone: str zone name, with or without the trailing dot
+    @param query_id: int 16 bit query id
+    @returns bytes
+    """
+    qname = b''
+    for label in zone.strip('.').split('.'):
+        if label:
+            qname += struct.pack('!B', len(label)) + label.encode('idna')
+    header = struct.pack('!HHHHHH', query_id, 0, 1, 0, 0, 0)
+    return header + qname + b'\x00' + struct.pack('!HH', _SOA, _IN)
+
+
+def check_soa(address, zone, port=DNS_PORT, timeout=DEFAULT_TIMEOUT):
+    """Ask address for the SOA of zone over UDP
+
+    Any answer, whatever its rcode, shows the nameserver is reachable.
+
+    @param address: str IPv4 or IPv6 address
+    @param zone: str zone name
+    @param port: int DNS port
+    @param timeout: float seconds to wait for the answer
+    @returns (float latency in seconds, str rcode name)
+    @raises CheckError if there is no answer in time
+    """
+    query_id = random.randint(0, 0xffff)
+    query = soa_query(zone, query_id)
+    try:
+        family, _, _, _, sockaddr = socket.getaddrinfo(
+            address, port, type=socket.SOCK_DGRAM)[0]
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            started = time.monotonic()
+            sock.sendto(query, sockaddr)
+            deadline = started + timeout
+            while True:
+                sock.settimeout(max(deadline - time.monotonic(), 0.001))
+                response = sock.recv(4096)
+                if (len(response) >= 12 and
+                        struct.unpack('!H', response[:2])[0] == query_id):
+                    break
+            latency = time.monotonic() - started
+    except socket.timeout:
+        raise CheckError('no answer within {}s'.format(timeout))
+    except OSError as e:
+        raise CheckError(e.strerror or str(e))
+    rcode = struct.unpack('!H', response[2:4])[0] & 0xf
+    return latency, RCODES.get(rcode, str(rcode))
+
+
+def check_rndc(address, key_file, port=RNDC_PORT, timeout=DEFAULT_TIMEOUT):
+    """Run 'rndc status' against address
+
+    @param address: str IPv4 or IPv6 address
+    @param key_file: str path of the rndc key file to authenticate with
+    @param port: int rndc port
+    @param timeout: float seconds to allow rndc to finish
+    @returns float latency in seconds
+    @raises CheckError if rndc fails or does not finish in time
+    """
+    cmd = ['rndc', '-s', address, '-p', str(port), '-k', key_file, 'status']
+    started = time.monotonic()
+    try:
+        subprocess.run(cmd, check=True, timeout=timeout,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except subprocess.TimeoutExpired:
+        raise CheckError('no answer within {}s'.format(timeout))
+    except subprocess.CalledProcessError as e:
+        lines = e.stderr.decode(errors='replace').strip().splitlines()
+        raise CheckError(lines[-1] if lines else
+                         'rndc exited {}'.format(e.returncode))
+    except OSError as e:
+        raise CheckError(e.strerror or str(e))
+    return time.monotonic() - started
+
+
+def check_target(target, zone='.', timeout=DEFAULT_TIMEOUT):
+    """Check one target's rndc and DNS ports
+
+    Targets fed from a catalog zone are not managed with rndc, so only
+    their DNS port is checked.
+
+    @param target: dict with 'name', 'address', 'rndc_key_file' and
+                   optionally 'catalog'
+    @param zone: str zone to ask for the SOA of
+    @param timeout: float seconds allowed for each check
+    @returns dict {'name', 'address', 'rndc', 'soa', 'ok'} where 'rndc' and
+             'soa' are latencies in milliseconds or error strings
+    """
+    result = {'name': target['name'], 'address': target['address'],
+              'rndc': None, 'soa': None, 'ok': True}
+    if not target.get('catalog'):
+        try:
+            result['rndc'] = round(check_rndc(
+                target['address'], target['rndc_key_file'],
+                timeout=timeout) * 1000, 1)
+        except CheckError as e:
+            result['rndc'] = str(e)
+            result['ok'] = False
+    try:
+        latency, rcode = check_soa(target['address'], zone, timeout=timeout)
+        result['soa'] = round(latency * 1000, 1)
+        result['rcode'] = rcode
+    except CheckError as e:
+        result['soa'] = str(e)
+        result['ok'] = False
+    return result
+
+
+def check_targets(targets, zone='.', concurrency=DEFAULT_CONCURRENCY,
+                  timeout=DEFAULT_TIMEOUT):
+    """Check all targets, at most concurrency of them at a time
+
+    @param targets: list of target dicts as taken by check_target()
+    @param zone: str zone to ask for the SOA of
+    @param concurrency: int maximum number of targets checked at once
+    @param timeout: float seconds allowed for each check
+    @returns list of result dicts in the order of targets
+    """
+    if not targets:
+        return []
+    workers = max(1, min(concurrency, len(targets)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(
+            lambda target: check_target(target, zone, timeout), targets))
+
+
+def _column(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '{:.1f}ms'.format(value)
+    return value
+
+
+def format_results(results):
+    """Render the results of check_targets() as a table, failures first
+
+    @param results: list of result dicts
+    @returns str
+    """
+    rows = [('target', 'address', 'rndc', 'soa', 'rcode')]
+    for result in sorted(results, key=lambda r: r['ok']):
+        rows.append((result['name'], result['address'],
+                     _column(result['rndc']), _column(result['soa']),
+                     result.get('rcode', '-')))
+    widths = [max(len(row[i]) for row in rows) for i in range(4)]
+    return '\n'.join(
+        '  '.join(cell.ljust(width) for cell, width in zip(row, widths)) +
+        '  ' + row[4] for row in rows)
@@ -14,21 +14,36 @@
 
 import collections
 import contextlib
+import fnmatch
+import functools
+import glob
+import grp
+import hashlib
+import ipaddress
+import json
 import os
+import pwd
 import subprocess
+import tempfile
+import urllib.parse
 import uuid
 
+import yaml
+
 import charmhelpers.contrib.openstack.utils as ch_utils
 import charmhelpers.contrib.charmsupport.nrpe as nrpe
 import charms_openstack.adapters as openstack_adapters
 import charms_openstack.charm as openstack_charm
 import charms_openstack.ip as os_ip
 import charms_openstack.plugins as ch_plugins
-import charmhelpers.core.decorators as decorators
 import charmhelpers.core.hookenv as hookenv
 import charmhelpers.core.host as host
 import charms.reactive.relations as relations
 
+import charm.openstack.designate_api as designate_api
+import charm.openstack.hook_metrics as hook_metrics
+import charm.openstack.rolling_restart as rolling_restart
+
 from charmhelpers.contrib.network import ip as ch_ip
 
 DESIGNATE_DIR = '/etc/designate'
@@ -36,15 +51,485 @@ DESIGNATE_DEFAULT = '/etc/default/openstack'
 DESIGNATE_CONF = DESIGNATE_DIR + '/designate.conf'
 POOLS_YAML = DESIGNATE_DIR + '/pools.yaml'
 RNDC_KEY_CONF = DESIGNATE_DIR + '/rndc.key'
+# Per backend rndc keys, named by dns-backend application or dns-slaves address
+RNDC_KEY_FILE = DESIGNATE_DIR + '/rndc_{}.key'
 NOVA_SINK_FILE = DESIGNATE_DIR + '/conf.d/nova_sink.cfg'
 NEUTRON_SINK_FILE = DESIGNATE_DIR + '/conf.d/neutron_sink.cfg'
 RC_FILE = '/root/novarc'
+# Leader setting holding the {domain name: domain id} map for the sink configs
+DOMAIN_IDS_KEY = 'domain-ids'
+# The pool every backend belongs to unless config('pools') assigns it
+# elsewhere.  Additional pools get stable ids derived from their names.
+DEFAULT_POOL_ID = '794ccc2c-d751-44fe-b57f-8894c9f5c842'
+DEFAULT_POOL_NAME = 'default'
+POOL_KEYS = ('ns-records', 'backends', 'also-notifies', 'attributes',
+             'catalog-zone')
 openstack_charm.use_defaults(
     'charm.default-select-release',
     'upgrade-charm',
 )
 
 
+class DNSSlave(collections.namedtuple('DNSSlave',
+                                      ['address', 'port', 'key'])):
+    """A DNS slave from config('dns-slaves')
+
+    @param address: str IPv4 or IPv6 address of the slave
+    @param port: int rndc port
+    @param key: str rndc key
+    """
+
+    __slots__ = ()
+
+    @property
+    def unit_name(self):
+        """Name used for the slave's pool target and rndc key file"""
+        return self.address.replace('.', '_').replace(':', '_')
+
+    @property
+    def rndc_key_file(self):
+        return RNDC_KEY_FILE.format(self.unit_name)
+
+
+@functools.lru_cache(maxsize=4)
+def parse_dns_slaves(dns_slaves):
+    """Parse config('dns-slaves')
+
+    Entries are space separated and of the form address:port:key, with IPv6
+    addresses in brackets, e.g. [fd00::1]:953:key.  Results are cached by
+    value so the option is only parsed once per hook however many
+    consumers read it.
+
+    @param dns_slaves: str value of config('dns-slaves')
+    @returns tuple of DNSSlave
+    @raises ValueError if any entry is malformed
+    """
+    slaves = []
+    for entry in (dns_slaves or '').split():
+        if entry.startswith('['):
+            address, sep, rest = entry[1:].partition(']:')
+            if not sep:
+                raise ValueError("{} is not of the form [address]:port:key"
+                                 .format(entry))
+            parts = [address] + rest.split(':')
+        else:
+            parts = entry.split(':')
+        if len(parts) != 3 or not all(parts):
+            raise ValueError("{} is not of the form address:port:key"
+                             .format(entry))
+        address, port, key = parts
+        try:
+            ipaddress.ip_address(address)
+        except ValueError:
+            raise ValueError("{} is not an IP address".format(address))
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            raise ValueError("{} is not a valid port".format(port))
+        slaves.append(DNSSlave(address, int(port), key))
+    return tuple(slaves)
+
+
+# Port assumed for memcached units that do not publish one on the relation
+MEMCACHE_PORT = 11211
+# Leader setting holding the key keystonemiddleware encrypts and
+# authenticates the token validations it caches in memcached with
+TOKEN_CACHE_SECRET_KEY = 'token-cache-secret'
+
+# Seconds a unit waits in one hook for its API to answer /healthcheck after
+# a rolling restart; if it doesn't, it checks again in the next hook.
+ROLLING_RESTART_HEALTH_BUDGET = 120
+
+# Share of options.workers (worker-multiplier x CPUs) each service gets when
+# its <service>-workers option is unset.
+SERVICE_WORKER_WEIGHTS = collections.OrderedDict([
+    ('api', 1.0),
+    ('central', 1.0),
+    ('mdns', 0.5),
+    ('worker', 0.5),
+    ('producer', 0.25),
+])
+# Resident memory of one designate service process, and the share of the
+# host's RAM that auto-sized workers may use between them.
+SERVICE_PROCESS_MEMORY = 160 * 1024 * 1024
+SERVICE_MEMORY_SHARE = 0.5
+
+# Upstream's [service:mdns] tcp_backlog, and BIND's default transfers-in: the
+# number of zone transfers a slave runs at once.
+MDNS_TCP_BACKLOG = 100
+BIND_TRANSFERS_IN = 10
+
+# Upstream's [service:worker] defaults, and how many zone changes each
+# target should be able to have in flight at once.
+WORKER_THREADS = 200
+WORKER_THREADS_PER_TARGET = 20
+WORKER_POLL_TIMEOUT = 30
+WORKER_POLL_RETRY_INTERVAL = 15
+WORKER_POLL_MAX_RETRIES = 10
+WORKER_POLL_DELAY = 5
+
+# Upstream's [producer_task:*] defaults, which suit up to
+# PRODUCER_BASE_ZONES zones.  Larger deployments page through zones in
+# bigger steps, to at most PRODUCER_MAX_PAGE, and purge deleted zones more
+# often rather than in bigger transactions.
+PRODUCER_TASKS = collections.OrderedDict([
+    ('zone_purge', collections.OrderedDict([
+        ('interval', 3600), ('per_page', 100), ('batch_size', 100)])),
+    ('delayed_notify', collections.OrderedDict([
+        ('interval', 5), ('per_page', 100), ('batch_size', 100)])),
+    ('periodic_exists', collections.OrderedDict([
+        ('interval', 3600), ('per_page', 100)])),
+    ('periodic_secondary_refresh', collections.OrderedDict([
+        ('interval', 3600), ('per_page', 100)])),
+    ('worker_periodic_recovery', collections.OrderedDict([
+        ('interval', 120), ('per_page', 100)])),
+])
+PRODUCER_BASE_ZONES = 1000
+PRODUCER_MAX_PAGE = 1000
+PRODUCER_MIN_PURGE_INTERVAL = 600
+
+# Services whose processes open designate database connections, and
+# oslo.db's per-process pool defaults, which sizing never goes beyond.
+DB_SERVICES = ('central', 'mdns', 'worker', 'producer')
+DB_MAX_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 50
+
+
+def size_service_workers(cpu_workers, total_ram, overrides=None):
+    """Work out the number of worker processes for each service
+
+    Services without an override get their SERVICE_WORKER_WEIGHTS share of
+    cpu_workers.  If that would take the processes of all services past
+    SERVICE_MEMORY_SHARE of total_ram, the auto-sized services are scaled
+    down to fit, to a minimum of one worker each.
+
+    @param cpu_workers: int workers derived from the CPU count
+    @param total_ram: int bytes of RAM on the host
+    @param overrides: dict {service: workers} set by the operator
+    @returns OrderedDict {service: workers}
+    """
+    overrides = {k: v for k, v in (overrides or {}).items() if v}
+    workers = collections.OrderedDict()
+    for service, weight in SERVICE_WORKER_WEIGHTS.items():
+        workers[service] = overrides.get(
+            service, max(1, int(round(cpu_workers * weight))))
+    auto = [s for s in workers if s not in overrides]
+    budget = int(total_ram * SERVICE_MEMORY_SHARE // SERVICE_PROCESS_MEMORY)
+    budget -= sum(overrides.values())
+    wanted = sum(workers[s] for s in auto)
+    if auto and wanted > budget:
+        scale = max(budget, 0) / float(wanted)
+        for service in auto:
+            workers[service] = max(1, int(workers[service] * scale))
+    return workers
+
+
+# designate.conf sections that are only read by some of the services.  When
+# only these sections change, only their services are restarted; a change to
+# any other section restarts everything that designate.conf is mapped to.
+CONF_SECTION_SERVICES = collections.OrderedDict([
+    ('service:api', ['designate-api']),
+    ('keystone_authtoken', ['designate-api']),
+    ('cors', ['designate-api']),
+    ('cors.subdomain', ['designate-api']),
+    ('service:central', ['designate-central']),
+    ('network_api:*', ['designate-central']),
+    # designate-worker sends NOTIFYs and SOA queries with the dnsutils
+    # options, e.g. all_tcp, read from [service:mdns]
+    ('service:mdns', ['designate-mdns', 'designate-worker']),
+    ('service:worker', ['designate-worker']),
+    ('service:producer', ['designate-producer']),
+    ('producer_task:*', ['designate-producer']),
+    ('service:zone_manager', ['designate-zone-manager']),
+    ('zone_manager_task:*', ['designate-zone-manager']),
+    ('service:pool_manager', ['designate-pool-manager']),
+    ('pool_manager_cache:*', ['designate-pool-manager']),
+    ('service:agent', ['designate-agent']),
+    ('backend:agent:*', ['designate-agent']),
+    ('service:sink', ['designate-sink']),
+    ('handler:*', ['designate-sink']),
+])
+
+
+def size_worker_polling(targets):
+    """Work out [service:worker] propagation settings for a pool size
+
+    Up to three targets every one must confirm a change, as upstream does.
+    Beyond that one lagging target is tolerated, so that it does not hold
+    its zones in PENDING and set off retries.  Retries are spaced out by a
+    second per target, up to a third of upstream's total polling window,
+    so that polling a large pool does not come in bursts.  Fewer retries
+    are made the further apart they are, so that they still fit in that
+    window.  The first poll waits a further second per ten targets to give
+    mdns time to serve the AXFRs.
+
+    @param targets: int number of targets in the largest pool
+    @returns: OrderedDict {setting: value}
+    """
+    window = WORKER_POLL_RETRY_INTERVAL * WORKER_POLL_MAX_RETRIES
+    retry_interval = min(max(WORKER_POLL_RETRY_INTERVAL, targets),
+                         window // 3)
+    threshold = 100
+    if targets > 3:
+        threshold = 100 * (targets - 1) // targets
+    return collections.OrderedDict([
+        ('threshold_percentage', threshold),
+        ('poll_timeout', WORKER_POLL_TIMEOUT),
+        ('poll_retry_interval', retry_interval),
+        ('poll_max_retries', window // retry_interval),
+        ('poll_delay', WORKER_POLL_DELAY + targets // 10),
+        ('notify_delay', None),
+    ])
+
+
+def parse_producer_tasks(producer_tasks):
+    """Parse config('producer-tasks') into per task settings
+
+    @param producer_tasks: YAML string mapping task names from
+                           PRODUCER_TASKS to {setting: value}
+    @returns: dict {task: {setting: int}}
+    @raises ValueError: if the YAML is invalid or names an unknown task or
+                        setting, or a value is not a positive integer
+    """
+    if not producer_tasks:
+        return {}
+    try:
+        data = yaml.safe_load(producer_tasks)
+    except yaml.YAMLError as e:
+        raise ValueError("not valid YAML: {}".format(str(e)))
+    if not isinstance(data, dict):
+        raise ValueError("must map task names to settings")
+    tasks = {}
+    for task, settings in data.items():
+        if task not in PRODUCER_TASKS:
+            raise ValueError("unknown task {}".format(task))
+        if not isinstance(settings, dict):
+            raise ValueError("settings for {} must be a mapping"
+                             .format(task))
+        for setting, value in settings.items():
+            if setting not in PRODUCER_TASKS[task]:
+                raise ValueError("unknown setting {} for {}"
+                                 .format(setting, task))
+            if (not isinstance(value, int) or isinstance(value, bool) or
+                    value < 1):
+                raise ValueError("{} for {} must be a positive integer"
+                                 .format(setting, task))
+        tasks[task] = settings
+    return tasks
+
+
+def size_producer_tasks(zones, overrides=None):
+    """Work out [producer_task:*] settings for the number of zones
+
+    @param zones: int expected number of zones, or None
+    @param overrides: dict as returned by parse_producer_tasks()
+    @returns: OrderedDict {task: OrderedDict {setting: value}}
+    """
+    overrides = overrides or {}
+    scale = max(1, -(-(zones or 0) // PRODUCER_BASE_ZONES))
+    tasks = collections.OrderedDict()
+    for task, defaults in PRODUCER_TASKS.items():
+        settings = collections.OrderedDict()
+        for setting, value in defaults.items():
+            if setting == 'per_page' or (task == 'delayed_notify' and
+                                         setting == 'batch_size'):
+                value = min(PRODUCER_MAX_PAGE, value * scale)
+            elif task == 'zone_purge' and setting == 'interval':
+                value = max(PRODUCER_MIN_PURGE_INTERVAL, value // scale)
+            settings[setting] = value
+        settings.update(overrides.get(task, {}))
+        tasks[task] = settings
+    return tasks
+
+
+def size_db_pool(budget, processes):
+    """Split a unit's database connection budget between its processes
+
+    Each process gets an equal share, half of it (up to DB_MAX_POOL_SIZE)
+    kept open in the pool and the rest (up to DB_MAX_OVERFLOW) opened on
+    demand.
+
+    @param budget: int connections the unit may open
+    @param processes: int processes sharing the budget
+    @returns: tuple (max_pool_size, max_overflow)
+    """
+    share = max(2, budget // max(1, processes))
+    pool_size = min(DB_MAX_POOL_SIZE, share // 2)
+    return pool_size, min(DB_MAX_OVERFLOW, share - pool_size)
+
+
+def _rndc_key_owner():
+    return pwd.getpwnam('root').pw_uid, grp.getgrnam('designate').gr_gid
+
+
+def config_section_hashes(path):
+    """Hash the settings in each section of an INI file
+
+    Comments and blank lines are ignored, so they never cause restarts.
+
+    @param path: str path of the INI file
+    @returns dict {section: sha256 hex digest}, empty if path doesn't exist
+    """
+    sections = collections.OrderedDict()
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return sections
+    section = sections.setdefault('DEFAULT', hashlib.sha256())
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith(('#', ';')):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = sections.setdefault(line[1:-1].strip(),
+                                          hashlib.sha256())
+            continue
+        section.update(line.encode('utf-8') + b'\n')
+    return {name: digest.hexdigest() for name, digest in sections.items()}
+
+
+def services_for_sections(sections, services):
+    """Services that need restarting when sections of designate.conf change
+
+    @param sections: iterable of changed section names
+    @param services: list of all services that read designate.conf
+    @returns list of services, in the order of services
+    """
+    restart = set()
+    for section in sections:
+        for pattern, section_services in CONF_SECTION_SERVICES.items():
+            if fnmatch.fnmatchcase(section, pattern):
+                restart.update(section_services)
+                break
+        else:
+            return list(services)
+    return [s for s in services if s in restart]
+
+
+def _split(value):
+    """Normalise a space separated string or a YAML list to a list of str"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return value.split()
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    raise ValueError("expected a string or a list, got {!r}".format(value))
+
+
+def _host_port(address, port):
+    """address:port, with IPv6 addresses in brackets"""
+    try:
+        ipaddress.IPv6Address(address)
+        address = '[{}]'.format(address)
+    except ValueError:
+        pass
+    return '{}:{}'.format(address, port)
+
+
+def _fqdn(name):
+    if not name:
+        return None
+    name = str(name)
+    return name if name.endswith('.') else name + '.'
+
+
+def parse_pools(pools_config):
+    """Parse the additional pools defined by config('pools')
+
+    @param pools_config: YAML mapping of pool name to a dict with the keys
+                         'ns-records', 'backends', 'also-notifies',
+                         'attributes' and 'catalog-zone'
+    @returns OrderedDict {name: {'id': pool_id,
+                                 'ns_records': [hostname, ...],
+                                 'backends': [backend, ...],
+                                 'also_notifies': [{'address': address,
+                                                    'port': port}, ...],
+                                 'attributes': {key: value},
+                                 'catalog_zone': fqdn or None}}
+    @raises ValueError if pools_config is malformed
+    """
+    pools = collections.OrderedDict()
+    if not pools_config:
+        return pools
+    try:
+        data = yaml.safe_load(pools_config)
+    except yaml.YAMLError as e:
+        raise ValueError("pools is not valid YAML: {}".format(str(e)))
+    if not isinstance(data, dict):
+        raise ValueError("pools must map pool names to pool definitions")
+    assigned = {}
+    for name, pool in data.items():
+        name = str(name)
+        if name == DEFAULT_POOL_NAME:
+            raise ValueError("pool name '{}' is reserved".format(name))
+        pool = pool or {}
+        if not isinstance(pool, dict):
+            raise ValueError("pool {} must be a mapping".format(name))
+        unknown = set(pool) - set(POOL_KEYS)
+        if unknown:
+            raise ValueError("pool {} has unknown keys: {}"
+                             .format(name, ', '.join(sorted(unknown))))
+        ns_records = _split(pool.get('ns-records'))
+        if not ns_records:
+            raise ValueError("pool {} has no ns-records".format(name))
+        backends = _split(pool.get('backends'))
+        for backend in backends:
+            if backend in assigned:
+                raise ValueError("backend {} is in pools {} and {}"
+                                 .format(backend, assigned[backend], name))
+            assigned[backend] = name
+        also_notifies = []
+        for entry in _split(pool.get('also-notifies')):
+            address, _, port = entry.rpartition(':')
+            if not address or not port.isdigit():
+                raise ValueError("pool {} has malformed also-notifies entry "
+                                 "{}".format(name, entry))
+            also_notifies.append({'address': address, 'port': port})
+        attributes = pool.get('attributes') or {}
+        if not isinstance(attributes, dict):
+            raise ValueError("pool {} attributes must be a mapping"
+                             .format(name))
+        pools[name] = {
+            'id': str(uuid.uuid5(uuid.UUID(DEFAULT_POOL_ID), name)),
+            'ns_records': ns_records,
+            'backends': backends,
+            'also_notifies': also_notifies,
+            'attributes': attributes,
+            'catalog_zone': _fqdn(pool.get('catalog-zone')),
+        }
+    return pools
+
+
+def configured_pools():
+    """The additional pools from config('pools')
+
+    An invalid config is logged and treated as defining no pools, which
+    leaves every backend in the default pool; invalid_pool_config() reports
+    the problem in the workload status.
+
+    @returns OrderedDict as returned by parse_pools()
+    """
+    try:
+        return parse_pools(hookenv.config('pools'))
+    except ValueError as e:
+        hookenv.log("Ignoring invalid 'pools' config: {}".format(str(e)),
+                    level=hookenv.ERROR)
+        return collections.OrderedDict()
+
+
+def pool_for_backend(pools, backend):
+    """Name of the pool that backend has been assigned to
+
+    @param pools: OrderedDict as returned by parse_pools()
+    @param backend: dns-backend application name or dns-slaves address
+    @returns str pool name
+    """
+    for name, pool in pools.items():
+        if backend in pool['backends']:
+            return name
+    return DEFAULT_POOL_NAME
+
+
 class DesignateDBAdapter(openstack_adapters.DatabaseRelationAdapter):
     """Get database URIs for the two designate databases"""
 
@@ -58,6 +543,37 @@ class DesignateDBAdapter(openstack_adapters.DatabaseRelationAdapter):
         """URI for designate pool DB"""
         return self.get_uri(prefix='dpm')
 
+    @property
+    def designate_replica_uri(self):
+        """URI for a read-only replica of the designate DB
+
+        The replica named by config('database-read-replica') shares the
+        primary's credentials, database and options, so its URI is the
+        primary's with the host swapped.  A unix_socket option, as used by
+        mysql-router, would take the connection back to the primary, so it
+        is dropped.
+
+        @returns: str URI, or None if no replica is configured or the
+                  primary is not yet known
+        """
+        replica = hookenv.config('database-read-replica')
+        uri = self.designate_uri
+        if not replica or not uri:
+            return None
+        try:
+            ipaddress.IPv6Address(replica)
+            replica = '[{}]'.format(replica)
+        except ValueError:
+            pass
+        parts = urllib.parse.urlsplit(uri)
+        userinfo = parts.netloc.rpartition('@')[0]
+        netloc = '{}@{}'.format(userinfo, replica) if userinfo else replica
+        query = urllib.parse.urlencode(
+            [(k, v) for k, v in urllib.parse.parse_qsl(parts.query)
+             if k != 'unix_socket'], safe='/')
+        return urllib.parse.urlunsplit(
+            (parts.scheme, netloc, parts.path, query, parts.fragment))
+
 
 class BindRNDCRelationAdapter(openstack_adapters.OpenStackRelationAdapter):
 
@@ -82,18 +598,20 @@ class BindRNDCRelationAdapter(openstack_adapters.OpenStackRelationAdapter):
         backend
 
         @returns: list [{'nameserver': name, 'pool_target': name,
-                         'address': slave_ip_addr},
+                         'address': slave_ip_addr, 'pool': pool_name},
                         ...]
         """
         pconfig = []
+        pools = configured_pools()
         for slave in self.slave_ips:
-            application_name = slave['unit'].split('/')[0].replace('-', '_')
+            remote_application = slave['unit'].split('/')[0]
+            application_name = remote_application.replace('-', '_')
             pconfig.append({
                 'nameserver': 'nameserver_{}'.format(application_name),
                 'pool_target': 'nameserver_{}'.format(application_name),
                 'address': slave['address'],
-                'rndc_key_file': '/etc/designate/rndc_{}.key'.format(
-                    application_name),
+                'rndc_key_file': RNDC_KEY_FILE.format(application_name),
+                'pool': pool_for_backend(pools, remote_application),
             })
         return pconfig
 
@@ -109,9 +627,10 @@ class BindRNDCRelationAdapter(openstack_adapters.OpenStackRelationAdapter):
     def slave_addresses(self):
         """List of slave IP addresses
 
-        @returns: str Comma delimited list of slave IP addresses
+        @returns: str Comma delimited list of slave host:port pairs, with
+                  IPv6 addresses in brackets
         """
-        return ', '.join(['{}:53'.format(s['address'])
+        return ', '.join([_host_port(s['address'], 53)
                          for s in self.pool_config])
 
     @property
@@ -124,6 +643,35 @@ class BindRNDCRelationAdapter(openstack_adapters.OpenStackRelationAdapter):
         return self.relation.rndc_info
 
 
+class DesignateMemcacheRelationAdapter(
+        openstack_adapters.MemcacheRelationAdapter):
+
+    @property
+    def servers(self):
+        """memcached servers in keystonemiddleware's memcached_servers form
+
+        Each memcached unit publishes the port it listens on; MEMCACHE_PORT
+        is assumed for those that have not.
+
+        @returns: str Comma delimited list of host:port, with IPv6 hosts
+                  written as inet6:[address]:port
+        """
+        endpoints = []
+        for conversation in self.relation.conversations():
+            address = conversation.get_remote('private-address')
+            if not address:
+                continue
+            port = conversation.get_remote('port') or MEMCACHE_PORT
+            try:
+                ipv6 = ipaddress.ip_address(address).version == 6
+            except ValueError:
+                ipv6 = False
+            if ipv6:
+                address = 'inet6:[{}]'.format(address)
+            endpoints.append('{}:{}'.format(address, port))
+        return ','.join(sorted(endpoints))
+
+
 class DesignateConfigurationAdapter(
         openstack_adapters.APIConfigurationAdapter):
 
@@ -136,42 +684,192 @@ class DesignateConfigurationAdapter(
         the nameserver and pool_target names to create a section for each
         backend.
 
+        When config('dns-slaves-catalog-zone') is set, slaves in a pool with
+        a catalog zone are marked 'catalog': they learn the pool's zones
+        from the catalog rather than being pool targets managed with rndc.
+
         @returns: list [{'nameserver': name,
                          'pool_target': name,
                          'address': slave_ip_addr,
-                         'rndc_key_file': rndc_key_file},
+                         'rndc_key_file': rndc_key_file,
+                         'pool': pool_name,
+                         'catalog': boolean},
                         ...]
         """
         pconfig = []
-        if self.dns_slaves:
-            for entry in self.dns_slaves.split():
-                try:
-                    address, port, key = entry.split(':')
-                    unit_name = address.replace('.', '_')
-                    pconfig.append({
-                        'nameserver': 'nameserver_{}'.format(unit_name),
-                        'pool_target': 'nameserver_{}'.format(unit_name),
-                        'address': address,
-                        'rndc_key_file': '/etc/designate/rndc_{}.key'.format(
-                            unit_name),
-                    })
-                except ValueError:
-                    # the entry doesn't until 3 values, so ignore it.
-                    pass
+        pools = configured_pools()
+        catalog_zones = self.catalog_zones
+        use_catalog = getattr(self, 'dns_slaves_catalog_zone', False)
+        for slave in self.slaves:
+            pool = pool_for_backend(pools, slave.address)
+            pconfig.append({
+                'nameserver': 'nameserver_{}'.format(slave.unit_name),
+                'pool_target': 'nameserver_{}'.format(slave.unit_name),
+                'address': slave.address,
+                'rndc_key_file': slave.rndc_key_file,
+                'pool': pool,
+                'catalog': bool(use_catalog and pool in catalog_zones),
+            })
         return pconfig
 
+    @property
+    def token_cache_secret(self):
+        """Key protecting the token validations cached in memcached
+
+        The leader generates it and shares it through leader settings so
+        that every unit can read what the others cache.
+
+        @returns: str or None until the leader has generated it
+        """
+        return hookenv.leader_get(TOKEN_CACHE_SECRET_KEY)
+
+    @property
+    def catalog_zones(self):
+        """Catalog zone of each pool that has one
+
+        The default pool's comes from config('catalog-zone'), the others'
+        from config('pools').  None are rendered on releases without
+        catalog zone support.
+
+        @returns: dict {pool name: catalog zone fqdn}
+        """
+        if not (self.charm_instance and
+                self.charm_instance.supports_catalog_zones()):
+            return {}
+        zones = {}
+        default = _fqdn(getattr(self, 'catalog_zone', None))
+        if default:
+            zones[DEFAULT_POOL_NAME] = default
+        for name, pool in configured_pools().items():
+            if pool['catalog_zone']:
+                zones[name] = pool['catalog_zone']
+        return zones
+
+    @property
+    def slaves(self):
+        """DNS slaves from config('dns-slaves')
+
+        A malformed option yields no slaves; invalid_pool_config() reports
+        why.
+
+        @returns: tuple of DNSSlave
+        """
+        try:
+            return parse_dns_slaves(self.dns_slaves)
+        except ValueError:
+            return ()
+
+    @property
+    def pool_target_counts(self):
+        """Number of targets rendered into each pool in pools.yaml
+
+        Counts the DNS slaves from config and the dns-backend relation,
+        except the dns-slaves that follow a catalog zone instead.
+
+        @returns: collections.Counter {pool name: targets}
+        """
+        counts = collections.Counter(
+            s['pool'] for s in self.pool_config if not s['catalog'])
+        dns_backend = relations.endpoint_from_flag('dns-backend.available')
+        if dns_backend:
+            pools = configured_pools()
+            counts.update(
+                pool_for_backend(pools, slave['unit'].split('/')[0])
+                for slave in dns_backend.slave_ips())
+        return counts
+
+    @property
+    def dns_slave_count(self):
+        """Number of DNS slaves, from config and the dns-backend relation
+
+        Unlike pool_target_counts this includes the dns-slaves that follow a
+        catalog zone, as they still transfer every zone from designate-mdns.
+
+        @returns: int
+        """
+        count = len(self.slaves)
+        dns_backend = relations.endpoint_from_flag('dns-backend.available')
+        if dns_backend:
+            count += len(dns_backend.slave_ips())
+        return count
+
+    @property
+    def worker_polling(self):
+        """Propagation settings for [service:worker]
+
+        Each setting comes from its worker-* option if set, or else from
+        size_worker_polling() for the largest pool.
+
+        @returns: OrderedDict {setting: value}
+        """
+        targets = max(self.pool_target_counts.values() or [0])
+        polling = size_worker_polling(targets)
+        for setting in polling:
+            value = getattr(self, 'worker_{}'.format(setting), None)
+            if value is not None:
+                polling[setting] = value
+        return polling
+
+    @property
+    def mdns_backlog(self):
+        """TCP backlog for designate-mdns
+
+        config('mdns-tcp-backlog') if set.  Otherwise there is room for
+        every slave to run its full set of concurrent AXFRs against this
+        unit: the slaves try their masters in the order the leader wrote
+        them into pools.yaml, so one unit can take every transfer however
+        many masters there are, and any unit may become leader.
+
+        @returns: int
+        """
+        backlog = getattr(self, 'mdns_tcp_backlog', None)
+        if backlog:
+            return backlog
+        return max(MDNS_TCP_BACKLOG, self.dns_slave_count * BIND_TRANSFERS_IN)
+
     def invalid_pool_config(self):
         """Validates that the pool config at least looks like something that
         can be used.
 
         @returns: Error string or None if okay
         """
-        if self.dns_slaves:
-            for entry in self.dns_slaves.split():
-                try:
-                    _, __, ___ = entry.split(':')
-                except ValueError:
-                    return "dns_slaves is malformed"
+        try:
+            parse_dns_slaves(self.dns_slaves)
+        except ValueError as e:
+            return "dns_slaves is malformed: {}".format(str(e))
+        try:
+            parse_pools(hookenv.config('pools'))
+        except ValueError as e:
+            return "pools is malformed: {}".format(str(e))
+        return None
+
+    @property
+    def producer_task_settings(self):
+        """Settings for each [producer_task:*] section
+
+        Sized by size_producer_tasks() from config('expected-zones'), with
+        config('producer-tasks') applied on top.  Invalid producer-tasks is
+        ignored; invalid_producer_tasks() reports why.
+
+        @returns: OrderedDict {task: OrderedDict {setting: value}}
+        """
+        try:
+            overrides = parse_producer_tasks(
+                getattr(self, 'producer_tasks', None))
+        except ValueError:
+            overrides = {}
+        return size_producer_tasks(getattr(self, 'expected_zones', None),
+                                   overrides)
+
+    def invalid_producer_tasks(self):
+        """Validates config('producer-tasks')
+
+        @returns: Error string or None if okay
+        """
+        try:
+            parse_producer_tasks(getattr(self, 'producer_tasks', None))
+        except ValueError as e:
+            return "producer-tasks is malformed: {}".format(str(e))
         return None
 
     @property
@@ -186,9 +884,10 @@ class DesignateConfigurationAdapter(
     def slave_addresses(self):
         """List of slave IP addresses
 
-        @returns: str Comma delimited list of slave IP addresses
+        @returns: str Comma delimited list of slave host:port pairs, with
+                  IPv6 addresses in brackets
         """
-        return ', '.join(['{}:53'.format(s['address'])
+        return ', '.join([_host_port(s['address'], 53)
                          for s in self.pool_config])
 
     @property
@@ -198,10 +897,8 @@ class DesignateConfigurationAdapter(
 
         @returns nova domain id
         """
-        domain = hookenv.config('nova-domain')
-        if domain:
-            return DesignateCharm.get_domain_id(domain)
-        return None
+        return DesignateCharm.resolve_domain_id(
+            hookenv.config('nova-domain'))
 
     @property
     def neutron_domain_id(self):
@@ -210,10 +907,8 @@ class DesignateConfigurationAdapter(
 
         @returns neutron domain id
         """
-        domain = hookenv.config('neutron-domain')
-        if domain:
-            return DesignateCharm.get_domain_id(domain)
-        return None
+        return DesignateCharm.resolve_domain_id(
+            hookenv.config('neutron-domain'))
 
     @property
     def notification_handlers(self):
@@ -269,6 +964,88 @@ class DesignateConfigurationAdapter(
                     rndc_master_ips.append(rndc_master_ip)
         return rndc_master_ips
 
+    @property
+    def service_workers(self):
+        """Worker processes for each service
+
+        Taken from the <service>-workers options, or sized from the CPU
+        count and RAM by size_service_workers() when those are unset.
+
+        @returns OrderedDict {service: workers}
+        """
+        overrides = {
+            service: getattr(self, '{}_workers'.format(service), None)
+            for service in SERVICE_WORKER_WEIGHTS}
+        return size_service_workers(self.workers, host.get_total_ram(),
+                                    overrides)
+
+    @property
+    def db_pool(self):
+        """Settings for [storage:sqlalchemy]
+
+        max_pool_size and max_overflow come from the db-* options if set,
+        or else from size_db_pool() for config('db-connection-budget')
+        spread over the worker processes that use the database.  The other
+        settings are None, leaving oslo.db's default, unless set.
+
+        @returns: OrderedDict {setting: value}
+        """
+        workers = self.service_workers
+        pool_size, overflow = size_db_pool(
+            self.db_connection_budget, sum(workers[s] for s in DB_SERVICES))
+        pool = collections.OrderedDict([
+            ('max_pool_size', pool_size),
+            ('max_overflow', overflow),
+            ('pool_timeout', None),
+            ('connection_recycle_time', None),
+            ('max_retries', None),
+        ])
+        for setting in pool:
+            value = getattr(self, 'db_{}'.format(setting), None)
+            if value is not None:
+                pool[setting] = value
+        return pool
+
+    @property
+    def db_connections(self):
+        """Most database connections this unit's services can open at once
+
+        A total over config('db-connection-budget') is logged.  Explicit
+        db-max-pool-size or db-max-overflow settings can cause one, as can
+        a budget of less than two connections per process.
+
+        @returns: int
+        """
+        workers = self.service_workers
+        pool = self.db_pool
+        total = (sum(workers[s] for s in DB_SERVICES) *
+                 (pool['max_pool_size'] + pool['max_overflow']))
+        if total > self.db_connection_budget:
+            hookenv.log("designate services may open {} database "
+                        "connections, over db-connection-budget of {}"
+                        .format(total, self.db_connection_budget),
+                        level=hookenv.WARNING)
+        return total
+
+    @property
+    def service_threads(self):
+        """Greenthreads for each service from the <service>-threads options
+
+        designate-worker runs a greenthread per target for every zone
+        change, so unless worker-threads is set its threads grow with the
+        size of the largest pool.
+
+        @returns dict {service: threads}, None where upstream's default
+                 applies
+        """
+        threads = {service: getattr(self, '{}_threads'.format(service), None)
+                   for service in SERVICE_WORKER_WEIGHTS}
+        if not threads['worker']:
+            targets = max(self.pool_target_counts.values() or [0])
+            if targets * WORKER_THREADS_PER_TARGET > WORKER_THREADS:
+                threads['worker'] = targets * WORKER_THREADS_PER_TARGET
+        return threads
+
     @property
     def ns_records(self):
         """List of NS records
@@ -277,6 +1054,61 @@ class DesignateConfigurationAdapter(
         """
         return self.nameservers.split()
 
+    @property
+    def all_pools(self):
+        """The default pool followed by those defined in config('pools')
+
+        Backends are placed in a pool by matching the 'pool' key of the
+        dns_backend and options pool_config entries against its name.
+        dns-slaves that follow the pool's catalog zone are notified of
+        changes as also_notifies rather than being targets.  Pools from
+        config('pools') with neither targets nor catalog zone members, e.g.
+        because their backends have not joined yet, are left out with a
+        warning, as designate cannot send their zones anywhere.
+
+        @returns list [{'id': pool_id, 'name': name, 'description': str,
+                        'ns_records': [hostname, ...],
+                        'also_notifies': [{'address': address,
+                                           'port': port}, ...],
+                        'attributes': {key: value},
+                        'catalog_zone': fqdn or None},
+                       ...]
+        """
+        # the default pool keeps its original description so that upgrading
+        # the charm does not change pools.yaml
+        pools = [{
+            'id': DEFAULT_POOL_ID,
+            'name': DEFAULT_POOL_NAME,
+            'description': 'Pool genergated by Juju',
+            'ns_records': self.ns_records,
+            'also_notifies': self.also_notifies_hosts,
+            'attributes': {},
+        }]
+        target_counts = self.pool_target_counts
+        members = [s for s in self.pool_config if s['catalog']]
+        for name, pool in configured_pools().items():
+            if not (target_counts[name] or
+                    any(s['pool'] == name for s in members)):
+                hookenv.log("Leaving pool {} out of pools.yaml as none of "
+                            "its backends are available".format(name),
+                            level=hookenv.WARNING)
+                continue
+            pools.append({
+                'id': pool['id'],
+                'name': name,
+                'description': 'Pool {} generated by Juju'.format(name),
+                'ns_records': pool['ns_records'],
+                'also_notifies': pool['also_notifies'],
+                'attributes': pool['attributes'],
+            })
+        catalog_zones = self.catalog_zones
+        for pool in pools:
+            pool['catalog_zone'] = catalog_zones.get(pool['name'])
+            pool['also_notifies'] = pool['also_notifies'] + [
+                {'address': s['address'], 'port': '53'}
+                for s in members if s['pool'] == pool['name']]
+        return pools
+
     @property
     def also_notifies_hosts(self):
         also_notifies_hosts = []
@@ -295,7 +1127,7 @@ class DesignateAdapters(openstack_adapters.OpenStackAPIRelationAdapters):
         'shared_db': DesignateDBAdapter,
         'cluster': openstack_adapters.PeerHARelationAdapter,
         'dns_backend': BindRNDCRelationAdapter,
-        'coordinator_memcached': openstack_adapters.MemcacheRelationAdapter,
+        'coordinator_memcached': DesignateMemcacheRelationAdapter,
     }
 
 
@@ -372,6 +1204,9 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
     # policyd override constants
     policyd_service_name = 'designate'
 
+    # domain ids resolved so far in this hook; see resolve_domain_id()
+    _resolved_domain_ids = {}
+
     def install(self):
         """Customise the installation, configure the source and then call the
         parent install() method to install the packages
@@ -379,6 +1214,107 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
         self.configure_source()
         super(DesignateCharm, self).install()
 
+    @contextlib.contextmanager
+    def restart_on_change(self):
+        """Restart the services affected by config changes in the block
+
+        This follows the restart_map like the default implementation, except
+        that designate.conf is compared section by section and only the
+        services that read the changed sections are restarted (see
+        CONF_SECTION_SERVICES).
+        """
+        restart_map = self.full_restart_map
+        checksums = {path: host.path_hash(path) for path in restart_map}
+        sections = config_section_hashes(DESIGNATE_CONF)
+        yield
+        restarts = []
+        for path, services in restart_map.items():
+            if host.path_hash(path) == checksums[path]:
+                continue
+            if path == DESIGNATE_CONF:
+                new_sections = config_section_hashes(DESIGNATE_CONF)
+                changed = [name for name in set(sections) | set(new_sections)
+                           if sections.get(name) != new_sections.get(name)]
+                services = services_for_sections(changed, services)
+                hookenv.log("Sections {} of {} changed, restarting {}"
+                            .format(', '.join(sorted(changed)),
+                                    DESIGNATE_CONF, ', '.join(services)),
+                            level=hookenv.DEBUG)
+            restarts.extend(services)
+        services_list = [
+            s for s in collections.OrderedDict.fromkeys(restarts) if s]
+        self.restart_services(services_list)
+
+    def restart_services(self, services):
+        """Restart services, in turn with the peers if rolling-restarts is set
+
+        @param services: list of service names
+        @returns None
+        """
+        if not services or ch_utils.is_unit_paused_set():
+            return
+        if hookenv.config('rolling-restarts') and rolling_restart.has_peers():
+            rolling_restart.request(services)
+            self.process_rolling_restarts()
+            return
+        self._stop_start(services)
+
+    @staticmethod
+    def _stop_start(services):
+        for service_name in services:
+            host.service_stop(service_name)
+        for service_name in services:
+            host.service_start(service_name)
+
+    def local_healthcheck_url(self):
+        """URL of the /healthcheck of the designate-api on this unit"""
+        port = self.options.service_listen_info['designate_api']['port']
+        return 'http://127.0.0.1:{}/healthcheck'.format(port)
+
+    def process_rolling_restarts(self):
+        """Take the rolling restart as far as this unit can in this hook
+
+        The leader hands out the restart slot.  The unit holding the slot
+        restarts its queued services and gives the slot up once its API
+        answers /healthcheck again.  Queued restarts happen straight away
+        if rolling-restarts has been switched off or the peers have gone.
+
+        @returns None
+        """
+        if hookenv.is_leader():
+            rolling_restart.grant_next_slot()
+        services = rolling_restart.pending()
+        if not services:
+            return
+        if ch_utils.is_unit_paused_set():
+            # resuming the unit starts its services anyway
+            rolling_restart.complete()
+        elif not (hookenv.config('rolling-restarts') and
+                  rolling_restart.has_peers()):
+            self._stop_start(services)
+            rolling_restart.complete()
+        elif not rolling_restart.holds_slot():
+            hookenv.log("Waiting for a restart slot to restart {}"
+                        .format(', '.join(services)), level=hookenv.INFO)
+            return
+        else:
+            if not rolling_restart.restarted():
+                self._stop_start(services)
+                rolling_restart.mark_restarted()
+            probe = designate_api.ReadinessProbe(
+                budget=ROLLING_RESTART_HEALTH_BUDGET)
+            try:
+                probe.wait(designate_api.HealthcheckEndpoint(
+                    self.local_healthcheck_url()))
+            except designate_api.DesignateAPIError as e:
+                hookenv.log("Keeping the restart slot until the API is "
+                            "healthy: {}".format(str(e)),
+                            level=hookenv.WARNING)
+                return
+            rolling_restart.complete()
+        if hookenv.is_leader():
+            rolling_restart.grant_next_slot()
+
     def render_base_config(self, interfaces_list):
         """Render initial config to bootstrap Designate service
 
@@ -394,66 +1330,134 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
     def render_full_config(self, interfaces_list):
         """Render all config for Designate service
 
+        Every target is rendered once.  Targets whose content is unchanged
+        are not rewritten and so do not restart their services.  When sinks
+        are configured, the sink configs and DESIGNATE_DEFAULT (which
+        references them) are left to be rendered once the domains they
+        need exist.
+
         @returns None
         """
-        # Render base config first to ensure Designate API is responding as
-        # sink configs rely on it.
-        self.render_base_config(interfaces_list)
-        self.render_with_interfaces(interfaces_list)
+        configs = list(self.full_restart_map.keys())
+        if self.configure_sink():
+            deferred = (NOVA_SINK_FILE, NEUTRON_SINK_FILE, DESIGNATE_DEFAULT)
+            configs = [c for c in configs if c not in deferred]
+        self.render_with_interfaces(interfaces_list, configs=configs)
 
     def write_key_file(self, unit_name, key):
-        """Write rndc keyfile for given unit_name
+        """Write rndc keyfile for given unit_name unless it is up to date
+
+        The key is written to a temporary file that is renamed into place,
+        so designate-worker never reads a partly written key.
 
         @param unit_name: str Name of unit using key
         @param key: str RNDC key
-        @returns None
+        @returns boolean whether the file was written
         """
-        key_file = '/etc/designate/rndc_{}.key'.format(unit_name)
+        key_file = RNDC_KEY_FILE.format(unit_name)
         template = ('key "rndc-key" {{\n    algorithm hmac-md5;\n    '
                     'secret "{}";\n}};')
-        host.write_file(
-            key_file,
-            str.encode(template.format(key)),
-            owner='root',
-            group='designate',
-            perms=0o440)
+        content = str.encode(template.format(key))
+        try:
+            with open(key_file, 'rb') as f:
+                if f.read() == content:
+                    return False
+        except FileNotFoundError:
+            pass
+        uid, gid = _rndc_key_owner()
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(key_file),
+                                   prefix='.rndc_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                os.fchown(f.fileno(), uid, gid)
+                os.fchmod(f.fileno(), 0o440)
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, key_file)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return True
+
+    def rndc_keys(self):
+        """The rndc keys for dns-slaves and the dns-backend relation
+
+        @returns (dict {unit_name: key}, set of unit_names whose key the
+                  dns-backend relation has not provided yet)
+        @raises ValueError if config('dns-slaves') is malformed
+        """
+        keys = collections.OrderedDict(
+            (slave.unit_name, slave.key)
+            for slave in parse_dns_slaves(hookenv.config('dns-slaves')))
+        pending = set()
+        dns_backend = relations.endpoint_from_flag('dns-backend.available')
+        if dns_backend:
+            for conversation in dns_backend.conversations():
+                application_name = conversation.scope.split(
+                    '/')[0].replace('-', '_')
+                if application_name in keys or application_name in pending:
+                    continue
+                rndckey = conversation.get_remote('rndckey')
+                if rndckey:
+                    keys[application_name] = rndckey
+                else:
+                    pending.add(application_name)
+        return keys, pending
 
     def render_rndc_keys(self):
-        """Render the rndc keys supplied via user config
+        """Bring the rndc key files in line with dns-slaves and dns-backend
 
-        @returns None
+        Only keys that changed are written, and key files no longer
+        referenced by either are removed; a key the dns-backend relation
+        has yet to provide keeps its current file.  designate-worker is
+        restarted if, and only if, its set of keys changed.  Nothing is
+        removed while config('dns-slaves') is malformed.
+
+        @returns boolean whether any key changed
         """
-        slaves = hookenv.config('dns-slaves') or ''
         try:
-            for entry in slaves.split():
-                address, port, key = entry.split(':')
-                unit_name = address.replace('.', '_')
-                self.write_key_file(unit_name, key)
+            keys, pending = self.rndc_keys()
         except ValueError as e:
             hookenv.log("Problem with 'dns-slaves' config: {}"
                         .format(str(e)), level=hookenv.ERROR)
-
-    def render_relation_rndc_keys(self):
-        """Render the rndc keys for each application in the dns-backend
-        relation
-
-        @returns None
+            return False
+        changed = [name for name, key in keys.items()
+                   if self.write_key_file(name, key)]
+        prefix, suffix = RNDC_KEY_FILE.split('{}')
+        for key_file in glob.glob(RNDC_KEY_FILE.format('*')):
+            name = key_file[len(prefix):-len(suffix)]
+            if name not in keys and name not in pending:
+                os.remove(key_file)
+                changed.append(name)
+        if not changed:
+            return False
+        hookenv.log("rndc keys changed for {}".format(', '.join(changed)),
+                    level=hookenv.INFO)
+        self.restart_services(
+            [s for s in self.services if s == 'designate-worker'])
+        return True
+
+    def backend_targets(self):
+        """The DNS backends from the dns-backend relation and dns-slaves
+
+        @returns list [{'name': pool_target name,
+                        'address': slave_ip_addr,
+                        'rndc_key_file': rndc_key_file,
+                        'catalog': boolean},
+                       ...]
         """
-        try:
-            applications = []
-            dns_backend = relations.endpoint_from_flag(
-                'dns-backend.available').conversations()
-            for conversation in dns_backend:
-                application_name = conversation.scope.split(
-                    '/')[0].replace('-', '_')
-                if application_name not in applications:
-                    applications.append(application_name)
-                    rndckey = conversation.get_remote('rndckey')
-                    self.write_key_file(application_name, rndckey)
-
-        except ValueError as e:
-            hookenv.log("problem writing relation_rndc_keys: {}"
-                        .format(str(e)), level=hookenv.ERROR)
+        pool_config = []
+        dns_backend = relations.endpoint_from_flag('dns-backend.available')
+        if dns_backend:
+            pool_config.extend(
+                BindRNDCRelationAdapter(dns_backend).pool_config)
+        pool_config.extend(self.options.pool_config)
+        return [{'name': slave['pool_target'],
+                 'address': slave['address'],
+                 'rndc_key_file': slave['rndc_key_file'],
+                 'catalog': slave.get('catalog', False)}
+                for slave in pool_config]
 
     def configure_sink(self):
         cmp_os_release = ch_utils.CompareOpenStackReleases(
@@ -461,9 +1465,25 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
         )
         return cmp_os_release < 'queens'
 
+    def supports_catalog_zones(self):
+        """Whether designate can serve catalog zones, new in Antelope
+
+        @returns boolean
+        """
+        cmp_os_release = ch_utils.CompareOpenStackReleases(
+            self.release
+        )
+        return cmp_os_release >= 'antelope'
+
+    @staticmethod
+    def api_client():
+        """Return the designate API client shared for the rest of the hook
+
+        @returns designate_api.DesignateClient
+        """
+        return designate_api.get_client(RC_FILE)
+
     @classmethod
-    @decorators.retry_on_exception(
-        40, base_delay=5, exc_type=subprocess.CalledProcessError)
     def get_domain_id(cls, domain):
         """Return the domain ID for a given domain name
 
@@ -472,16 +1492,25 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
         """
         if domain:
             cls.ensure_api_responding()
-            get_cmd = ['reactive/designate_utils.py', 'domain-get',
-                       '--domain-name', domain]
-            output = subprocess.check_output(get_cmd)
-            if output:
-                return output.decode('utf8').strip()
+            return cls.api_client().get_zone_id(domain)
         return None
 
     @classmethod
-    @decorators.retry_on_exception(
-        40, base_delay=5, exc_type=subprocess.CalledProcessError)
+    def get_domain_ids(cls, *domains):
+        """Return the domain IDs for several domain names, looked up
+        concurrently
+
+        @param domains: Domain names; empty names map to None
+        @returns dict {domain: domain_id}
+        """
+        domain_ids = dict.fromkeys(domains)
+        wanted = [d for d in domain_ids if d]
+        if wanted:
+            cls.ensure_api_responding()
+            domain_ids.update(cls.api_client().get_zone_ids(wanted))
+        return domain_ids
+
+    @classmethod
     def create_domain(cls, domain, email):
         """Create a domain
 
@@ -492,13 +1521,9 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
         @returns None
         """
         cls.ensure_api_responding()
-        create_cmd = ['reactive/designate_utils.py', 'domain-create',
-                      '--domain-name', domain, '--email', email]
-        subprocess.check_call(create_cmd)
+        cls.api_client().create_zone(domain, email)
 
     @classmethod
-    @decorators.retry_on_exception(
-        40, base_delay=5, exc_type=subprocess.CalledProcessError)
     def create_server(cls, nsname):
         """ create a nameserver entry with the supplied name
 
@@ -506,9 +1531,7 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
         @returns None
         """
         cls.ensure_api_responding()
-        create_cmd = ['reactive/designate_utils.py', 'server-create',
-                      '--server-name', nsname]
-        subprocess.check_call(create_cmd)
+        cls.api_client().create_server(nsname)
 
     def domain_init_done(self):
         """Query leader db to see if domain creation is donei
@@ -517,35 +1540,147 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
         return hookenv.leader_get(attribute='domain-init-done')
 
     @classmethod
-    @decorators.retry_on_exception(
-        40, base_delay=5, exc_type=subprocess.CalledProcessError)
     def ensure_api_responding(cls):
         """Check that the api service is responding.
 
-        The retry_on_exception decorator will cause this method to be called
-        until it succeeds or retry limit is exceeded"""
+        The API is polled with backoff, through /healthcheck and a zone
+        listing that needs designate-central, until it answers or the time
+        budget shared by all callers in this hook runs out.  Once it has
+        answered, later calls in the same hook return immediately.
+
+        @raises designate_api.DesignateAPIError if the budget is exhausted
+        """
         hookenv.log('Checking API service is responding',
-                    level=hookenv.WARNING)
-        check_cmd = ['reactive/designate_utils.py', 'server-list']
-        subprocess.check_call(check_cmd)
+                    level=hookenv.DEBUG)
+        with hook_metrics.record(hook_metrics.API, 'healthcheck') as entry:
+            entry['retries'] = designate_api.wait_until_ready(
+                cls.api_client())
+
+    @staticmethod
+    def published_domain_ids():
+        """Return the domain id map the leader published in leader settings
+
+        @returns dict {domain_name: domain_id}
+        """
+        domain_ids = hookenv.leader_get(attribute=DOMAIN_IDS_KEY)
+        if domain_ids:
+            return json.loads(domain_ids)
+        return {}
+
+    @classmethod
+    def resolve_domain_id(cls, domain):
+        """Return the id of domain for use when rendering
+
+        The id is taken from the map published by the leader.  Only the
+        leader falls back to asking the API, so rendering on other units
+        never waits on it.  Results are remembered for the rest of the hook.
+
+        @param domain: Domain name
+        @returns domain_id or None
+        """
+        if not domain:
+            return None
+        if domain not in cls._resolved_domain_ids:
+            domain_id = cls.published_domain_ids().get(domain)
+            if domain_id is None and hookenv.is_leader():
+                domain_id = cls.get_domain_id(domain)
+            cls._resolved_domain_ids[domain] = domain_id
+        return cls._resolved_domain_ids[domain]
+
+    @staticmethod
+    def ensure_token_cache_secret():
+        """Generate the token cache secret unless there is one (leader only)
+
+        @returns None
+        """
+        if (hookenv.is_leader() and
+                not hookenv.leader_get(TOKEN_CACHE_SECRET_KEY)):
+            hookenv.leader_set({TOKEN_CACHE_SECRET_KEY: host.pwgen(32)})
+
+    @classmethod
+    def publish_domain_ids(cls, domain_ids):
+        """Publish domain_ids to leader settings for the peers to render from
+
+        Updating domain-init-done as well triggers the peers to rerender
+        their sink configs.  Use host ID and current time UUID to help with
+        debugging.
+
+        @param domain_ids: dict {domain_name: domain_id}
+        @returns None
+        """
+        hookenv.leader_set({
+            'domain-init-done': uuid.uuid1(),
+            DOMAIN_IDS_KEY: json.dumps(domain_ids, sort_keys=True),
+        })
+        cls._resolved_domain_ids.clear()
+        cls._resolved_domain_ids.update(domain_ids)
+
+    @classmethod
+    def ensure_domain_ids_published(cls):
+        """Publish the ids of configured domains missing from leader settings
+
+        This is a no-op off the leader or once the map is complete, so it
+        costs no API calls on most hooks.
+
+        @returns None
+        """
+        if not hookenv.is_leader():
+            return
+        domains = [d for d in (hookenv.config('nova-domain'),
+                               hookenv.config('neutron-domain')) if d]
+        domain_ids = cls.published_domain_ids()
+        missing = [d for d in domains if d not in domain_ids]
+        if not missing:
+            return
+        for domain, domain_id in cls.get_domain_ids(*missing).items():
+            if domain_id:
+                domain_ids[domain] = domain_id
+        if domain_ids != cls.published_domain_ids():
+            cls.publish_domain_ids(domain_ids)
 
     @classmethod
     @contextlib.contextmanager
     def check_zone_ids(cls, nova_domain_name, neutron_domain_name):
-        zone_org_ids = {
-            'nova-domain-id': cls.get_domain_id(nova_domain_name),
-            'neutron-domain-id': cls.get_domain_id(neutron_domain_name),
-        }
+        zone_org_ids = cls.get_domain_ids(nova_domain_name,
+                                          neutron_domain_name)
         yield
-        zone_ids = {
-            'nova-domain-id': cls.get_domain_id(nova_domain_name),
-            'neutron-domain-id': cls.get_domain_id(neutron_domain_name),
-        }
-        if zone_org_ids != zone_ids:
+        zone_ids = cls.get_domain_ids(nova_domain_name, neutron_domain_name)
+        domain_ids = {name: domain_id
+                      for name, domain_id in zone_ids.items()
+                      if name and domain_id}
+        if (zone_org_ids != zone_ids or
+                cls.published_domain_ids() != domain_ids):
             # Update leader-db to trigger peers to rerender configs
             # as sink files will need updating with new domain ids
-            # Use host ID and current time UUID to help with debugging
-            hookenv.leader_set({'domain-init-done': uuid.uuid1()})
+            cls.publish_domain_ids(domain_ids)
+
+    @classmethod
+    def provision_servers_and_domains(cls, nameservers, domains):
+        """Create any missing nameservers and domains in one batch
+
+        The API is probed and authenticated against once for the whole batch
+        rather than once per item.
+
+        @param nameservers: list of nameserver names
+        @param domains: list of (domain, email) tuples
+        @returns list of designate_api.ProvisionResult
+        @raises designate_api.DesignateAPIError if any item failed
+        """
+        cls.ensure_api_responding()
+        results = cls.api_client().ensure_servers_and_zones(
+            nameservers, domains)
+        failed = []
+        for result in results:
+            hookenv.log("{} {}: {}{}".format(
+                result.kind, result.name, result.status,
+                ' ({})'.format(result.error) if result.error else ''),
+                level=hookenv.DEBUG)
+            if result.status == 'failed':
+                failed.append(result.name)
+        if failed:
+            raise designate_api.DesignateAPIError(
+                "Failed to create: {}".format(', '.join(failed)))
+        return results
 
     @classmethod
     def create_initial_servers_and_domains(cls):
@@ -563,6 +1698,7 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
             nova_domain_name = hookenv.config('nova-domain')
             neutron_domain_name = hookenv.config('neutron-domain')
             with cls.check_zone_ids(nova_domain_name, neutron_domain_name):
+                nameservers = []
                 if hookenv.config('nameservers'):
                     for ns in hookenv.config('nameservers').split():
                         ns_ = ns
@@ -571,20 +1707,22 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
                             hookenv.log(("Missing dot (.) at the end of '%s', "
                                          "adding it automatically." % ns),
                                         level=hookenv.WARNING)
-                        cls.create_server(ns_)
+                        nameservers.append(ns_)
                 else:
                     hookenv.log('No nameserver specified, skipping creation of'
                                 'nova and neutron domains',
                                 level=hookenv.WARNING)
                     return
+                domains = []
                 if nova_domain_name:
-                    cls.create_domain(
-                        nova_domain_name,
-                        hookenv.config('nova-domain-email'))
+                    domains.append(
+                        (nova_domain_name,
+                         hookenv.config('nova-domain-email')))
                 if neutron_domain_name:
-                    cls.create_domain(
-                        neutron_domain_name,
-                        hookenv.config('neutron-domain-email'))
+                    domains.append(
+                        (neutron_domain_name,
+                         hookenv.config('neutron-domain-email')))
+                cls.provision_servers_and_domains(nameservers, domains)
             # if this fails, we weren't the leader any more; another unit may
             # attempt to do this too.
             hookenv.leader_set({KEY: 'done'})
@@ -595,17 +1733,28 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
         # NOTE(AJK) this runs with every hook (once most relations are up) and
         # so if it fails it will be picked up by the next relation change or
         # update-status.  i.e. it will heal eventually.
+        # The pools are only pushed when pools.yaml differs from the last
+        # version that was applied successfully, so hooks that don't change
+        # it skip the AMQP round trip to designate-central.
         if hookenv.is_leader():
+            pools_hash = host.file_hash(POOLS_YAML)
+            if pools_hash is None:
+                hookenv.log("{} not rendered yet, not updating pools"
+                            .format(POOLS_YAML), level=hookenv.DEBUG)
+                return
+            if pools_hash == hookenv.leader_get('pool-yaml-hash'):
+                hookenv.log("{} unchanged, not updating pools"
+                            .format(POOLS_YAML), level=hookenv.DEBUG)
+                return
             try:
                 cmd = "designate-manage pool update"
                 # Note(tinwood) that this command may fail if the pools.yaml
                 # doesn't actually contain any pools.  This happens when the
                 # relation is broken, which errors out the charm.  This stops
                 # this happening and logs the error.
-                subprocess.check_call(cmd.split(), timeout=60)
+                hook_metrics.check_call(cmd.split(), timeout=60)
                 # Update leader db to trigger restarts
-                hookenv.leader_set(
-                    {'pool-yaml-hash': host.file_hash(POOLS_YAML)})
+                hookenv.leader_set({'pool-yaml-hash': pools_hash})
             except subprocess.CalledProcessError as e:
                 hookenv.log("designate-manage pool update failed: {}"
                             .format(str(e)))
@@ -638,7 +1787,7 @@ class DesignateCharm(ch_plugins.PolicydOverridePlugin,
     def pool_manager_cache_sync(self):
         if not self.pool_manager_cache_sync_done() and hookenv.is_leader():
             sync_cmd = "designate-manage pool-manager-cache sync"
-            subprocess.check_call(sync_cmd.split(), timeout=60)
+            hook_metrics.check_call(sync_cmd.split(), timeout=60)
             hookenv.leader_set({'pool-manager-cache-sync-done': True})
             self.restart_all()
 
@@ -714,6 +1863,9 @@ class DesignateCharmQueens(DesignateCharm):
         invalid_dns = self.options.invalid_pool_config()
         if invalid_dns:
             return 'blocked', invalid_dns
+        invalid_tasks = self.options.invalid_producer_tasks()
+        if invalid_tasks:
+            return 'blocked', invalid_tasks
         dns_backend_available = (relations
                                  .endpoint_from_flag('dns-backend.available'))
         if not (dns_backend_available or hookenv.config('dns-slaves')):
@@ -0,0 +1,625 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process client for the parts of the Designate API used by the charm.
+
+A single DesignateClient holds one Keystone token and one pooled HTTP session
+for the lifetime of a hook, so creating servers and domains no longer needs a
+python interpreter and a Keystone round trip per call.
+"""
+
+import asyncio
+import collections
+import datetime
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import requests
+
+import charmhelpers.core.hookenv as hookenv
+
+RC_FILE = '/root/novarc'
+# Scoped token shared between hook invocations; readable by root only
+TOKEN_CACHE_FILE = '/root/.designate-token-cache.json'
+# Cached tokens are not reused within this many seconds of their expiry
+TOKEN_EXPIRY_MARGIN = 300
+
+# Zones (domains) are managed through the v2 API.  The v2 API has no writable
+# nameserver resource, so NS servers still go through /v1/servers exactly as
+# the legacy 'designate server-create' command did.
+ZONES_PATH = '/v2/zones'
+SERVERS_PATH = '/v1/servers'
+
+# Page size used when walking full zone listings
+PAGE_LIMIT = 500
+
+# Maximum number of API requests a batch keeps in flight at once
+MAX_IN_FLIGHT = 8
+
+# Total time, in seconds, a hook may spend waiting for the API to come up,
+# shared by every caller of ReadinessProbe.wait in that hook.
+READINESS_BUDGET = 300
+
+_clients = {}
+
+# Outcome of provisioning a single server or zone in a batch.  status is one
+# of 'exists', 'created' or 'failed'; error is only set for failures.
+ProvisionResult = collections.namedtuple(
+    'ProvisionResult', ['kind', 'name', 'id', 'status', 'error'])
+
+
+class DesignateAPIError(Exception):
+    """Raised when Keystone or the Designate API cannot service a request"""
+
+    def __init__(self, message, status_code=None):
+        super(DesignateAPIError, self).__init__(message)
+        self.status_code = status_code
+
+    @property
+    def transient(self):
+        """Whether retrying may succeed: no response at all or a 5xx"""
+        return self.status_code is None or self.status_code >= 500
+
+
+def get_environment(env, rc_file=RC_FILE):
+    """Update env with the variables exported by rc_file
+
+    @param env: dict to update
+    @param rc_file: path of the novarc style file to read
+    @returns dict env
+    """
+    with open(rc_file, "r") as ins:
+        for line in ins:
+            if '=' not in line:
+                continue
+            k, v = line.replace('export', '').replace(" ", "").split('=', 1)
+            env[k] = v.strip()
+    return env
+
+
+def _parse_expiry(timestamp):
+    """Convert a Keystone expiry timestamp to seconds since the epoch"""
+    return datetime.datetime.fromisoformat(
+        timestamp.replace('Z', '+00:00')).timestamp()
+
+
+class TokenCache(object):
+    """Keystone token persisted on disk between hook invocations
+
+    The cached token is tied to a key derived from the credentials it was
+    issued for, so it is ignored as soon as RC_FILE changes.  The cache is
+    only an optimisation: failures to read or write it are logged and
+    otherwise ignored.
+    """
+
+    def __init__(self, key, path=TOKEN_CACHE_FILE,
+                 margin=TOKEN_EXPIRY_MARGIN):
+        self.key = key
+        self.path = path
+        self.margin = margin
+
+    def get(self):
+        """Return the cached token, or None if it is missing, stale or was
+        issued for different credentials
+        """
+        try:
+            with open(self.path, 'r') as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            hookenv.log("Unable to read token cache {}: {}"
+                        .format(self.path, str(e)), level=hookenv.WARNING)
+            return None
+        if (not isinstance(cached, dict) or
+                cached.get('key') != self.key or
+                cached.get('expires', 0) - self.margin < time.time()):
+            return None
+        return cached.get('token')
+
+    def set(self, token, expires):
+        """Atomically replace the cache with token
+
+        @param token: str token
+        @param expires: token expiry in seconds since the epoch
+        """
+        tmp_path = None
+        try:
+            # mkstemp creates the file readable by its owner only
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.path),
+                prefix='.{}.'.format(os.path.basename(self.path)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': self.key, 'token': token,
+                           'expires': expires}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            hookenv.log("Unable to write token cache {}: {}"
+                        .format(self.path, str(e)), level=hookenv.WARNING)
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def invalidate(self):
+        """Remove the cached token"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            hookenv.log("Unable to remove token cache {}: {}"
+                        .format(self.path, str(e)), level=hookenv.WARNING)
+
+
+class DesignateClient(object):
+    """Designate API client holding one authenticated, pooled session"""
+
+    def __init__(self, credentials, timeout=30, token_cache=None):
+        """
+        @param credentials: dict of OS_* variables as written to RC_FILE
+        @param timeout: per request timeout in seconds
+        @param token_cache: optional TokenCache to share tokens across hooks
+        """
+        self.credentials = credentials
+        self.timeout = timeout
+        self.token_cache = token_cache
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2,
+                                                pool_maxsize=10)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.token = None
+        self._auth_lock = threading.Lock()
+
+    @classmethod
+    def from_rc_file(cls, rc_file=RC_FILE, token_cache_file=None, **kwargs):
+        """Create a client using the credentials in rc_file
+
+        @param rc_file: path of the novarc style file to read
+        @param token_cache_file: path of the token cache, or None to disable
+        @returns DesignateClient
+        """
+        if token_cache_file:
+            with open(rc_file, 'rb') as f:
+                key = hashlib.sha256(f.read()).hexdigest()
+            kwargs['token_cache'] = TokenCache(key, path=token_cache_file)
+        return cls(get_environment({}, rc_file=rc_file), **kwargs)
+
+    @property
+    def endpoint(self):
+        return self.credentials['OS_DNS_ENDPOINT'].rstrip('/')
+
+    def _keystone_v3(self):
+        return (self.credentials.get('OS_IDENTITY_API_VERSION') == '3' or
+                self.credentials['OS_AUTH_URL'].rstrip('/').endswith('/v3'))
+
+    def authenticate(self, use_cache=True):
+        """Fetch a project scoped token, from the token cache if possible
+
+        @param use_cache: False to always ask Keystone for a new token
+        @returns str token
+        @raises DesignateAPIError
+        """
+        if use_cache and self.token_cache:
+            self.token = self.token_cache.get()
+            if self.token:
+                return self.token
+        creds = self.credentials
+        auth_url = creds['OS_AUTH_URL'].rstrip('/')
+        if self._keystone_v3():
+            body = {'auth': {
+                'identity': {
+                    'methods': ['password'],
+                    'password': {'user': {
+                        'name': creds['OS_USERNAME'],
+                        'password': creds['OS_PASSWORD'],
+                        'domain': {'name': creds.get('OS_USER_DOMAIN_NAME',
+                                                     'default')},
+                    }},
+                },
+                'scope': {'project': {
+                    'name': creds['OS_PROJECT_NAME'],
+                    'domain': {'name': creds.get('OS_PROJECT_DOMAIN_NAME',
+                                                 'default')},
+                }},
+            }}
+            resp = self._send('POST', auth_url + '/auth/tokens', json=body)
+            self.token = resp.headers['X-Subject-Token']
+            expires = resp.json()['token']['expires_at']
+        else:
+            body = {'auth': {
+                'tenantName': creds['OS_TENANT_NAME'],
+                'passwordCredentials': {
+                    'username': creds['OS_USERNAME'],
+                    'password': creds['OS_PASSWORD'],
+                },
+            }}
+            resp = self._send('POST', auth_url + '/tokens', json=body)
+            self.token = resp.json()['access']['token']['id']
+            expires = resp.json()['access']['token']['expires']
+        if self.token_cache:
+            self.token_cache.set(self.token, _parse_expiry(expires))
+        return self.token
+
+    def run_concurrently(self, calls, limit=MAX_IN_FLIGHT):
+        """Run blocking API calls concurrently with at most limit in flight
+
+        @param calls: list of callables taking no arguments
+        @param limit: maximum number of calls running at once
+        @returns list with each call's return value, or the exception it
+                 raised, in the order of calls
+        """
+        async def _run(semaphore, call):
+            async with semaphore:
+                return await asyncio.to_thread(call)
+
+        async def _run_all():
+            semaphore = asyncio.Semaphore(limit)
+            return await asyncio.gather(
+                *[_run(semaphore, call) for call in calls],
+                return_exceptions=True)
+
+        if not calls:
+            return []
+        # authenticate up front rather than racing to do it in every thread
+        with self._auth_lock:
+            if self.token is None:
+                self.authenticate()
+        return asyncio.run(_run_all())
+
+    def _send(self, method, url, **kwargs):
+        try:
+            resp = self.session.request(method, url, timeout=self.timeout,
+                                        **kwargs)
+        except requests.RequestException as e:
+            raise DesignateAPIError(
+                "{} {} failed: {}".format(method, url, str(e)))
+        if resp.status_code >= 400:
+            raise DesignateAPIError(
+                "{} {} failed, status code {} body {}".format(
+                    method, url, resp.status_code, resp.text),
+                status_code=resp.status_code)
+        return resp
+
+    def request(self, method, path, **kwargs):
+        """Make an authenticated request against the Designate API
+
+        A token that Keystone has revoked or expired is refreshed once.
+        Concurrent requests that are refused with the same token share a
+        single refresh.
+
+        @param method: HTTP method
+        @param path: path relative to the designate endpoint
+        @returns requests.Response
+        @raises DesignateAPIError
+        """
+        with self._auth_lock:
+            if self.token is None:
+                self.authenticate()
+            token = self.token
+        url = self.endpoint + path
+        headers = kwargs.pop('headers', {})
+        headers['X-Auth-Token'] = token
+        try:
+            return self._send(method, url, headers=headers, **kwargs)
+        except DesignateAPIError as e:
+            if e.status_code != 401:
+                raise
+        with self._auth_lock:
+            # another request may have refreshed the token meanwhile
+            if self.token == token:
+                if self.token_cache:
+                    self.token_cache.invalidate()
+                self.authenticate(use_cache=False)
+            headers['X-Auth-Token'] = self.token
+        return self._send(method, url, headers=headers, **kwargs)
+
+    def healthcheck(self):
+        """Check the API's unauthenticated /healthcheck endpoint
+
+        @raises DesignateAPIError if the API is not healthy
+        """
+        self._send('GET', self.endpoint + '/healthcheck')
+
+    def check_ready(self):
+        """Check the API can serve requests that go through designate-central
+
+        /healthcheck answers as soon as designate-api is up, before central
+        or the message bus are, so a single zone is listed as well.
+
+        @raises DesignateAPIError if the API cannot serve requests yet
+        """
+        self.healthcheck()
+        self.request('GET', ZONES_PATH, params={'limit': 1})
+
+    def iter_zones(self, limit=PAGE_LIMIT, **filters):
+        """Yield the zones visible to the charm's project page by page
+
+        Each page is parsed and released before the next one is requested,
+        so memory use is bounded by the page size rather than by the number
+        of zones in the cloud.
+
+        @param limit: number of zones to request per page
+        @param filters: server side filters, e.g. name='example.com.'
+        @returns generator of zone dicts
+        """
+        params = dict(filters, limit=limit)
+        while True:
+            page = self.request('GET', ZONES_PATH, params=params).json()
+            for zone in page.get('zones', []):
+                yield zone
+            next_link = page.get('links', {}).get('next')
+            if not next_link:
+                return
+            # The next link is built from api_base_uri, which is usually the
+            # public endpoint, so only reuse its query string.
+            query = urllib.parse.urlparse(next_link).query
+            params = dict(urllib.parse.parse_qsl(query))
+
+    def get_zones(self):
+        """Return all zones visible to the charm's project
+
+        @returns dict {zone_name: {'id': zone_id, 'serial': serial}, ...}
+        """
+        zones = {}
+        for zone in self.iter_zones():
+            zones[zone['name']] = {
+                'id': zone['id'],
+                'serial': zone['serial'],
+            }
+        return zones
+
+    def get_zone_id(self, zone_name):
+        """Return the ID of zone_name or None if it does not exist
+
+        The lookup uses the API's name filter so its cost does not depend on
+        how many zones exist.
+        """
+        for zone in self.iter_zones(limit=1, name=zone_name):
+            if zone['name'] == zone_name:
+                return zone['id']
+        return None
+
+    def create_zone(self, zone_name, email):
+        """Create zone_name unless it already exists
+
+        @param zone_name: fully qualified zone name, ending with a full stop
+        @param email: email address of the person responsible for the zone
+        @returns str zone id
+        """
+        zone_id = self.get_zone_id(zone_name)
+        if zone_id:
+            return zone_id
+        resp = self.request('POST', ZONES_PATH,
+                            json={'name': zone_name, 'email': email})
+        return resp.json()['id']
+
+    def delete_zone(self, zone_name):
+        """Delete zone_name if it exists
+
+        @param zone_name: fully qualified zone name, ending with a full stop
+        @returns None
+        """
+        zone_id = self.get_zone_id(zone_name)
+        if zone_id:
+            self.request('DELETE', '{}/{}'.format(ZONES_PATH, zone_id))
+
+    def get_servers(self):
+        """Return the NS servers known to designate
+
+        @returns dict {server_name: {'id': server_id}, ...}
+        """
+        servers = {}
+        for server in self.request('GET', SERVERS_PATH).json()['servers']:
+            servers[server['name']] = {'id': server['id']}
+        return servers
+
+    def get_server_id(self, server_name):
+        """Return the ID of server_name or None if it does not exist"""
+        server = self.get_servers().get(server_name)
+        if server:
+            return server['id']
+        return None
+
+    def create_server(self, server_name):
+        """Create the NS server server_name unless it already exists
+
+        @param server_name: fully qualified name of the NS server
+        @returns str server id
+        """
+        server_id = self.get_server_id(server_name)
+        if server_id:
+            return server_id
+        resp = self.request('POST', SERVERS_PATH, json={'name': server_name})
+        return resp.json()['id']
+
+    def get_zone_ids(self, zone_names):
+        """Look up several zones concurrently
+
+        @param zone_names: list of zone names
+        @returns dict {zone_name: zone_id or None}
+        @raises DesignateAPIError if any lookup failed
+        """
+        results = self.run_concurrently(
+            [lambda n=name: self.get_zone_id(n) for name in zone_names])
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return dict(zip(zone_names, results))
+
+    def _provision_server(self, name):
+        resp = self.request('POST', SERVERS_PATH, json={'name': name})
+        return ProvisionResult('server', name, resp.json()['id'], 'created',
+                               None)
+
+    def _provision_zone(self, name, email):
+        zone_id = self.get_zone_id(name)
+        if zone_id:
+            return ProvisionResult('zone', name, zone_id, 'exists', None)
+        resp = self.request('POST', ZONES_PATH,
+                            json={'name': name, 'email': email})
+        return ProvisionResult('zone', name, resp.json()['id'], 'created',
+                               None)
+
+    def ensure_servers_and_zones(self, servers, zones):
+        """Create whichever of servers and zones do not exist yet
+
+        The existing servers are read with a single listing and each zone is
+        checked with a name filtered lookup, then only the missing items are
+        created.  A failure on one item does not stop the others.
+
+        Servers are created one at a time in the order given: each create
+        rewrites the default pool's NS records, so concurrent creates could
+        lose records, and the order sets the NS priority and the SOA MNAME.
+        Zones are independent, so they are provisioned concurrently.
+
+        @param servers: list of fully qualified NS server names
+        @param zones: list of (zone_name, email) tuples
+        @returns list of ProvisionResult, servers first, in the order given
+        """
+        existing = self.get_servers()
+        results = []
+        for name in servers:
+            if name in existing:
+                results.append(ProvisionResult(
+                    'server', name, existing[name]['id'], 'exists', None))
+                continue
+            try:
+                results.append(self._provision_server(name))
+            except DesignateAPIError as e:
+                results.append(ProvisionResult('server', name, None,
+                                               'failed', str(e)))
+        calls = [lambda n=name, e=email: self._provision_zone(n, e)
+                 for name, email in zones]
+        for (name, _), result in zip(zones, self.run_concurrently(calls)):
+            if isinstance(result, Exception):
+                result = ProvisionResult('zone', name, None, 'failed',
+                                         str(result))
+            results.append(result)
+        return results
+
+
+class ReadinessProbe(object):
+    """Wait for the API to become healthy within a per-hook time budget
+
+    The budget starts on the first call to wait() and is shared by every
+    later call, and once the API has answered it is not probed again.
+    """
+
+    def __init__(self, budget=READINESS_BUDGET, base_delay=1, max_delay=30):
+        self.budget = budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = None
+        self.ready = False
+
+    def wait(self, client):
+        """Return once client.check_ready() succeeds
+
+        Transient failures, where the API did not answer or answered with
+        a 5xx, are retried with exponential backoff and full jitter until
+        the budget runs out.  Any other error is raised straight away.
+
+        @param client: DesignateClient to probe
+        @returns number of failed checks before the API answered
+        @raises DesignateAPIError if the budget is exhausted
+        """
+        if self.ready:
+            return 0
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.budget
+        attempt = 0
+        while True:
+            try:
+                client.check_ready()
+                self.ready = True
+                return attempt
+            except DesignateAPIError as e:
+                if not e.transient:
+                    raise
+                remaining = self.deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DesignateAPIError(
+                        "API not healthy within {}s: {}".format(
+                            self.budget, str(e)))
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            time.sleep(min(random.uniform(0, delay), remaining))
+            attempt += 1
+
+
+class HealthcheckEndpoint(object):
+    """The /healthcheck of a single API instance, e.g. the local unit's
+
+    It can be passed to ReadinessProbe.wait() in place of a client.
+
+    @param url: full URL of the /healthcheck endpoint
+    @param timeout: seconds to wait for each response
+    """
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def check_ready(self):
+        """Check the endpoint
+
+        @raises DesignateAPIError if the API is not healthy
+        """
+        try:
+            resp = requests.get(self.url, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise DesignateAPIError(
+                "GET {} failed: {}".format(self.url, str(e)))
+        if resp.status_code >= 400:
+            raise DesignateAPIError(
+                "GET {} failed, status code {}".format(
+                    self.url, resp.status_code),
+                status_code=resp.status_code)
+
+
+_probe = ReadinessProbe()
+
+
+def wait_until_ready(client):
+    """Wait for the API behind client using the hook's shared probe
+
+    @param client: DesignateClient to probe
+    @returns number of failed checks before the API answered
+    @raises DesignateAPIError if the hook's budget is exhausted
+    """
+    return _probe.wait(client)
+
+
+def get_client(rc_file=RC_FILE):
+    """Return the client for rc_file, creating it on first use
+
+    The client, and therefore its token and connection pool, is shared by
+    every caller for the rest of the hook.  Its token is also cached in
+    TOKEN_CACHE_FILE so later hooks can reuse it until it nears expiry.
+
+    @param rc_file: path of the novarc style file to read
+    @returns DesignateClient
+    """
+    if rc_file not in _clients:
+        _clients[rc_file] = DesignateClient.from_rc_file(
+            rc_file, token_cache_file=TOKEN_CACHE_FILE)
+    return _clients[rc_file]
@@ -0,0 +1,239 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in timing of reactive handlers and the commands they run.
+
+When config('hook-metrics') is set, every handler wrapped with timed() and
+every command run through check_call() appends one JSON object per line to
+METRICS_FILE.  Each record carries the Juju context id of the hook that
+produced it so that summarise() can group records by hook invocation.
+"""
+
+import collections
+import contextlib
+import functools
+import json
+import os
+import subprocess
+import time
+
+import charmhelpers.core.hookenv as hookenv
+import charms.reactive.bus as bus
+
+METRICS_FILE = '/var/log/designate-charm/hook-metrics.jsonl'
+MAX_FILE_SIZE = 1024 * 1024
+
+HANDLER = 'handler'
+COMMAND = 'command'
+API = 'api'
+
+
+def enabled():
+    """Whether hook metrics have been switched on by the operator
+
+    @returns boolean
+    """
+    return hookenv.config('hook-metrics') is True
+
+
+def _context_id():
+    return os.environ.get('JUJU_CONTEXT_ID',
+                          os.environ.get('JUJU_HOOK_NAME', 'unknown'))
+
+
+def _rotate(path, max_size):
+    try:
+        if os.path.getsize(path) >= max_size:
+            os.replace(path, path + '.1')
+    except FileNotFoundError:
+        pass
+
+
+def write_record(record, path=METRICS_FILE, max_size=MAX_FILE_SIZE):
+    """Append record to the metrics file, rotating it once it is full
+
+    Metrics are diagnostic only, so a failure to write them is logged and
+    otherwise ignored.
+
+    @param record: dict to serialise as one JSON line
+    @param path: metrics file to append to
+    @param max_size: size in bytes at which path is moved to path.1
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _rotate(path, max_size)
+        with open(path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+    except OSError as e:
+        hookenv.log("Unable to write hook metrics to {}: {}"
+                    .format(path, str(e)), level=hookenv.WARNING)
+
+
+@contextlib.contextmanager
+def record(kind, name):
+    """Time the body of the with statement and write it as a record
+
+    The yielded dict is written once the body finishes, so callers may add
+    to it, e.g. to set 'retries'.  'status' is 'ok', or the name of the
+    exception that escaped the body, unless the caller has set it already.
+    Nothing is recorded unless enabled() is True.
+
+    @param kind: one of HANDLER, COMMAND or API
+    @param name: handler name or command line
+    @returns context manager yielding the record dict
+    """
+    entry = {'kind': kind, 'name': name, 'retries': 0}
+    if not enabled():
+        yield entry
+        return
+    entry['hook'] = _context_id()
+    entry['start'] = time.time()
+    started = time.monotonic()
+    try:
+        yield entry
+    except BaseException as e:
+        entry.setdefault('status', type(e).__name__)
+        raise
+    finally:
+        entry.setdefault('status', 'ok')
+        entry['duration'] = round(time.monotonic() - started, 6)
+        write_record(entry)
+
+
+def timed(f):
+    """Decorator that records the run time of a reactive handler
+
+    It must be applied beneath the charms.reactive decorators.  The wrapper
+    takes over the handler identity of f so that charms.reactive still
+    registers each handler separately.
+
+    @param f: handler function
+    @returns wrapped handler
+    """
+    @functools.wraps(f)
+    def _timed(*args, **kwargs):
+        with record(HANDLER, f.__name__):
+            return f(*args, **kwargs)
+    # charms.reactive has no public way to name a handler, so its private
+    # helpers are used; they honour these attributes when they are set.
+    # test_reactive_bus_helpers fails if a charms.reactive upgrade drops
+    # them.
+    _timed._action_id = bus._action_id(f)
+    _timed._short_action_id = bus._short_action_id(f)
+    return _timed
+
+
+def check_call(cmd, **kwargs):
+    """subprocess.check_call() that records the command's run time
+
+    The exit status is recorded as the command's return code, or 'timeout'
+    if it was killed for overrunning.
+
+    @param cmd: list of command line arguments
+    @param kwargs: passed through to subprocess.check_call()
+    @raises subprocess.CalledProcessError, subprocess.TimeoutExpired
+    """
+    with record(COMMAND, ' '.join(cmd)) as entry:
+        try:
+            subprocess.check_call(cmd, **kwargs)
+            entry['status'] = 0
+        except subprocess.CalledProcessError as e:
+            entry['status'] = e.returncode
+            raise
+        except subprocess.TimeoutExpired:
+            entry['status'] = 'timeout'
+            raise
+
+
+def read_records(path=METRICS_FILE):
+    """Read all records, oldest first, from path and its rotated backup
+
+    Lines that are not valid JSON (e.g. a write cut short) are skipped.
+
+    @param path: metrics file
+    @returns list of dicts
+    """
+    records = []
+    for name in (path + '.1', path):
+        try:
+            with open(name) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
+    return records
+
+
+def summarise(records, hooks=10, limit=5):
+    """Find the slowest handlers and commands over the most recent hooks
+
+    @param records: list of record dicts as returned by read_records()
+    @param hooks: number of most recent hook invocations to consider
+    @param limit: number of entries to return for each kind
+    @returns dict of kind -> list of dicts with name, count, total, max,
+             failures and retries, slowest (by total time) first
+    """
+    recent = []
+    for entry in reversed(records):
+        if entry.get('hook') not in recent:
+            if len(recent) == hooks:
+                break
+            recent.append(entry.get('hook'))
+    recent = set(recent)
+
+    stats = collections.OrderedDict()
+    for entry in records:
+        if entry.get('hook') not in recent:
+            continue
+        key = (entry.get('kind'), entry.get('name'))
+        if key not in stats:
+            stats[key] = {'name': entry.get('name'), 'count': 0,
+                          'total': 0.0, 'max': 0.0, 'failures': 0,
+                          'retries': 0}
+        item = stats[key]
+        duration = entry.get('duration', 0.0)
+        item['count'] += 1
+        item['total'] += duration
+        item['max'] = max(item['max'], duration)
+        item['retries'] += entry.get('retries', 0)
+        if entry.get('status') not in ('ok', 0):
+            item['failures'] += 1
+
+    summary = {}
+    for (kind, _), item in stats.items():
+        item['total'] = round(item['total'], 3)
+        item['max'] = round(item['max'], 3)
+        summary.setdefault(kind, []).append(item)
+    for kind, items in summary.items():
+        items.sort(key=lambda i: i['total'], reverse=True)
+        del items[limit:]
+    return summary
+
+
+def format_summary(summary):
+    """Render the output of summarise() as lines of text per kind
+
+    @param summary: dict as returned by summarise()
+    @returns dict of kind -> multi-line string
+    """
+    output = {}
+    for kind, items in summary.items():
+        output[kind] = '\n'.join(
+            "{total:9.3f}s total {max:9.3f}s max {count:4d} runs "
+            "{failures:3d} failed {retries:3d} retries  {name}"
+            .format(**item) for item in items)
+    return output
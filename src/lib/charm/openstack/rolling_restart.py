@@ -0,0 +1,191 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Leader-coordinated rolling restarts across the peers of an application.
+
+A unit with services to restart queues them locally and publishes a
+restart request on the cluster relation.  The leader grants one request at
+a time through the 'restart-slot' leader setting.  The unit holding the
+slot restarts its services and reports the request done on the cluster
+relation once its API answers /healthcheck again; only then does the leader
+grant the next slot.
+"""
+
+import json
+import uuid
+
+import charmhelpers.core.hookenv as hookenv
+import charmhelpers.core.unitdata as unitdata
+
+RELATION = 'cluster'
+SLOT_KEY = 'restart-slot'
+REQUEST_KEY = 'restart-request'
+DONE_KEY = 'restart-done'
+
+_PENDING = 'rolling-restart.pending'
+_REQUEST = 'rolling-restart.request'
+_RESTARTED = 'rolling-restart.restarted'
+
+
+def _relation_id():
+    rids = hookenv.relation_ids(RELATION)
+    return rids[0] if rids else None
+
+
+def has_peers():
+    """Whether there are peers to coordinate restarts with
+
+    @returns boolean
+    """
+    rid = _relation_id()
+    return bool(rid and hookenv.related_units(rid))
+
+
+def request(services):
+    """Queue services for restart and ask the leader for a slot
+
+    Services queued while a request is outstanding are added to it, and
+    restarted again if the request's restart has already happened.
+
+    @param services: list of service names
+    """
+    kv = unitdata.kv()
+    pending = kv.get(_PENDING) or []
+    added = [s for s in services if s not in pending]
+    pending.extend(added)
+    kv.set(_PENDING, pending)
+    nonce = kv.get(_REQUEST)
+    if not nonce:
+        nonce = str(uuid.uuid4())
+        kv.set(_REQUEST, nonce)
+    if added:
+        # restart again if the queue grew after the last restart
+        kv.unset(_RESTARTED)
+    kv.flush()
+    rid = _relation_id()
+    if rid:
+        hookenv.relation_set(relation_id=rid,
+                             relation_settings={REQUEST_KEY: nonce})
+    hookenv.log("Queued rolling restart of {} as request {}"
+                .format(', '.join(pending), nonce), level=hookenv.DEBUG)
+
+
+def pending():
+    """Services queued for restart on this unit
+
+    @returns list of service names
+    """
+    return unitdata.kv().get(_PENDING) or []
+
+
+def current_slot():
+    """The request currently allowed to restart
+
+    @returns dict {'unit': unit name, 'request': nonce} or None
+    """
+    slot = hookenv.leader_get(SLOT_KEY)
+    return json.loads(slot) if slot else None
+
+
+def outstanding_requests():
+    """Restart requests that have not been reported done, by unit
+
+    @returns dict {unit name: nonce}
+    """
+    rid = _relation_id()
+    if not rid:
+        return {}
+    requests = {}
+    for unit in [hookenv.local_unit()] + hookenv.related_units(rid):
+        data = hookenv.relation_get(rid=rid, unit=unit) or {}
+        nonce = data.get(REQUEST_KEY)
+        if nonce and nonce != data.get(DONE_KEY):
+            requests[unit] = nonce
+    return requests
+
+
+def _unit_key(unit):
+    name, _, number = unit.rpartition('/')
+    return (name, int(number) if number.isdigit() else number)
+
+
+def grant_next_slot():
+    """Hand the restart slot to the next requesting unit (leader only)
+
+    The slot is only moved on once its holder has reported its request
+    done or has left the relation.  Units are served in unit number
+    order, starting after the previous holder.
+
+    @returns dict the current slot, or None if no unit is waiting
+    """
+    slot = current_slot()
+    requests = outstanding_requests()
+    if slot and requests.get(slot['unit']) == slot['request']:
+        return slot
+    if not requests:
+        if slot:
+            hookenv.leader_set({SLOT_KEY: None})
+        return None
+    units = sorted(requests, key=_unit_key)
+    if slot:
+        later = [u for u in units
+                 if _unit_key(u) > _unit_key(slot['unit'])]
+        units = later or units
+    slot = {'unit': units[0], 'request': requests[units[0]]}
+    hookenv.log("Granting restart slot to {} for request {}"
+                .format(slot['unit'], slot['request']), level=hookenv.INFO)
+    hookenv.leader_set({SLOT_KEY: json.dumps(slot, sort_keys=True)})
+    return slot
+
+
+def holds_slot():
+    """Whether this unit's outstanding request holds the restart slot
+
+    @returns boolean
+    """
+    nonce = unitdata.kv().get(_REQUEST)
+    slot = current_slot()
+    return bool(nonce and slot and slot['unit'] == hookenv.local_unit() and
+                slot['request'] == nonce)
+
+
+def restarted():
+    """Whether the services have been restarted for the current request
+
+    @returns boolean
+    """
+    kv = unitdata.kv()
+    return bool(kv.get(_REQUEST)) and kv.get(_RESTARTED) == kv.get(_REQUEST)
+
+
+def mark_restarted():
+    """Record that the services have been restarted for the request"""
+    kv = unitdata.kv()
+    kv.set(_RESTARTED, kv.get(_REQUEST))
+    kv.flush()
+
+
+def complete():
+    """Report the outstanding request done and clear the queue"""
+    kv = unitdata.kv()
+    nonce = kv.get(_REQUEST)
+    rid = _relation_id()
+    if nonce and rid:
+        hookenv.relation_set(relation_id=rid,
+                             relation_settings={DONE_KEY: nonce})
+    for key in (_PENDING, _REQUEST, _RESTARTED):
+        kv.unset(key)
+    kv.flush()
+    hookenv.log("Rolling restart request {} done".format(nonce),
+                level=hookenv.INFO)
@@ -15,6 +15,8 @@
 import subprocess
 
 import charm.openstack.designate as designate
+import charm.openstack.designate_api as designate_api
+import charm.openstack.hook_metrics as hook_metrics
 import charms.reactive as reactive
 import charms.reactive.relations as relations
 import charmhelpers.core.hookenv as hookenv
@@ -44,6 +46,7 @@ COMPLETE_INTERFACE_STATES = [
 
 
 @reactive.hook('config-changed')
+@hook_metrics.timed
 def check_dns_slaves():
     """verify if the config('dns-slaves') is valid and set or remove the state
     accordingly.  Note, that hooks run BEFORE the reactive handlers so this
@@ -62,17 +65,20 @@ def check_dns_slaves():
 @reactive.when_not('is-update-status-hook')
 @reactive.when_any('dns-slaves-config-valid',
                    'dns-backend.available')
+@hook_metrics.timed
 def set_dns_config_available(*args):
     reactive.set_state(DNS_CONFIG_AVAILABLE)
 
 
 @reactive.when_none('dns-slaves-config-valid',
                     'dns-backend.available')
+@hook_metrics.timed
 def clear_dns_config_available():
     reactive.remove_state(DNS_CONFIG_AVAILABLE)
 
 
 @reactive.when_not('installed')
+@hook_metrics.timed
 def install_packages():
     """Install charms packages"""
     with charm.provide_charm_instance() as instance:
@@ -86,6 +92,7 @@ def install_packages():
 
 @reactive.when_not('is-update-status-hook')
 @reactive.when('amqp.connected')
+@hook_metrics.timed
 def setup_amqp_req(amqp):
     """Send request for rabbit access and vhost"""
     amqp.request_access(username='designate',
@@ -94,6 +101,7 @@ def setup_amqp_req(amqp):
 
 @reactive.when('base-config.rendered')
 @reactive.when_not('config.rendered')
+@hook_metrics.timed
 def config_rendered():
     """Set the config.rendered state when ready for operation.
 
@@ -110,6 +118,7 @@ def config_rendered():
 @reactive.when_not('is-update-status-hook')
 @reactive.when_none('charm.paused')
 @reactive.when('config.rendered', 'base-config.rendered')
+@hook_metrics.timed
 def start_designate_services():
     """Enable services when database is synchronized"""
     with charm.provide_charm_instance() as instance:
@@ -122,6 +131,7 @@ def start_designate_services():
 
 @reactive.when('shared-db.connected')
 @reactive.when_not('shared-db.setup')
+@hook_metrics.timed
 def setup_database(database):
     """Send request designate accounts and dbs"""
     hostname = None
@@ -137,6 +147,7 @@ def setup_database(database):
 
 @reactive.when_not('is-update-status-hook')
 @reactive.when('identity-service.connected')
+@hook_metrics.timed
 def maybe_setup_endpoint(keystone):
     """When the keystone interface connects, register this unit in the keystone
     catalogue.
@@ -152,13 +163,26 @@ def maybe_setup_endpoint(keystone):
 
 @reactive.when_not('is-update-status-hook')
 @reactive.when('cluster.connected')
+@hook_metrics.timed
 def expose_rndc_address(cluster):
     rndc_address = ip.get_relation_ip('dns-backend')
     cluster.set_address('rndc', rndc_address)
 
 
+@reactive.when('cluster.connected')
+@hook_metrics.timed
+def process_rolling_restarts(cluster):
+    """Hand out restart slots on the leader and restart when it is our turn.
+    Runs in every hook so that a unit still waiting for its API to become
+    healthy after its restart keeps checking.
+    """
+    with charm.provide_charm_instance() as instance:
+        instance.process_rolling_restarts()
+
+
 @reactive.when_not('base-config.rendered')
 @reactive.when(*COMPLETE_INTERFACE_STATES)
+@hook_metrics.timed
 def configure_designate_basic(*args):
     """Configure the minimum to bootstrap designate"""
     # If cluster relation is available it needs to passed in
@@ -177,6 +201,7 @@ def configure_designate_basic(*args):
 @reactive.when_not('db.synched')
 @reactive.when('base-config.rendered')
 @reactive.when(*COMPLETE_INTERFACE_STATES)
+@hook_metrics.timed
 def run_db_migration(*args):
     """Run database migrations"""
     with charm.provide_charm_instance() as instance:
@@ -188,6 +213,7 @@ def run_db_migration(*args):
 @reactive.when_not('pool-manager-cache.synched')
 @reactive.when('base-config.rendered')
 @reactive.when(*COMPLETE_INTERFACE_STATES)
+@hook_metrics.timed
 def sync_pool_manager_cache(*args):
     with charm.provide_charm_instance() as instance:
         instance.pool_manager_cache_sync()
@@ -199,6 +225,7 @@ def sync_pool_manager_cache(*args):
 @reactive.when('db.synched')
 @reactive.when('pool-manager-cache.synched')
 @reactive.when(*COMPLETE_INTERFACE_STATES)
+@hook_metrics.timed
 def configure_designate_full(*args):
     """Write out all designate config include bootstrap domain info"""
     # If cluster relation is available it needs to passed in
@@ -229,10 +256,12 @@ def configure_designate_full(*args):
             # the following function should only run once for the leader.
             if instance.configure_sink():
                 instance.create_initial_servers_and_domains()
+                instance.ensure_domain_ids_published()
                 _render_sink_configs(instance, args)
             instance.render_rndc_keys()
             instance.update_pools()
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError,
+                designate_api.DesignateAPIError) as e:
             hookenv.log("ensure_api_responding() errored out: {}"
                         .format(str(e)),
                         level=hookenv.ERROR)
@@ -242,13 +271,13 @@ def configure_designate_full(*args):
 @reactive.when('dns-backend.available')
 @reactive.when('db.synched')
 @reactive.when(*COMPLETE_INTERFACE_STATES)
+@hook_metrics.timed
 def configure_dns_backend_rndc_keys(*args):
-    """Write the dns-backend relation configuration files and restart
-    designate-worker to apply the new config.
+    """Write the dns-backend relation rndc keys, restarting designate-worker
+    only if they changed.
     """
     with charm.provide_charm_instance() as instance:
-        instance.render_relation_rndc_keys()
-    host.service_restart('designate-worker')
+        instance.render_rndc_keys()
 
 
 def _render_sink_configs(instance, interfaces_list):
@@ -266,6 +295,7 @@ def _render_sink_configs(instance, interfaces_list):
 
 @reactive.when_not('is-update-status-hook')
 @reactive.when('ha.connected')
+@hook_metrics.timed
 def cluster_connected(hacluster):
     """Configure HA resources in corosync"""
     with charm.provide_charm_instance() as instance:
@@ -274,6 +304,7 @@ def cluster_connected(hacluster):
 
 @reactive.when_not('is-update-status-hook')
 @reactive.when('dnsaas.connected')
+@hook_metrics.timed
 def expose_endpoint(endpoint):
     with charm.provide_charm_instance() as instance:
         if hookenv.config('use-internal-endpoints'):
@@ -283,6 +314,7 @@ def expose_endpoint(endpoint):
 
 
 @reactive.when_not('dont-set-assess-status')
+@hook_metrics.timed
 def run_assess_status_on_every_hook():
     """The call to charm instance.assess_status() sets up the assess status
     functionality to be called atexit() of the charm.  i.e. as the last thing
@@ -293,7 +325,18 @@ def run_assess_status_on_every_hook():
         instance.assess_status()
 
 
+@reactive.when('leadership.is_leader')
+@reactive.when_not('leadership.set.{}'.format(
+    designate.TOKEN_CACHE_SECRET_KEY))
+@hook_metrics.timed
+def generate_token_cache_secret():
+    """Generate the key the units protect their cached tokens with"""
+    with charm.provide_charm_instance() as instance:
+        instance.ensure_token_cache_secret()
+
+
 @reactive.when('leadership.changed.pool-yaml-hash')
+@hook_metrics.timed
 def remote_pools_updated():
     hookenv.log(
         "Pools updated on remote host, restarting pool manager",
@@ -302,6 +345,7 @@ def remote_pools_updated():
 
 
 @reactive.when_file_changed(designate.POOLS_YAML)
+@hook_metrics.timed
 def local_pools_updated():
     hookenv.log(
         "Pools updated locally, restarting pool manager",
@@ -311,6 +355,7 @@ def local_pools_updated():
 
 @reactive.when('shared-db.setup')
 @reactive.when_not('shared-db.connected')
+@hook_metrics.timed
 def reset_shared_db():
     """Clear flags on shared-db departed.
 
@@ -329,6 +374,7 @@ def reset_shared_db():
                    'config.changed.nrpe-nameserver-check-host',
                    'endpoint.nrpe-external-master.changed',
                    'nrpe-external-master.available')
+@hook_metrics.timed
 def configure_nrpe():
     """Handle config-changed for NRPE options."""
     with charm.provide_charm_instance() as charm_instance:
@@ -16,37 +16,24 @@
 
 import argparse
 import os
-import subprocess
+import sys
 
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'lib'))
 
-def display(msg):
-    print(msg)
+import charm.openstack.designate_api as designate_api
 
 
-def run_command(cmd):
-    os_env = get_environment(os.environ.copy())
-    p = subprocess.Popen(cmd, env=os_env, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    out, err = p.communicate()
-    if p.returncode != 0:
-        raise RuntimeError(
-            "{} failed, status code {} stdout {} stderr {}".format(
-                cmd, p.returncode, out, err))
-    return out, err
+def display(msg):
+    print(msg)
 
 
-def get_environment(env):
-    with open("/root/novarc", "r") as ins:
-        for line in ins:
-            k, v = line.replace('export', '').replace(" ", "").split('=')
-            env[k] = v.strip()
-    return env
+def get_client():
+    return designate_api.get_client(designate_api.RC_FILE)
 
 
 def get_server_id(server_name):
-    servers = get_servers()
-    if servers.get(server_name):
-        return servers[server_name]['id']
+    return get_client().get_server_id(server_name)
 
 
 def display_server_id(server_name):
@@ -56,9 +43,7 @@ def display_server_id(server_name):
 
 
 def get_domain_id(domain_name):
-    domains = get_domains()
-    if domains.get(domain_name):
-        return domains[domain_name]['id']
+    return get_client().get_zone_id(domain_name)
 
 
 def display_domain_id(domain_name):
@@ -68,69 +53,28 @@ def display_domain_id(domain_name):
 
 
 def create_server(server_name):
-    server_id = get_server_id(server_name)
-    if server_id:
-        return server_id
-    cmd = [
-        'designate', 'server-create',
-        '--name', server_name,
-        '-f', 'value',
-    ]
-    out, err = run_command(cmd)
-    display(get_server_id(server_name))
+    display(get_client().create_server(server_name))
 
 
 def create_domain(domain_name, domain_email):
-    domain_id = get_domain_id(domain_name)
-    if domain_id:
-        return domain_id
-    cmd = [
-        'designate', 'domain-create',
-        '--name', domain_name,
-        '--email', domain_email,
-        '-f', 'value',
-    ]
-    out, err = run_command(cmd)
-    display(get_domain_id(domain_name))
+    display(get_client().create_zone(domain_name, domain_email))
 
 
 def delete_domain(domain_name):
-    domain_id = get_domain_id(domain_name)
-    if domain_id:
-        cmd = ['domain-delete', domain_id]
-        run_command(cmd)
+    get_client().delete_zone(domain_name)
 
 
 def get_domains():
-    domains = {}
-    cmd = ['designate', 'domain-list', '-f', 'value']
-    out, err = run_command(cmd)
-    for line in out.decode('utf8').split('\n'):
-        values = line.split()
-        if values:
-            domains[values[1]] = {
-                'id': values[0],
-                'serial': values[2],
-            }
-    return domains
+    return get_client().get_zones()
 
 
 def get_servers():
-    servers = {}
-    cmd = ['designate', 'server-list', '-f', 'value']
-    out, err = run_command(cmd)
-    for line in out.decode('utf8').split('\n'):
-        values = line.split()
-        if values:
-            servers[values[1]] = {
-                'id': values[0],
-            }
-    return servers
+    return get_client().get_servers()
 
 
 def display_domains():
-    for domain in get_domains():
-        display(domain)
+    for domain in get_client().iter_zones():
+        display(domain['name'])
 
 
 def display_servers():
@@ -0,0 +1,94 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import unittest
+
+from unittest import mock
+
+sys.path.append('src/actions')
+import actions
+
+
+class TestActions(unittest.TestCase):
+
+    def setUp(self):
+        for attr in ('action_get', 'action_set', 'action_fail'):
+            patcher = mock.patch.object(actions.hookenv, attr)
+            setattr(self, attr, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.action_get.return_value = {'hooks': 3, 'limit': 2}
+
+    @mock.patch.object(actions.hook_metrics, 'read_records')
+    def test_hook_metrics_summary(self, read_records):
+        read_records.return_value = [
+            {'hook': 'h1', 'kind': 'command', 'name': 'cmd',
+             'duration': 2.0, 'status': 0, 'retries': 0}]
+        actions.main(['actions/hook-metrics-summary'])
+        self.action_set.assert_called_once_with({'command': mock.ANY})
+        self.assertIn('cmd', self.action_set.call_args[0][0]['command'])
+        self.assertFalse(self.action_fail.called)
+
+    @mock.patch.object(actions.hook_metrics, 'read_records')
+    def test_hook_metrics_summary_empty(self, read_records):
+        read_records.return_value = []
+        actions.main(['actions/hook-metrics-summary'])
+        self.action_set.assert_called_once_with(
+            {'output': 'No hook metrics have been recorded'})
+
+    @mock.patch.object(actions.hook_metrics, 'read_records')
+    def test_hook_metrics_summary_fails(self, read_records):
+        read_records.side_effect = PermissionError('denied')
+        actions.main(['actions/hook-metrics-summary'])
+        self.action_fail.assert_called_once_with('denied')
+
+    @mock.patch.object(actions.backend_check, 'check_targets')
+    @mock.patch.object(actions.charms_openstack.bus, 'discover')
+    @mock.patch.object(actions.charm, 'provide_charm_instance')
+    def test_check_backends(self, provide_charm_instance, discover,
+                            check_targets):
+        self.action_get.return_value = {'zone': '.', 'concurrency': 20,
+                                        'timeout': 5.0}
+        instance = mock.MagicMock()
+        instance.backend_targets.return_value = ['t1', 't2']
+        provide_charm_instance.return_value.__enter__.return_value = instance
+        check_targets.return_value = [
+            {'name': 'ns1', 'address': '10.0.0.1', 'rndc': 1.0, 'soa': 1.0,
+             'rcode': 'NOERROR', 'ok': True},
+            {'name': 'ns2', 'address': '10.0.0.2', 'rndc': 'refused',
+             'soa': 1.0, 'rcode': 'NOERROR', 'ok': False}]
+        actions.main(['actions/check-backends'])
+        check_targets.assert_called_once_with(
+            ['t1', 't2'], zone='.', concurrency=20, timeout=5.0)
+        self.action_set.assert_called_once_with(
+            {'output': mock.ANY, 'unreachable': 1})
+        self.action_fail.assert_called_once_with(
+            '1 of 2 DNS backends unreachable: ns2')
+
+    @mock.patch.object(actions.backend_check, 'check_targets')
+    @mock.patch.object(actions.charms_openstack.bus, 'discover')
+    @mock.patch.object(actions.charm, 'provide_charm_instance')
+    def test_check_backends_none(self, provide_charm_instance, discover,
+                                 check_targets):
+        instance = mock.MagicMock()
+        instance.backend_targets.return_value = []
+        provide_charm_instance.return_value.__enter__.return_value = instance
+        actions.main(['actions/check-backends'])
+        self.action_set.assert_called_once_with(
+            {'output': 'No DNS backends are configured'})
+        self.assertFalse(check_targets.called)
+
+    def test_unknown_action(self):
+        self.assertEqual(actions.main(['actions/foo']),
+                         'Action foo undefined')
@@ -25,6 +25,7 @@ class TestRegisteredHooks(test_utils.TestRegisteredHooks):
                 'start_designate_services': ('config.rendered',
                                              'base-config.rendered', ),
                 'expose_rndc_address': ('cluster.connected', ),
+                'process_rolling_restarts': ('cluster.connected', ),
                 'config_rendered': ('base-config.rendered', ),
                 'configure_ssl': ('identity-service.available', ),
                 'config_changed': ('config.changed', ),
@@ -42,6 +43,7 @@ class TestRegisteredHooks(test_utils.TestRegisteredHooks):
                 'expose_endpoint': ('dnsaas.connected', ),
                 'remote_pools_updated': (
                     'leadership.changed.pool-yaml-hash', ),
+                'generate_token_cache_secret': ('leadership.is_leader', ),
                 'reset_shared_db': ('shared-db.setup', ),
                 'configure_nrpe': ('base-config.rendered', ),
                 'configure_dns_backend_rndc_keys': (
@@ -68,6 +70,8 @@ class TestRegisteredHooks(test_utils.TestRegisteredHooks):
                 'expose_rndc_address': ('is-update-status-hook', ),
                 'cluster_connected': ('is-update-status-hook', ),
                 'configure_dns_backend_rndc_keys': ('is-update-status-hook', ),
+                'generate_token_cache_secret': (
+                    'leadership.set.token-cache-secret', ),
             },
             'when_any': {
                 'set_dns_config_available': (
@@ -215,6 +219,7 @@ class TestHandlers(test_utils.PatchHelper):
         the_charm.render_full_config.assert_called_once_with(
             ('arg1', 'arg2', ))
         the_charm.create_initial_servers_and_domains.assert_called_once_with()
+        the_charm.ensure_domain_ids_published.assert_called_once_with()
         the_charm.render_with_interfaces.assert_called_once_with(
             ('arg1', 'arg2'), configs=mock.ANY)
         the_charm.render_rndc_keys.assert_called_once_with()
@@ -223,8 +228,23 @@ class TestHandlers(test_utils.PatchHelper):
             ('arg1', 'arg2', ))
         the_charm.remove_obsolete_packages.assert_called_once_with()
 
+    def test_generate_token_cache_secret(self):
+        the_charm = self._patch_provide_charm_instance()
+        handlers.generate_token_cache_secret()
+        the_charm.ensure_token_cache_secret.assert_called_once_with()
+
+    def test_configure_dns_backend_rndc_keys(self):
+        the_charm = self._patch_provide_charm_instance()
+        handlers.configure_dns_backend_rndc_keys('arg1')
+        the_charm.render_rndc_keys.assert_called_once_with()
+
     def test_cluster_connected(self):
         the_charm = self._patch_provide_charm_instance()
         hacluster = mock.MagicMock()
         handlers.cluster_connected(hacluster)
         the_charm.configure_ha_resources.assert_called_once_with(hacluster)
+
+    def test_process_rolling_restarts(self):
+        the_charm = self._patch_provide_charm_instance()
+        handlers.process_rolling_restarts(mock.MagicMock())
+        the_charm.process_rolling_restarts.assert_called_once_with()
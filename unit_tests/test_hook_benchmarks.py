@@ -0,0 +1,561 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hook cost benchmarks.
+
+Drives the reactive handlers against in-memory fakes for hookenv, leader
+settings, relations, subprocesses, services and the designate API, and
+records the wall time and side effects of each handler while scaling the
+number of dns-backend units, cluster peers and zones.
+
+Files the handlers write, including the rendered configs, go to a scratch
+directory that lasts as long as the FakeEnvironment, so running a handler
+twice shows which writes are skipped when nothing changed.  'file-writes'
+counts the files whose content actually changed.
+
+The test cases assert budgets on the side effect counts so regressions in
+hook cost are caught by the unit tests.  For a timing report run, from the
+top of the tree:
+
+    python -m unit_tests.test_hook_benchmarks [--non-leader] [--mitaka]
+"""
+
+import collections
+import contextlib
+import hashlib
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import unittest
+import urllib.parse
+
+from unittest import mock
+
+import charm.openstack.designate as designate
+import charm.openstack.designate_api as designate_api
+import reactive.designate_handlers as handlers
+
+# (dns-backend units, cluster peers, zones)
+SCALES = [
+    (1, 0, 10),
+    (10, 2, 1000),
+    (50, 6, 20000),
+]
+
+HANDLERS = [
+    'configure_designate_basic',
+    'configure_designate_full',
+    'configure_dns_backend_rndc_keys',
+    'configure_nrpe',
+    'run_assess_status_on_every_hook',
+]
+
+REPEAT = 3
+
+# Adapter properties each config file is rendered from.  The fake render
+# writes their values, so a file only changes when its inputs do.
+RENDERED_PROPERTIES = collections.OrderedDict([
+    (designate.DESIGNATE_CONF,
+     ['pool_config', 'pool_targets', 'slave_addresses']),
+    (designate.POOLS_YAML,
+     ['all_pools', 'pool_config', 'rndc_master_ips', 'also_notifies_hosts',
+      'ns_records']),
+    (designate.NOVA_SINK_FILE, ['nova_domain_id']),
+    (designate.NEUTRON_SINK_FILE, ['neutron_domain_id']),
+])
+
+# the originals of what the benchmark patches
+_config_section_hashes = designate.config_section_hashes
+_RC_FILE = designate.RC_FILE
+
+
+def _file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class FakeConfig(dict):
+
+    def changed(self, key):
+        return False
+
+    def previous(self, key):
+        return self.get(key)
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code=200, json=None, headers=None):
+        self.status_code = status_code
+        self._json = json
+        self.headers = headers or {}
+        self.text = ''
+
+    def json(self):
+        return self._json
+
+
+class FakeDesignateAPI(object):
+    """Stands in for requests.Session, serving Keystone and Designate"""
+
+    def __init__(self, counters, zones):
+        self.counters = counters
+        self.zones = [{'id': 'zone-{}'.format(i),
+                       'name': 'zone{}.example.com.'.format(i),
+                       'serial': i} for i in range(zones)]
+        self.servers = []
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def request(self, method, url, params=None, json=None, **kwargs):
+        self.counters['api-requests'] += 1
+        path = urllib.parse.urlparse(url).path
+        if path.endswith('/auth/tokens'):
+            self.counters['keystone-auth'] += 1
+            return FakeResponse(201, headers={'X-Subject-Token': 'tok'},
+                                json={'token': {
+                                    'expires_at': '2099-01-01T00:00:00Z'}})
+        if path == '/healthcheck':
+            return FakeResponse(200)
+        if path == designate_api.SERVERS_PATH:
+            if method == 'POST':
+                self.servers.append({'id': json['name'],
+                                     'name': json['name']})
+                return FakeResponse(200, json={'id': json['name']})
+            return FakeResponse(200, json={'servers': list(self.servers)})
+        if path == designate_api.ZONES_PATH:
+            if method == 'POST':
+                zone = {'id': json['name'], 'name': json['name'],
+                        'serial': 1}
+                self.zones.append(zone)
+                return FakeResponse(202, json=zone)
+            return self._list_zones(dict(params or {}))
+        return FakeResponse(404)
+
+    def _list_zones(self, params):
+        limit = int(params.get('limit', designate_api.PAGE_LIMIT))
+        zones = self.zones
+        if 'name' in params:
+            zones = [z for z in zones if z['name'] == params['name']]
+        start = int(params.get('marker', 0))
+        page = zones[start:start + limit]
+        links = {}
+        if start + limit < len(zones):
+            links['next'] = 'http://public/v2/zones?limit={}&marker={}'.format(
+                limit, start + limit)
+        return FakeResponse(200, json={'zones': page, 'links': links})
+
+
+class FakeConversation(object):
+
+    def __init__(self, counters, scope):
+        self.counters = counters
+        self.scope = scope
+
+    def get_remote(self, key):
+        self.counters['relation-get'] += 1
+        return 'rndckey-{}'.format(self.scope)
+
+
+class FakeDNSBackend(object):
+
+    def __init__(self, counters, units):
+        self.counters = counters
+        self.units = ['designate-bind-{}/0'.format(i) for i in range(units)]
+
+    def conversations(self):
+        return [FakeConversation(self.counters, u) for u in self.units]
+
+    def slave_ips(self):
+        self.counters['relation-get'] += len(self.units)
+        return [{'unit': u, 'address': '10.1.0.{}'.format(i)}
+                for i, u in enumerate(self.units)]
+
+
+class FakeEnvironment(object):
+    """In-memory hook environment recording every side effect"""
+
+    def __init__(self, backend_units, peers, zones, leader=True,
+                 release='caracal'):
+        self.counters = collections.Counter()
+        self.leader = leader
+        self.release = release
+        self.peers = ['designate/{}'.format(i + 1) for i in range(peers)]
+        self.leader_data = {}
+        self.config = FakeConfig({
+            'dns-slaves': ' '.join(
+                '10.2.0.{0}:953:key{0}'.format(i)
+                for i in range(backend_units)),
+            'nameservers': 'ns1.example.com. ns2.example.com.',
+            'nova-domain': 'nova.example.com.',
+            'nova-domain-email': 'admin@example.com',
+            'neutron-domain': 'neutron.example.com.',
+            'neutron-domain-email': 'admin@example.com',
+            'also-notifies': '',
+            'nrpe-nameserver-check-host': 'canonical.com',
+            'ssl_param': None,
+        })
+        self.api = FakeDesignateAPI(self.counters, zones)
+        self.endpoints = {
+            'dns-backend.available': FakeDNSBackend(self.counters,
+                                                    backend_units),
+            'cluster.available': mock.MagicMock(),
+            'coordinator-memcached.available': mock.MagicMock(),
+        }
+        self.root = tempfile.mkdtemp()
+        with open(self.path(_RC_FILE), 'w') as f:
+            f.write('export OS_AUTH_URL=http://keystone:5000/v3\n'
+                    'export OS_USERNAME=designate\n'
+                    'export OS_PASSWORD=secret\n'
+                    'export OS_PROJECT_NAME=services\n'
+                    'export OS_IDENTITY_API_VERSION=3\n'
+                    'export OS_DNS_ENDPOINT=http://127.0.0.1:9001\n')
+
+    def close(self):
+        """Remove the scratch directory"""
+        shutil.rmtree(self.root)
+
+    # files
+    def path(self, path):
+        """Where path lives in the scratch directory"""
+        path = os.path.join(self.root, path.lstrip('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def file_hash(self, path):
+        self.counters['file-reads'] += 1
+        return _file_hash(self.path(path))
+
+    def snapshot(self):
+        """Hash of every file in the scratch directory"""
+        hashes = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                hashes[path] = _file_hash(path)
+        return hashes
+
+    # hookenv
+    def hookenv_config(self, key=None):
+        return self.config.get(key) if key else self.config
+
+    def is_leader(self):
+        return self.leader
+
+    def leader_get(self, attribute=None):
+        self.counters['leader-get'] += 1
+        if attribute:
+            return self.leader_data.get(attribute)
+        return dict(self.leader_data)
+
+    def leader_set(self, settings=None, **kwargs):
+        self.counters['leader-set'] += 1
+        self.leader_data.update(
+            {k: str(v) for k, v in dict(settings or {}, **kwargs).items()})
+
+    def relation_ids(self, reltype=None):
+        self.counters['relation-ids'] += 1
+        return ['{}:1'.format(reltype)]
+
+    def related_units(self, relid=None):
+        self.counters['related-units'] += 1
+        return list(self.peers)
+
+    def relation_get(self, attribute=None, unit=None, rid=None):
+        self.counters['relation-get'] += 1
+        return '10.0.0.{}'.format(unit.split('/')[1])
+
+    # relations
+    def endpoint_from_flag(self, flag):
+        return self.endpoints.get(flag)
+
+    # subprocess, files and services
+    def count(self, name, return_value=None):
+        def _count(*args, **kwargs):
+            self.counters[name] += 1
+            return return_value
+        return _count
+
+    def restart_services(self, services):
+        self.counters['service-ops'] += len(services)
+
+    # charm instance
+    def render_with_interfaces(self, instance, interfaces, configs=None):
+        """Render configs into the scratch directory
+
+        Like the real render every file is rewritten, from the values of
+        the adapter properties its template uses, and services are
+        restarted through restart_on_change().  The credentials file is
+        provided by the environment rather than rendered.
+        """
+        if configs is None:
+            configs = list(instance.restart_map.keys())
+        self.counters['renders'] += 1
+        options = self.adapter(instance)
+        with instance.restart_on_change():
+            for config in configs:
+                if config == _RC_FILE:
+                    continue
+                lines = ['[DEFAULT]']
+                for name in RENDERED_PROPERTIES.get(config, []):
+                    lines.append('{} = {!r}'.format(name,
+                                                    getattr(options, name)))
+                with open(self.path(config), 'w') as f:
+                    f.write('\n'.join(lines) + '\n')
+
+    def adapter(self, instance):
+        with mock.patch.object(
+                designate.openstack_adapters.APIConfigurationAdapter,
+                'get_network_addresses'):
+            return designate.DesignateConfigurationAdapter(
+                charm_instance=instance)
+
+    def make_charm(self):
+        if self.release == 'caracal':
+            instance = designate.DesignateCharmCaracal(release='caracal')
+        else:
+            instance = designate.DesignateCharm(release=self.release)
+        stubs = {
+            'render_with_interfaces': (
+                lambda interfaces, configs=None:
+                    self.render_with_interfaces(instance, interfaces,
+                                                configs)),
+            'haproxy_enabled': lambda: False,
+            'configure_sink': lambda: self.release in ('mitaka', 'newton',
+                                                       'ocata', 'pike'),
+            'upgrade_if_available': lambda interfaces: None,
+            'remove_obsolete_packages': lambda: None,
+            'configure_ssl': lambda: None,
+            'enable_services': self.count('service-ops'),
+            'disable_services': self.count('service-ops'),
+            'assess_status': lambda: instance.custom_assess_status_check(),
+        }
+        for name, stub in stubs.items():
+            setattr(instance, name, stub)
+        return instance
+
+    @contextlib.contextmanager
+    def patched(self):
+        instance = self.make_charm()
+
+        @contextlib.contextmanager
+        def provide_charm_instance():
+            yield instance
+
+        hookenv = designate.hookenv
+        patches = [
+            mock.patch.object(hookenv, 'config', self.hookenv_config),
+            mock.patch.object(hookenv, 'is_leader', self.is_leader),
+            mock.patch.object(hookenv, 'leader_get', self.leader_get),
+            mock.patch.object(hookenv, 'leader_set', self.leader_set),
+            mock.patch.object(hookenv, 'relation_ids', self.relation_ids),
+            mock.patch.object(hookenv, 'related_units', self.related_units),
+            mock.patch.object(hookenv, 'relation_get', self.relation_get),
+            mock.patch.object(designate.relations, 'endpoint_from_flag',
+                              self.endpoint_from_flag),
+            mock.patch.object(handlers.relations, 'endpoint_from_flag',
+                              self.endpoint_from_flag),
+            mock.patch.object(handlers.charm, 'provide_charm_instance',
+                              provide_charm_instance),
+            mock.patch.object(handlers.reactive, 'set_state',
+                              self.count('flag-ops')),
+            mock.patch.object(handlers.reactive, 'remove_state',
+                              self.count('flag-ops')),
+            mock.patch.object(designate.subprocess, 'check_call',
+                              self.count('subprocesses')),
+            mock.patch.object(designate.subprocess, 'check_output',
+                              self.count('subprocesses', b'')),
+            mock.patch.object(designate.host, 'file_hash', self.file_hash),
+            mock.patch.object(designate.host, 'path_hash', self.file_hash),
+            mock.patch.object(designate, 'config_section_hashes',
+                              lambda path: _config_section_hashes(
+                                  self.path(path))),
+            mock.patch.object(handlers.host, 'service_restart',
+                              self.count('service-ops')),
+            # the NRPE checks are written outside of the scratch directory
+            mock.patch.object(designate.nrpe, 'NRPE',
+                              lambda **kwargs: mock.MagicMock(
+                                  write=self.count('file-writes'))),
+            mock.patch.object(designate_api.requests, 'Session',
+                              lambda: self.api),
+            mock.patch.object(designate_api, 'TOKEN_CACHE_FILE',
+                              self.path(designate_api.TOKEN_CACHE_FILE)),
+            mock.patch.object(designate_api, '_clients', {}),
+            mock.patch.object(designate_api, '_probe',
+                              designate_api.ReadinessProbe()),
+            mock.patch.object(designate.DesignateCharm,
+                              '_resolved_domain_ids', {}),
+            mock.patch.object(designate, 'RC_FILE',
+                              self.path(_RC_FILE)),
+            mock.patch.object(designate, 'RNDC_KEY_FILE',
+                              self.path(designate.RNDC_KEY_FILE)),
+            mock.patch.object(designate, '_rndc_key_owner',
+                              lambda: (os.getuid(), os.getgid())),
+            mock.patch.object(designate.DesignateCharm, 'restart_services',
+                              self.restart_services),
+        ]
+        try:
+            for p in patches:
+                p.start()
+            # the adapter reads the patched config, so build it last
+            options = mock.patch.object(designate.DesignateCharm, 'options',
+                                        new_callable=mock.PropertyMock,
+                                        return_value=self.adapter(instance))
+            options.start()
+            patches.append(options)
+            yield
+        finally:
+            for p in reversed(patches):
+                p.stop()
+
+    def run(self, handler_name):
+        """Run one handler and return (seconds, side effect counters)"""
+        self.counters.clear()
+        handler = getattr(handlers, handler_name)
+        before = self.snapshot()
+        with self.patched():
+            start = time.perf_counter()
+            handler()
+            elapsed = time.perf_counter() - start
+        after = self.snapshot()
+        self.counters['file-writes'] += sum(
+            1 for path in set(before) | set(after)
+            if before.get(path) != after.get(path))
+        return elapsed, collections.Counter(self.counters)
+
+
+def run_benchmarks(scales=SCALES, leader=True, release='caracal',
+                   repeat=REPEAT):
+    """Benchmark every handler in HANDLERS at each scale
+
+    @returns list of (scale, handler_name, median seconds, counters)
+    """
+    results = []
+    for scale in scales:
+        for handler_name in HANDLERS:
+            timings = []
+            for _ in range(repeat):
+                env = FakeEnvironment(*scale, leader=leader, release=release)
+                try:
+                    elapsed, counters = env.run(handler_name)
+                finally:
+                    env.close()
+                timings.append(elapsed)
+            results.append((scale, handler_name,
+                            statistics.median(timings), counters))
+    return results
+
+
+def format_report(results):
+    columns = ['api-requests', 'keystone-auth', 'subprocesses',
+               'file-writes', 'relation-get', 'leader-set', 'service-ops']
+    lines = ['{:<14} {:<34} {:>9} '.format('scale', 'handler', 'ms') +
+             ' '.join('{:>13}'.format(c) for c in columns)]
+    for scale, handler_name, elapsed, counters in results:
+        lines.append(
+            '{:<14} {:<34} {:>9.2f} '.format(
+                '{}/{}/{}'.format(*scale), handler_name, elapsed * 1000) +
+            ' '.join('{:>13}'.format(counters[c]) for c in columns))
+    return '\n'.join(lines)
+
+
+class TestHookCost(unittest.TestCase):
+    """Side effect budgets for the largest scale"""
+
+    def environment(self, leader=True, release='caracal'):
+        env = FakeEnvironment(*SCALES[-1], leader=leader, release=release)
+        self.addCleanup(env.close)
+        return env
+
+    def run_handler(self, handler_name, leader=True, release='caracal'):
+        return self.environment(leader, release).run(handler_name)[1]
+
+    def test_configure_designate_full_non_leader(self):
+        counters = self.run_handler('configure_designate_full',
+                                    leader=False, release='mitaka')
+        self.assertEqual(counters['api-requests'], 0)
+        self.assertEqual(counters['subprocesses'], 0)
+        self.assertEqual(counters['leader-set'], 0)
+
+    def test_configure_designate_full_leader(self):
+        counters = self.run_handler('configure_designate_full',
+                                    release='mitaka')
+        self.assertLessEqual(counters['keystone-auth'], 1)
+        # lookups must not page through every zone in the cloud
+        self.assertLess(counters['api-requests'], 20)
+        self.assertLessEqual(counters['subprocesses'], 1)
+        # one pass for the main config and one for the sinks
+        self.assertEqual(counters['renders'], 2)
+
+    def test_configure_designate_full_caracal(self):
+        counters = self.run_handler('configure_designate_full')
+        self.assertEqual(counters['renders'], 1)
+        self.assertEqual(counters['api-requests'], 0)
+
+    def test_configure_designate_full_unchanged(self):
+        env = self.environment()
+        counters = env.run('configure_designate_full')[1]
+        self.assertEqual(counters['subprocesses'], 1)
+        self.assertGreater(counters['file-writes'], 0)
+        self.assertGreater(counters['service-ops'], 0)
+        # nothing has changed, so no file changes, no restarts and no pools
+        # to push
+        counters = env.run('configure_designate_full')[1]
+        self.assertEqual(counters['subprocesses'], 0)
+        self.assertEqual(counters['leader-set'], 0)
+        self.assertEqual(counters['file-writes'], 0)
+        self.assertEqual(counters['service-ops'], 0)
+        # a new backend changes pools.yaml, which is pushed again
+        env.config['dns-slaves'] += ' 10.3.0.1:953:key'
+        counters = env.run('configure_designate_full')[1]
+        self.assertEqual(counters['subprocesses'], 1)
+
+    def test_configure_dns_backend_rndc_keys_unchanged(self):
+        env = self.environment()
+        counters = env.run('configure_dns_backend_rndc_keys')[1]
+        # one key per dns-slaves entry and one per related application
+        self.assertEqual(counters['file-writes'], 2 * SCALES[-1][0])
+        self.assertEqual(counters['service-ops'], 1)
+        counters = env.run('configure_dns_backend_rndc_keys')[1]
+        self.assertEqual(counters['file-writes'], 0)
+        self.assertEqual(counters['service-ops'], 0)
+
+    def test_configure_designate_basic(self):
+        counters = self.run_handler('configure_designate_basic')
+        self.assertEqual(counters['renders'], 1)
+        self.assertEqual(counters['api-requests'], 0)
+
+    def test_configure_nrpe(self):
+        counters = self.run_handler('configure_nrpe')
+        self.assertEqual(counters['api-requests'], 0)
+        self.assertEqual(counters['subprocesses'], 0)
+
+    def test_run_assess_status_on_every_hook(self):
+        counters = self.run_handler('run_assess_status_on_every_hook')
+        self.assertEqual(counters['api-requests'], 0)
+        self.assertEqual(counters['file-writes'], 0)
+        self.assertEqual(counters['subprocesses'], 0)
+
+
+if __name__ == '__main__':
+    leader = '--non-leader' not in sys.argv
+    release = 'mitaka' if '--mitaka' in sys.argv else 'caracal'
+    print(format_report(run_benchmarks(leader=leader, release=release)))
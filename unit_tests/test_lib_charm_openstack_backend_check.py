@@ -0,0 +1,149 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import struct
+import subprocess
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+import charm.openstack.backend_check as backend_check
+
+
+class FakeNameserver(object):
+    """UDP server answering every query with rcode"""
+
+    def __init__(self, rcode=5):
+        self.rcode = rcode
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.queries = []
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                query, peer = self.sock.recvfrom(512)
+            except OSError:
+                return
+            self.queries.append(query)
+            flags = 0x8000 | self.rcode
+            self.sock.sendto(query[:2] + struct.pack('!H', flags) +
+                             query[4:], peer)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestBackendCheck(unittest.TestCase):
+
+    def test_soa_query(self):
+        query = backend_check.soa_query('example.com.', 0x1234)
+        self.assertEqual(query[:12], struct.pack('!HHHHHH', 0x1234, 0, 1,
+                                                 0, 0, 0))
+        self.assertEqual(query[12:], b'\x07example\x03com\x00\x00\x06\x00\x01')
+        self.assertEqual(backend_check.soa_query('.', 1)[12:],
+                         b'\x00\x00\x06\x00\x01')
+
+    def test_check_soa(self):
+        server = FakeNameserver(rcode=5)
+        self.addCleanup(server.close)
+        latency, rcode = backend_check.check_soa('127.0.0.1', 'example.com',
+                                                 port=server.port)
+        self.assertEqual(rcode, 'REFUSED')
+        self.assertGreaterEqual(latency, 0)
+        self.assertEqual(len(server.queries), 1)
+
+    def test_check_soa_timeout(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        sock.bind(('127.0.0.1', 0))
+        with self.assertRaises(backend_check.CheckError):
+            backend_check.check_soa('127.0.0.1', '.',
+                                    port=sock.getsockname()[1], timeout=0.1)
+
+    @mock.patch.object(backend_check.subprocess, 'run')
+    def test_check_rndc(self, run):
+        self.assertGreaterEqual(
+            backend_check.check_rndc('10.0.0.1', '/etc/rndc.key'), 0)
+        run.assert_called_once_with(
+            ['rndc', '-s', '10.0.0.1', '-p', '953', '-k', '/etc/rndc.key',
+             'status'],
+            check=True, timeout=5.0, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE)
+
+    @mock.patch.object(backend_check.subprocess, 'run')
+    def test_check_rndc_failure(self, run):
+        run.side_effect = subprocess.CalledProcessError(
+            1, 'rndc', stderr=b'rndc: connection to remote host closed\n')
+        with self.assertRaisesRegex(backend_check.CheckError,
+                                    'connection to remote host closed'):
+            backend_check.check_rndc('10.0.0.1', '/etc/rndc.key')
+        run.side_effect = subprocess.TimeoutExpired('rndc', 5)
+        with self.assertRaisesRegex(backend_check.CheckError, 'within'):
+            backend_check.check_rndc('10.0.0.1', '/etc/rndc.key')
+
+    @mock.patch.object(backend_check, 'check_soa')
+    @mock.patch.object(backend_check, 'check_rndc')
+    def test_check_target(self, check_rndc, check_soa):
+        check_rndc.return_value = 0.0123
+        check_soa.return_value = (0.002, 'NOERROR')
+        target = {'name': 'ns1', 'address': '10.0.0.1',
+                  'rndc_key_file': '/etc/rndc.key'}
+        self.assertEqual(backend_check.check_target(target), {
+            'name': 'ns1', 'address': '10.0.0.1', 'rndc': 12.3, 'soa': 2.0,
+            'rcode': 'NOERROR', 'ok': True})
+        check_rndc.side_effect = backend_check.CheckError('refused')
+        result = backend_check.check_target(target)
+        self.assertEqual(result['rndc'], 'refused')
+        self.assertFalse(result['ok'])
+        # catalog zone members are not managed with rndc
+        check_rndc.reset_mock()
+        target['catalog'] = True
+        result = backend_check.check_target(target)
+        self.assertIsNone(result['rndc'])
+        self.assertTrue(result['ok'])
+        self.assertFalse(check_rndc.called)
+
+    @mock.patch.object(backend_check, 'check_target')
+    def test_check_targets_concurrent(self, check_target):
+        def slow_check(target, zone, timeout):
+            time.sleep(0.2)
+            return target['name']
+        check_target.side_effect = slow_check
+        targets = [{'name': 'ns{}'.format(i)} for i in range(10)]
+        started = time.monotonic()
+        results = backend_check.check_targets(targets, concurrency=10)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(results, ['ns{}'.format(i) for i in range(10)])
+        self.assertEqual(backend_check.check_targets([]), [])
+
+    def test_format_results(self):
+        output = backend_check.format_results([
+            {'name': 'nameserver_ns1', 'address': '10.0.0.1', 'rndc': 1.5,
+             'soa': 0.5, 'rcode': 'NOERROR', 'ok': True},
+            {'name': 'nameserver_ns2', 'address': '10.0.0.2',
+             'rndc': 'no answer within 5.0s', 'soa': None, 'ok': False}])
+        lines = output.splitlines()
+        self.assertEqual(lines[0].split(),
+                         ['target', 'address', 'rndc', 'soa', 'rcode'])
+        self.assertIn('nameserver_ns2', lines[1])
+        self.assertIn('no answer within 5.0s', lines[1])
+        self.assertEqual(lines[2].split(), ['nameserver_ns1', '10.0.0.1',
+                                            '1.5ms', '0.5ms', 'NOERROR'])
@@ -13,6 +13,9 @@
 # limitations under the License.
 
 import contextlib
+import os
+import shutil
+import tempfile
 import unittest
 
 from unittest import mock
@@ -81,6 +84,31 @@ class TestDesignateDBAdapter(Helper):
         self.assertEqual(a.designate_uri, 'mysql://uri/designate-database')
         self.assertEqual(a.designate_pool_uri, 'mysql://uri/dpm-database')
 
+    def test_designate_replica_uri(self):
+        relation = mock.MagicMock()
+        a = designate.DesignateDBAdapter(relation)
+        self.patch(designate.DesignateDBAdapter, 'designate_uri',
+                   new_callable=mock.PropertyMock,
+                   return_value='mysql+pymysql://designate:pw@127.0.0.1/'
+                                'designate?unix_socket=/run/mysql.sock&'
+                                'ssl_ca=/etc/ssl/ca.pem')
+        test_config = {'database-read-replica': None}
+        self.patch(designate.hookenv, 'config',
+                   side_effect=FakeConfig(test_config))
+        self.assertIsNone(a.designate_replica_uri)
+        test_config['database-read-replica'] = '10.0.0.20:3307'
+        self.assertEqual(
+            a.designate_replica_uri,
+            'mysql+pymysql://designate:pw@10.0.0.20:3307/designate?'
+            'ssl_ca=/etc/ssl/ca.pem')
+        test_config['database-read-replica'] = 'fd00::20'
+        self.assertEqual(
+            a.designate_replica_uri,
+            'mysql+pymysql://designate:pw@[fd00::20]/designate?'
+            'ssl_ca=/etc/ssl/ca.pem')
+        self.designate_uri.return_value = None
+        self.assertIsNone(a.designate_replica_uri)
+
 
 class TestBindRNDCRelationAdapter(Helper):
 
@@ -97,17 +125,23 @@ class TestBindRNDCRelationAdapter(Helper):
              'address': 'addr1'},
             {'unit': 'unit/2',
              'address': 'addr2'}]
+        self.patch(designate, 'configured_pools',
+                   return_value=designate.parse_pools(
+                       'shard: {ns-records: ns1.example.com., '
+                       'backends: unit}'))
         with mock.patch.object(designate.BindRNDCRelationAdapter,
                                'slave_ips', new=_slave_ips):
             a = designate.BindRNDCRelationAdapter(relation)
             expect = [{'address': 'addr1',
                        'nameserver': 'nameserver_unit',
                        'pool_target': 'nameserver_unit',
-                       'rndc_key_file': '/etc/designate/rndc_unit.key'},
+                       'rndc_key_file': '/etc/designate/rndc_unit.key',
+                       'pool': 'shard'},
                       {'address': 'addr2',
                        'nameserver': 'nameserver_unit',
                        'pool_target': 'nameserver_unit',
-                       'rndc_key_file': '/etc/designate/rndc_unit.key'}]
+                       'rndc_key_file': '/etc/designate/rndc_unit.key',
+                       'pool': 'shard'}]
             self.assertEqual(a.pool_config, expect)
             self.assertEqual(
                 a.pool_targets,
@@ -121,6 +155,28 @@ class TestBindRNDCRelationAdapter(Helper):
         self.assertEqual(a.rndc_info, 'rndcstuff')
 
 
+class TestDesignateMemcacheRelationAdapter(Helper):
+
+    def test_servers(self):
+        def conversation(**remote):
+            conv = mock.MagicMock()
+            conv.get_remote.side_effect = remote.get
+            return conv
+
+        relation = mock.MagicMock()
+        relation.conversations.return_value = [
+            conversation(**{'private-address': '10.0.0.2', 'port': '11311'}),
+            conversation(**{'private-address': 'fd00::1', 'port': '11211'}),
+            conversation(**{'private-address': '10.0.0.1'}),
+            conversation()]
+        a = designate.DesignateMemcacheRelationAdapter(relation)
+        self.assertEqual(
+            a.servers,
+            '10.0.0.1:11211,10.0.0.2:11311,inet6:[fd00::1]:11211')
+        relation.conversations.return_value = []
+        self.assertEqual(a.servers, '')
+
+
 class TestDesignateConfigurationAdapter(Helper):
 
     def test_designate_configuration_adapter_pool_info(self):
@@ -129,22 +185,154 @@ class TestDesignateConfigurationAdapter(Helper):
             designate.openstack_adapters.APIConfigurationAdapter,
             'get_network_addresses')
         test_config = {
-            'dns_slaves': 'ip1:port1:key1 ip2:port2:key2',
+            'dns_slaves': '10.0.0.1:953:key1 [fd00::2]:953:key2',
         }
+        self.patch(designate, 'configured_pools',
+                   return_value=designate.parse_pools(
+                       'shard: {ns-records: ns1.example.com., '
+                       'backends: "fd00::2"}'))
         with mock.patch.object(designate.openstack_adapters.hookenv, 'config',
                                new=lambda: test_config):
             a = designate.DesignateConfigurationAdapter(relation)
-            expect = [{'address': 'ip1',
-                       'nameserver': 'nameserver_ip1',
-                       'pool_target': 'nameserver_ip1',
-                       'rndc_key_file': '/etc/designate/rndc_ip1.key'},
-                      {'address': 'ip2',
-                       'nameserver': 'nameserver_ip2',
-                       'pool_target': 'nameserver_ip2',
-                       'rndc_key_file': '/etc/designate/rndc_ip2.key'}]
+            expect = [{'address': '10.0.0.1',
+                       'nameserver': 'nameserver_10_0_0_1',
+                       'pool_target': 'nameserver_10_0_0_1',
+                       'rndc_key_file': '/etc/designate/rndc_10_0_0_1.key',
+                       'pool': 'default',
+                       'catalog': False},
+                      {'address': 'fd00::2',
+                       'nameserver': 'nameserver_fd00__2',
+                       'pool_target': 'nameserver_fd00__2',
+                       'rndc_key_file': '/etc/designate/rndc_fd00__2.key',
+                       'pool': 'shard',
+                       'catalog': False}]
             self.assertEqual(a.pool_config, expect)
-            self.assertEqual(a.pool_targets, 'nameserver_ip1, nameserver_ip2')
-            self.assertEqual(a.slave_addresses, 'ip1:53, ip2:53')
+            self.assertEqual(a.pool_targets,
+                             'nameserver_10_0_0_1, nameserver_fd00__2')
+            self.assertEqual(a.slave_addresses,
+                             '10.0.0.1:53, [fd00::2]:53')
+            self.assertIsNone(a.invalid_pool_config())
+
+    def test_designate_configuration_adapter_malformed_slaves(self):
+        relation = mock.MagicMock()
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        self.patch(designate, 'configured_pools', return_value={})
+        test_config = {
+            'dns_slaves': '10.0.0.1:953:key1 10.0.0.2:key2',
+        }
+        with mock.patch.object(designate.openstack_adapters.hookenv, 'config',
+                               new=lambda: test_config):
+            a = designate.DesignateConfigurationAdapter(relation)
+            self.assertEqual(a.pool_config, [])
+            self.assertEqual(
+                a.invalid_pool_config(),
+                'dns_slaves is malformed: 10.0.0.2:key2 is not of the form '
+                'address:port:key')
+
+    def test_all_pools(self):
+        relation = mock.MagicMock()
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        self.patch(designate, 'configured_pools',
+                   return_value=designate.parse_pools(
+                       'shard:\n'
+                       '  ns-records: ns1.shard.com.\n'
+                       '  backends: 10.0.0.2\n'
+                       '  also-notifies: 10.0.0.9:53\n'
+                       '  attributes: {tier: gold}\n'
+                       'empty:\n'
+                       '  ns-records: ns1.empty.com.\n'
+                       '  backends: bind-2\n'))
+        self.patch(designate.relations, 'endpoint_from_flag',
+                   return_value=None)
+        self.patch(designate.hookenv, 'log')
+        test_config = {
+            'nameservers': 'ns1.example.com. ns2.example.com.',
+            'also-notifies': '10.0.0.1:53',
+        }
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            a = designate.DesignateConfigurationAdapter(relation)
+            a.nameservers = test_config['nameservers']
+            a.dns_slaves = '10.0.0.2:953:key2'
+            pools = a.all_pools
+        # the empty pool's backend has not joined, so it is left out
+        self.assertEqual(len(pools), 2)
+        designate.hookenv.log.assert_any_call(
+            "Leaving pool empty out of pools.yaml as none of its backends "
+            "are available", level=designate.hookenv.WARNING)
+        self.assertEqual(pools[0]['id'], designate.DEFAULT_POOL_ID)
+        self.assertEqual(pools[0]['name'], 'default')
+        self.assertEqual(pools[0]['ns_records'],
+                         ['ns1.example.com.', 'ns2.example.com.'])
+        self.assertEqual(pools[0]['also_notifies'],
+                         [{'address': '10.0.0.1', 'port': '53'}])
+        self.assertEqual(pools[1]['name'], 'shard')
+        self.assertNotEqual(pools[1]['id'], designate.DEFAULT_POOL_ID)
+        self.assertEqual(pools[1]['ns_records'], ['ns1.shard.com.'])
+        self.assertEqual(pools[1]['also_notifies'],
+                         [{'address': '10.0.0.9', 'port': '53'}])
+        self.assertEqual(pools[1]['attributes'], {'tier': 'gold'})
+        self.assertIsNone(pools[1]['catalog_zone'])
+
+    def test_all_pools_catalog_zones(self):
+        charm_instance = mock.MagicMock()
+        charm_instance.supports_catalog_zones.return_value = True
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        self.patch(designate, 'configured_pools',
+                   return_value=designate.parse_pools(
+                       'shard:\n'
+                       '  ns-records: ns1.shard.com.\n'
+                       '  backends: 10.0.0.2\n'
+                       '  catalog-zone: catalog.shard.com\n'))
+        self.patch(designate.relations, 'endpoint_from_flag')
+        test_config = {'also-notifies': None}
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            a = designate.DesignateConfigurationAdapter(
+                charm_instance=charm_instance)
+            a.nameservers = 'ns1.example.com.'
+            a.dns_slaves = '10.0.0.1:953:key1 10.0.0.2:953:key2'
+            a.catalog_zone = 'catalog.example.com.'
+            self.assertEqual(a.catalog_zones,
+                             {'default': 'catalog.example.com.',
+                              'shard': 'catalog.shard.com.'})
+            self.assertEqual([s['catalog'] for s in a.pool_config],
+                             [False, False])
+            a.dns_slaves_catalog_zone = True
+            self.assertEqual([s['catalog'] for s in a.pool_config],
+                             [True, True])
+            pools = a.all_pools
+            self.assertEqual(pools[0]['catalog_zone'],
+                             'catalog.example.com.')
+            self.assertEqual(pools[1]['also_notifies'],
+                             [{'address': '10.0.0.2', 'port': '53'}])
+            self.assertEqual(a.pool_target_counts, {})
+            charm_instance.supports_catalog_zones.return_value = False
+            self.assertEqual(a.catalog_zones, {})
+            self.assertEqual([s['catalog'] for s in a.pool_config],
+                             [False, False])
+
+    def test_invalid_pool_config_pools(self):
+        relation = mock.MagicMock()
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        test_config = {'pools': 'shard: {backends: bind}'}
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            a = designate.DesignateConfigurationAdapter(relation)
+            a.dns_slaves = None
+            self.assertEqual(a.invalid_pool_config(),
+                             'pools is malformed: pool shard has no '
+                             'ns-records')
+            test_config['pools'] = 'shard: {ns-records: ns1.shard.com.}'
+            self.assertIsNone(a.invalid_pool_config())
 
     def test_designate_configuration_domains(self):
         relation = mock.MagicMock()
@@ -161,8 +349,8 @@ class TestDesignateConfigurationAdapter(Helper):
         }
         with mock.patch.object(designate.hookenv, 'config',
                                side_effect=FakeConfig(test_config)):
-            self.patch(designate.DesignateCharm, 'get_domain_id')
-            self.get_domain_id.side_effect = lambda x: domain_map.get(x)
+            self.patch(designate.DesignateCharm, 'resolve_domain_id')
+            self.resolve_domain_id.side_effect = lambda x: domain_map.get(x)
             a = designate.DesignateConfigurationAdapter(relation)
             self.assertEqual(a.nova_domain_id, 12)
             self.assertEqual(a.neutron_domain_id, 13)
@@ -207,6 +395,566 @@ class TestDesignateConfigurationAdapter(Helper):
             a = designate.DesignateConfigurationAdapter(relation)
             self.assertEqual(a.also_notifies_hosts, expect)
 
+    def test_service_workers(self):
+        relation = mock.MagicMock()
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        self.patch(designate.DesignateConfigurationAdapter, 'workers',
+                   return_value=8, new_callable=mock.PropertyMock)
+        self.patch(designate.host, 'get_total_ram',
+                   return_value=64 * 1024 ** 3)
+        self.patch(designate.relations, 'endpoint_from_flag')
+        test_config = {'mdns-workers': 3, 'api-threads': 500, 'pools': ''}
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            a = designate.DesignateConfigurationAdapter(relation)
+            a.mdns_workers = 3
+            a.api_threads = 500
+            self.assertEqual(a.service_workers, {
+                'api': 8, 'central': 8, 'mdns': 3, 'worker': 4,
+                'producer': 2})
+            self.assertEqual(a.service_threads['api'], 500)
+            self.assertIsNone(a.service_threads['central'])
+            self.assertIsNone(a.service_threads['worker'])
+
+    def test_token_cache_secret(self):
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        self.patch(designate.hookenv, 'leader_get', return_value='s3cret')
+        a = designate.DesignateConfigurationAdapter()
+        self.assertEqual(a.token_cache_secret, 's3cret')
+        self.leader_get.assert_called_once_with('token-cache-secret')
+
+    def test_mdns_backlog(self):
+        relation = mock.MagicMock()
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        dns_backend = mock.MagicMock()
+        dns_backend.slave_ips.return_value = [
+            {'unit': 'bind/{}'.format(i), 'address': '10.0.1.{}'.format(i)}
+            for i in range(12)]
+        self.patch(designate.relations, 'endpoint_from_flag',
+                   return_value=dns_backend)
+        test_config = {'dns-slaves': '10.0.0.1:953:secret', 'pools': ''}
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            a = designate.DesignateConfigurationAdapter(relation)
+            a.dns_slaves = test_config['dns-slaves']
+            self.assertEqual(a.dns_slave_count, 13)
+            self.assertEqual(a.mdns_backlog, 130)
+            self.endpoint_from_flag.return_value = None
+            self.assertEqual(a.dns_slave_count, 1)
+            self.assertEqual(a.mdns_backlog, designate.MDNS_TCP_BACKLOG)
+            a.mdns_tcp_backlog = 64
+            self.assertEqual(a.mdns_backlog, 64)
+
+    def test_mdns_backlog_catalog_zone(self):
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        self.patch(designate.relations, 'endpoint_from_flag',
+                   return_value=None)
+        dns_slaves = ' '.join('10.0.0.{}:953:secret'.format(i)
+                              for i in range(15))
+        test_config = {'dns-slaves': dns_slaves, 'pools': ''}
+        charm_instance = mock.MagicMock()
+        charm_instance.supports_catalog_zones.return_value = True
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            a = designate.DesignateConfigurationAdapter(
+                charm_instance=charm_instance)
+            a.dns_slaves = dns_slaves
+            a.catalog_zone = 'catalog.example.com'
+            a.dns_slaves_catalog_zone = True
+            # catalog consumers are not worker targets, but they still
+            # transfer every zone from designate-mdns
+            self.assertEqual(a.pool_target_counts, {})
+            self.assertEqual(a.dns_slave_count, 15)
+            self.assertEqual(a.mdns_backlog, 150)
+
+    def test_worker_polling(self):
+        relation = mock.MagicMock()
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        dns_backend = mock.MagicMock()
+        dns_backend.slave_ips.return_value = [
+            {'unit': 'bind-{}/{}'.format(app, i),
+             'address': '10.0.{}.{}'.format(app, i)}
+            for app in range(2) for i in range(10)]
+        self.patch(designate.relations, 'endpoint_from_flag',
+                   return_value=dns_backend)
+        test_config = {'dns-slaves': '10.0.9.1:953:secret',
+                       'pools': 'shard:\n'
+                                '  ns-records: ns1.shard.com.\n'
+                                '  backends: [bind-1, 10.0.9.1]\n'}
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            a = designate.DesignateConfigurationAdapter(relation)
+            a.dns_slaves = test_config['dns-slaves']
+            self.assertEqual(a.pool_target_counts,
+                             {'default': 10, 'shard': 11})
+            polling = a.worker_polling
+            self.assertEqual(polling['threshold_percentage'], 90)
+            self.assertEqual(polling['poll_retry_interval'], 15)
+            self.assertEqual(polling['poll_max_retries'], 10)
+            self.assertEqual(polling['poll_delay'], 6)
+            self.assertIsNone(polling['notify_delay'])
+            self.assertEqual(a.service_threads['worker'], 220)
+            a.worker_threshold_percentage = 100
+            a.worker_notify_delay = 2.5
+            a.worker_threads = 100
+            polling = a.worker_polling
+            self.assertEqual(polling['threshold_percentage'], 100)
+            self.assertEqual(polling['notify_delay'], 2.5)
+            self.assertEqual(a.service_threads['worker'], 100)
+
+    def test_size_worker_polling(self):
+        polling = designate.size_worker_polling(0)
+        self.assertEqual(polling, {
+            'threshold_percentage': 100,
+            'poll_timeout': designate.WORKER_POLL_TIMEOUT,
+            'poll_retry_interval': designate.WORKER_POLL_RETRY_INTERVAL,
+            'poll_max_retries': designate.WORKER_POLL_MAX_RETRIES,
+            'poll_delay': designate.WORKER_POLL_DELAY,
+            'notify_delay': None})
+        self.assertEqual(
+            designate.size_worker_polling(3)['threshold_percentage'], 100)
+        self.assertEqual(
+            designate.size_worker_polling(4)['threshold_percentage'], 75)
+        polling = designate.size_worker_polling(50)
+        self.assertEqual(polling['threshold_percentage'], 98)
+        self.assertEqual(polling['poll_retry_interval'], 50)
+        self.assertEqual(polling['poll_max_retries'], 3)
+        self.assertEqual(polling['poll_delay'], 10)
+        window = (designate.WORKER_POLL_RETRY_INTERVAL *
+                  designate.WORKER_POLL_MAX_RETRIES)
+        for targets in (16, 49, 100, 200, 1000):
+            polling = designate.size_worker_polling(targets)
+            self.assertLessEqual(polling['poll_retry_interval'], 50)
+            self.assertGreaterEqual(polling['poll_max_retries'], 3)
+            self.assertLessEqual(
+                polling['poll_retry_interval'] * polling['poll_max_retries'],
+                window)
+
+    def test_producer_task_settings(self):
+        relation = mock.MagicMock()
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        test_config = {
+            'expected-zones': 5000,
+            'producer-tasks': 'delayed_notify: {interval: 10}\n',
+        }
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            a = designate.DesignateConfigurationAdapter(relation)
+            a.expected_zones = 5000
+            a.producer_tasks = test_config['producer-tasks']
+            tasks = a.producer_task_settings
+            self.assertEqual(tasks['delayed_notify'], {
+                'interval': 10, 'per_page': 500, 'batch_size': 500})
+            self.assertIsNone(a.invalid_producer_tasks())
+            a.producer_tasks = 'delayed_notify: {interval: 0}'
+            self.assertEqual(
+                a.invalid_producer_tasks(),
+                'producer-tasks is malformed: interval for delayed_notify '
+                'must be a positive integer')
+            self.assertEqual(a.producer_task_settings['delayed_notify'],
+                             {'interval': 5, 'per_page': 500,
+                              'batch_size': 500})
+
+    def test_db_pool(self):
+        relation = mock.MagicMock()
+        self.patch(
+            designate.openstack_adapters.APIConfigurationAdapter,
+            'get_network_addresses')
+        self.patch(designate.DesignateConfigurationAdapter,
+                   'service_workers', new_callable=mock.PropertyMock,
+                   return_value={'api': 8, 'central': 8, 'mdns': 4,
+                                 'worker': 4, 'producer': 4})
+        self.patch(designate.hookenv, 'log')
+        test_config = {'db-connection-budget': 200}
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            a = designate.DesignateConfigurationAdapter(relation)
+            a.db_connection_budget = 200
+            self.assertEqual(a.db_pool, {
+                'max_pool_size': 5, 'max_overflow': 5, 'pool_timeout': None,
+                'connection_recycle_time': None, 'max_retries': None})
+            self.assertEqual(a.db_connections, 200)
+            self.assertFalse(self.log.called)
+            a.db_max_overflow = 20
+            a.db_connection_recycle_time = 600
+            pool = a.db_pool
+            self.assertEqual(pool['max_overflow'], 20)
+            self.assertEqual(pool['connection_recycle_time'], 600)
+            self.assertEqual(a.db_connections, 500)
+            self.assertTrue(self.log.called)
+
+    def test_size_db_pool(self):
+        self.assertEqual(designate.size_db_pool(200, 20), (5, 5))
+        self.assertEqual(designate.size_db_pool(200, 4), (5, 45))
+        self.assertEqual(designate.size_db_pool(2000, 4), (5, 50))
+        self.assertEqual(designate.size_db_pool(60, 10), (3, 3))
+        self.assertEqual(designate.size_db_pool(10, 40), (1, 1))
+
+    def test_size_service_workers(self):
+        gib = 1024 ** 3
+        self.assertEqual(
+            list(designate.size_service_workers(32, 64 * gib).values()),
+            [32, 32, 16, 16, 8])
+        self.assertEqual(
+            list(designate.size_service_workers(1, 64 * gib).values()),
+            [1, 1, 1, 1, 1])
+
+    def test_size_service_workers_memory_bound(self):
+        # 2GiB leaves room for 6 processes, against 2 + 2 + 1 + 1 + 1 wanted
+        workers = designate.size_service_workers(2, 2 * 1024 ** 3)
+        self.assertEqual(list(workers.values()), [1, 1, 1, 1, 1])
+        workers = designate.size_service_workers(16, 8 * 1024 ** 3)
+        self.assertLessEqual(
+            sum(workers.values()) * designate.SERVICE_PROCESS_MEMORY,
+            8 * 1024 ** 3 * designate.SERVICE_MEMORY_SHARE)
+        self.assertEqual(list(workers.values()), [7, 7, 3, 3, 1])
+        # operator settings are never scaled down
+        workers = designate.size_service_workers(
+            16, 8 * 1024 ** 3, {'api': 20, 'central': None})
+        self.assertEqual(list(workers.values()), [20, 2, 1, 1, 1])
+
+
+class TestProducerTasks(Helper):
+
+    def test_parse_producer_tasks(self):
+        self.assertEqual(designate.parse_producer_tasks(None), {})
+        self.assertEqual(
+            designate.parse_producer_tasks(
+                'zone_purge: {batch_size: 50}\n'
+                'periodic_exists: {interval: 7200}\n'),
+            {'zone_purge': {'batch_size': 50},
+             'periodic_exists': {'interval': 7200}})
+
+    def test_parse_producer_tasks_invalid(self):
+        for value, error in (
+                ('[', 'not valid YAML'),
+                ('- zone_purge', 'must map task names'),
+                ('bogus: {interval: 1}', 'unknown task bogus'),
+                ('zone_purge: 10', 'must be a mapping'),
+                ('periodic_exists: {batch_size: 1}',
+                 'unknown setting batch_size'),
+                ('zone_purge: {interval: true}', 'positive integer'),
+                ('zone_purge: {interval: "10"}', 'positive integer')):
+            with self.assertRaises(ValueError) as ctxt:
+                designate.parse_producer_tasks(value)
+            self.assertIn(error, str(ctxt.exception))
+
+    def test_size_producer_tasks(self):
+        self.assertEqual(designate.size_producer_tasks(None),
+                         designate.PRODUCER_TASKS)
+        self.assertEqual(designate.size_producer_tasks(1000),
+                         designate.PRODUCER_TASKS)
+        tasks = designate.size_producer_tasks(4500)
+        self.assertEqual(tasks['zone_purge'], {
+            'interval': 720, 'per_page': 500, 'batch_size': 100})
+        self.assertEqual(tasks['delayed_notify'], {
+            'interval': 5, 'per_page': 500, 'batch_size': 500})
+        self.assertEqual(tasks['worker_periodic_recovery'], {
+            'interval': 120, 'per_page': 500})
+        tasks = designate.size_producer_tasks(
+            100000, {'zone_purge': {'batch_size': 20}})
+        self.assertEqual(tasks['zone_purge'], {
+            'interval': 600, 'per_page': 1000, 'batch_size': 20})
+        self.assertEqual(tasks['periodic_exists']['per_page'], 1000)
+
+
+class TestSectionRestarts(Helper):
+
+    CONF = (
+        '[DEFAULT]\n'
+        'debug = False\n'
+        '\n'
+        '[service:api]\n'
+        'workers = 2\n'
+        '[producer_task:zone_purge]\n'
+        'interval = 3600\n'
+        '[storage:sqlalchemy]\n'
+        'connection = mysql://db\n')
+
+    SERVICES = ['designate-mdns', 'designate-producer', 'designate-worker',
+                'designate-central', 'designate-sink', 'designate-api']
+
+    def setUp(self):
+        super(TestSectionRestarts, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.conf = os.path.join(self.tmpdir, 'designate.conf')
+        self.write(self.CONF)
+
+    def write(self, content):
+        with open(self.conf, 'w') as f:
+            f.write(content)
+
+    def test_config_section_hashes(self):
+        hashes = designate.config_section_hashes(self.conf)
+        self.assertEqual(
+            sorted(hashes),
+            ['DEFAULT', 'producer_task:zone_purge', 'service:api',
+             'storage:sqlalchemy'])
+        # comments and blank lines don't count as changes
+        self.write('# rendered by juju\n' + self.CONF + '\n; the end\n')
+        self.assertEqual(designate.config_section_hashes(self.conf), hashes)
+        self.write(self.CONF.replace('workers = 2', 'workers = 4'))
+        new_hashes = designate.config_section_hashes(self.conf)
+        self.assertNotEqual(new_hashes['service:api'], hashes['service:api'])
+        self.assertEqual(new_hashes['DEFAULT'], hashes['DEFAULT'])
+        self.assertEqual(
+            designate.config_section_hashes(self.conf + '.missing'), {})
+
+    def test_services_for_sections(self):
+        self.assertEqual(
+            designate.services_for_sections(['service:api'], self.SERVICES),
+            ['designate-api'])
+        self.assertEqual(
+            designate.services_for_sections(
+                ['producer_task:zone_purge', 'service:worker'],
+                self.SERVICES),
+            ['designate-producer', 'designate-worker'])
+        self.assertEqual(
+            designate.services_for_sections(
+                ['service:api', 'storage:sqlalchemy'], self.SERVICES),
+            self.SERVICES)
+        self.assertEqual(
+            designate.services_for_sections(['service:mdns'], self.SERVICES),
+            ['designate-mdns', 'designate-worker'])
+        # services this release doesn't run are never restarted
+        self.assertEqual(
+            designate.services_for_sections(['service:pool_manager'],
+                                            self.SERVICES),
+            [])
+        self.assertEqual(
+            designate.services_for_sections([], self.SERVICES), [])
+
+    def _restart_on_change(self, new_content):
+        self.patch_object(designate, 'DESIGNATE_CONF', new=self.conf)
+        self.patch_object(designate.DesignateCharm, 'full_restart_map',
+                          new=mock.PropertyMock(return_value={
+                              self.conf: self.SERVICES,
+                              '/root/novarc': ['']}))
+        self.patch(designate.ch_utils, 'is_unit_paused_set',
+                   return_value=False)
+        self.patch(designate.hookenv, 'config', return_value=False)
+        self.patch(designate.host, 'path_hash')
+        self.path_hash.side_effect = lambda path: (
+            open(path).read() if path == self.conf else 'same')
+        self.patch(designate.host, 'service_stop')
+        self.patch(designate.host, 'service_start')
+        a = designate.DesignateCharm(release='mitaka')
+        with a.restart_on_change():
+            self.write(new_content)
+        return [c[0][0] for c in self.service_start.call_args_list]
+
+    def test_restart_on_change_api_section(self):
+        started = self._restart_on_change(
+            self.CONF.replace('workers = 2', 'workers = 4'))
+        self.assertEqual(started, ['designate-api'])
+        self.service_stop.assert_called_once_with('designate-api')
+
+    def test_restart_on_change_shared_section(self):
+        started = self._restart_on_change(
+            self.CONF.replace('debug = False', 'debug = True'))
+        self.assertEqual(started, self.SERVICES)
+
+    def test_restart_on_change_unchanged(self):
+        started = self._restart_on_change(self.CONF)
+        self.assertEqual(started, [])
+        self.assertFalse(self.service_stop.called)
+
+
+class TestRollingRestarts(Helper):
+
+    def setUp(self):
+        super(TestRollingRestarts, self).setUp()
+        self.test_config = {'rolling-restarts': True}
+        self.patch(designate.hookenv, 'config')
+        self.config.side_effect = self.test_config.get
+        self.patch(designate.hookenv, 'is_leader', return_value=False)
+        self.patch(designate.ch_utils, 'is_unit_paused_set',
+                   return_value=False)
+        self.patch(designate.DesignateCharm, '_stop_start')
+        self.patch(designate.DesignateCharm, 'local_healthcheck_url',
+                   return_value='http://127.0.0.1:9001/healthcheck')
+        self.patch(designate.designate_api, 'ReadinessProbe')
+        for attr in ('has_peers', 'request', 'pending', 'grant_next_slot',
+                     'holds_slot', 'restarted', 'mark_restarted',
+                     'complete'):
+            self.patch(designate.rolling_restart, attr)
+        self.has_peers.return_value = True
+        self.pending.return_value = ['designate-api']
+
+    def test_restart_services_without_rolling(self):
+        self.test_config['rolling-restarts'] = False
+        a = designate.DesignateCharm(release='mitaka')
+        a.restart_services(['designate-api'])
+        self._stop_start.assert_called_once_with(['designate-api'])
+        self.assertFalse(self.request.called)
+
+    def test_restart_services_paused(self):
+        self.is_unit_paused_set.return_value = True
+        a = designate.DesignateCharm(release='mitaka')
+        a.restart_services(['designate-api'])
+        self.assertFalse(self._stop_start.called)
+        self.assertFalse(self.request.called)
+
+    def test_restart_services_rolling_waits_for_slot(self):
+        self.holds_slot.return_value = False
+        a = designate.DesignateCharm(release='mitaka')
+        a.restart_services(['designate-api'])
+        self.request.assert_called_once_with(['designate-api'])
+        self.assertFalse(self._stop_start.called)
+        self.assertFalse(self.complete.called)
+
+    def test_process_rolling_restarts_holds_slot(self):
+        self.is_leader.return_value = True
+        self.holds_slot.return_value = True
+        self.restarted.return_value = False
+        a = designate.DesignateCharm(release='mitaka')
+        a.process_rolling_restarts()
+        self._stop_start.assert_called_once_with(['designate-api'])
+        self.mark_restarted.assert_called_once_with()
+        self.ReadinessProbe.return_value.wait.assert_called_once_with(
+            mock.ANY)
+        self.complete.assert_called_once_with()
+        # the leader passes the slot on straight away
+        self.assertEqual(self.grant_next_slot.call_count, 2)
+
+    def test_process_rolling_restarts_unhealthy(self):
+        self.holds_slot.return_value = True
+        self.restarted.return_value = True
+        self.ReadinessProbe.return_value.wait.side_effect = (
+            designate.designate_api.DesignateAPIError('down'))
+        a = designate.DesignateCharm(release='mitaka')
+        a.process_rolling_restarts()
+        # already restarted for this request, so only the check is retried
+        self.assertFalse(self._stop_start.called)
+        self.assertFalse(self.complete.called)
+
+    def test_process_rolling_restarts_disabled(self):
+        self.test_config['rolling-restarts'] = False
+        a = designate.DesignateCharm(release='mitaka')
+        a.process_rolling_restarts()
+        self._stop_start.assert_called_once_with(['designate-api'])
+        self.complete.assert_called_once_with()
+
+    def test_process_rolling_restarts_nothing_pending(self):
+        self.pending.return_value = []
+        a = designate.DesignateCharm(release='mitaka')
+        a.process_rolling_restarts()
+        self.assertFalse(self.holds_slot.called)
+        self.assertFalse(self._stop_start.called)
+
+
+class TestDNSSlaves(Helper):
+
+    def test_parse_dns_slaves(self):
+        self.assertEqual(designate.parse_dns_slaves(None), ())
+        slaves = designate.parse_dns_slaves(
+            '10.0.0.1:953:key1  [fd00::1]:5353:key2')
+        self.assertEqual(slaves, (
+            designate.DNSSlave('10.0.0.1', 953, 'key1'),
+            designate.DNSSlave('fd00::1', 5353, 'key2')))
+        self.assertEqual(slaves[0].unit_name, '10_0_0_1')
+        self.assertEqual(slaves[1].rndc_key_file,
+                         '/etc/designate/rndc_fd00__1.key')
+        with self.assertRaises(AttributeError):
+            slaves[0].port = 1
+        with self.assertRaises(AttributeError):
+            slaves[0].extra = 1
+
+    def test_parse_dns_slaves_cached(self):
+        value = '10.0.0.1:953:key1 10.0.0.2:953:key2'
+        self.assertIs(designate.parse_dns_slaves(value),
+                      designate.parse_dns_slaves(value))
+
+    def test_parse_dns_slaves_invalid(self):
+        for dns_slaves in ('10.0.0.1:953',
+                           '10.0.0.1:953:key:extra',
+                           '10.0.0.1::key',
+                           'bind.example.com:953:key',
+                           '10.0.0.1:port:key',
+                           '10.0.0.1:0:key',
+                           '10.0.0.1:65536:key',
+                           'fd00::1:953:key',
+                           '[fd00::1:953:key',
+                           '[fd00::zz]:953:key'):
+            with self.assertRaises(ValueError):
+                designate.parse_dns_slaves(dns_slaves)
+
+
+class TestPools(Helper):
+
+    def test_parse_pools(self):
+        self.assertEqual(designate.parse_pools(None), {})
+        pools = designate.parse_pools(
+            'shard-b:\n'
+            '  ns-records: [ns1.b.com., ns2.b.com.]\n'
+            '  backends: designate-bind-b 10.0.0.2\n'
+            'shard-a:\n'
+            '  ns-records: ns1.a.com.\n'
+            '  also-notifies: 10.0.0.9:5353 fd00::9:53\n')
+        self.assertEqual(list(pools.keys()), ['shard-b', 'shard-a'])
+        self.assertEqual(pools['shard-b']['ns_records'],
+                         ['ns1.b.com.', 'ns2.b.com.'])
+        self.assertEqual(pools['shard-b']['backends'],
+                         ['designate-bind-b', '10.0.0.2'])
+        self.assertEqual(pools['shard-a']['backends'], [])
+        self.assertEqual(pools['shard-a']['also_notifies'],
+                         [{'address': '10.0.0.9', 'port': '5353'},
+                          {'address': 'fd00::9', 'port': '53'}])
+        # pool ids are stable and distinct
+        self.assertEqual(
+            pools['shard-a']['id'],
+            designate.parse_pools(
+                'shard-a: {ns-records: ns.a.com.}')['shard-a']['id'])
+        self.assertNotEqual(pools['shard-a']['id'], pools['shard-b']['id'])
+        self.assertIsNone(pools['shard-a']['catalog_zone'])
+
+    def test_parse_pools_catalog_zone(self):
+        pools = designate.parse_pools(
+            'shard: {ns-records: ns.a.com., catalog-zone: catalog.a.com}')
+        self.assertEqual(pools['shard']['catalog_zone'], 'catalog.a.com.')
+
+    def test_parse_pools_invalid(self):
+        for pools_config in (
+                'shard: [',
+                '- shard',
+                'default: {ns-records: ns.com.}',
+                'shard: ns.com.',
+                'shard: {ns-records: ns.com., targets: x}',
+                'shard: {backends: bind}',
+                'shard: {ns-records: ns.com., also-notifies: 10.0.0.1}',
+                'shard: {ns-records: ns.com., attributes: [a]}',
+                'a: {ns-records: ns.com., backends: bind}\n'
+                'b: {ns-records: ns.com., backends: bind}'):
+            with self.assertRaises(ValueError):
+                designate.parse_pools(pools_config)
+
+    def test_configured_pools_invalid(self):
+        self.patch(designate.hookenv, 'config', return_value='- shard')
+        self.assertEqual(designate.configured_pools(), {})
+
+    def test_pool_for_backend(self):
+        pools = designate.parse_pools(
+            'shard: {ns-records: ns.com., backends: bind-a 10.0.0.1}')
+        self.assertEqual(designate.pool_for_backend(pools, 'bind-a'),
+                         'shard')
+        self.assertEqual(designate.pool_for_backend(pools, '10.0.0.1'),
+                         'shard')
+        self.assertEqual(designate.pool_for_backend(pools, 'bind-b'),
+                         'default')
+
 
 class TestDesignateCharm(Helper):
 
@@ -241,110 +989,197 @@ class TestDesignateCharm(Helper):
         self.patch(
             designate.DesignateCharm,
             'render_with_interfaces')
+        self.patch(designate.DesignateCharm, 'configure_sink',
+                   return_value=False)
+        self.patch_object(designate.DesignateCharm, 'full_restart_map',
+                          new=mock.PropertyMock(return_value={
+                              '/etc/default/openstack': ['svc'],
+                              '/etc/designate/designate.conf': ['svc'],
+                              '/etc/haproxy/haproxy.cfg': ['haproxy']}))
         a = designate.DesignateCharm(release='mitaka')
         a.render_full_config('interface_list')
-        self.render_with_interfaces.assert_called_with('interface_list')
+        self.render_with_interfaces.assert_called_once_with(
+            'interface_list',
+            configs=['/etc/default/openstack',
+                     '/etc/designate/designate.conf',
+                     '/etc/haproxy/haproxy.cfg'])
+
+    def test_render_full_config_defers_sinks(self):
+        self.patch(
+            designate.DesignateCharm,
+            'render_with_interfaces')
+        self.patch(designate.DesignateCharm, 'configure_sink',
+                   return_value=True)
+        self.patch_object(designate.DesignateCharm, 'full_restart_map',
+                          new=mock.PropertyMock(return_value={
+                              '/etc/default/openstack': ['svc'],
+                              '/etc/designate/designate.conf': ['svc'],
+                              designate.NOVA_SINK_FILE: ['svc'],
+                              designate.NEUTRON_SINK_FILE: ['svc']}))
+        a = designate.DesignateCharm(release='mitaka')
+        a.render_full_config('interface_list')
+        self.render_with_interfaces.assert_called_once_with(
+            'interface_list',
+            configs=['/etc/designate/designate.conf'])
+
+    def key_dir(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.patch_object(designate, 'RNDC_KEY_FILE',
+                          new=os.path.join(tmpdir, 'rndc_{}.key'))
+        self.patch(designate, '_rndc_key_owner',
+                   return_value=(os.getuid(), os.getgid()))
+        return tmpdir
 
     def test_write_key_file(self):
-        self.patch(designate.host, 'write_file')
+        tmpdir = self.key_dir()
         a = designate.DesignateCharm(release='mitaka')
-        a.write_key_file('unit1', 'keydigest')
-        self.write_file.assert_called_with(
-            '/etc/designate/rndc_unit1.key',
-            mock.ANY,
-            owner='root',
-            group='designate',
-            perms=0o440)
+        self.assertTrue(a.write_key_file('unit1', 'keydigest'))
+        key_file = os.path.join(tmpdir, 'rndc_unit1.key')
+        with open(key_file) as f:
+            self.assertIn('secret "keydigest";', f.read())
+        self.assertEqual(os.stat(key_file).st_mode & 0o777, 0o440)
+        self.assertFalse(a.write_key_file('unit1', 'keydigest'))
+        self.assertTrue(a.write_key_file('unit1', 'newdigest'))
+        self.assertEqual(os.listdir(tmpdir), ['rndc_unit1.key'])
 
-    def test_render_rndc_keys(self):
-        test_config = {
-            'dns-slaves': '10.0.0.10:port1:key1 192.168.23.4:port2:key2',
-        }
-        self.patch(designate.DesignateCharm, 'write_key_file')
+    def test_rndc_keys(self):
+        conversations = []
+        for scope, key in (('designate-bind-t1/1', 'rndckey1'),
+                           ('designate-bind-t1/0', 'rndckey1'),
+                           ('designate-bind-t0/1', 'rndckey2'),
+                           ('designate-bind-t2/0', None)):
+            conversation = mock.MagicMock(scope=scope)
+            conversation.get_remote.return_value = key
+            conversations.append(conversation)
+        endpoint = mock.MagicMock()
+        endpoint.conversations.return_value = conversations
+        self.patch(designate.relations, 'endpoint_from_flag',
+                   return_value=endpoint)
+        test_config = {'dns-slaves': '10.0.0.10:953:key1'}
         with mock.patch.object(designate.hookenv, 'config',
                                side_effect=FakeConfig(test_config)):
-            a = designate.DesignateCharm(release='mitaka')
-            a.render_rndc_keys()
-            calls = [
-                mock.call('10_0_0_10', 'key1'),
-                mock.call('192_168_23_4', 'key2'),
-            ]
-            self.write_key_file.assert_has_calls(calls)
-
-    def test_rndc_keys(self):
+            d = designate.DesignateCharm(release='mitaka')
+            keys, pending = d.rndc_keys()
+        self.assertEqual(keys, {'10_0_0_10': 'key1',
+                                'designate_bind_t1': 'rndckey1',
+                                'designate_bind_t0': 'rndckey2'})
+        self.assertEqual(pending, {'designate_bind_t2'})
 
-        def fake_conversations():
-            conversations = []
-            Conversation = mock.Mock()
-            Conversation.key = 'reactive.conversations.dns-backend:65.'
-            'designate-bind-t1/1'
-            Conversation.namespace = 'dns-backend:65'
-            self.patch(Conversation, 'relation_ids',
-                       return_value='dns-backend:65')
-            Conversation.relation_name = 'dns-backend'
-            Conversation.scope = 'designate-bind-t1/1'
-            self.patch(Conversation, 'get_remote', return_value='rndckey1')
-            conversations.append(Conversation)
-            Conversation = mock.Mock()
-            Conversation.key = 'reactive.conversations.dns-backend:66.'
-            'designate-bind-t0/1'
-            Conversation.namespace = 'dns-backend:66'
-            self.patch(Conversation, 'relation_ids',
-                       return_value='dns-backend:66')
-            Conversation.relation_name = 'dns-backend'
-            Conversation.scope = 'designate-bind-t0/1'
-            self.patch(Conversation, 'get_remote', return_value='rndckey2')
-            conversations.append(Conversation)
-            return conversations
-
-        mock_endpoint_from_flag = mock.MagicMock()
-        mock_endpoint_from_flag.conversations.side_effect = fake_conversations
-
-        def fake_endpoint_from_flag(*args, **kwargs):
-            return mock_endpoint_from_flag
+    def test_render_rndc_keys(self):
+        tmpdir = self.key_dir()
+        keys = {'10_0_0_10': 'key1', 'designate_bind_t0': 'key2'}
+        pending = set()
+        self.patch(designate.DesignateCharm, 'rndc_keys',
+                   side_effect=lambda: (keys, pending))
+        self.patch(designate.DesignateCharm, 'restart_services')
+        self.patch(designate.hookenv, 'log')
+        a = designate.DesignateCharmRocky(release='rocky')
+        self.assertTrue(a.render_rndc_keys())
+        self.restart_services.assert_called_once_with(['designate-worker'])
+        self.assertEqual(sorted(os.listdir(tmpdir)),
+                         ['rndc_10_0_0_10.key', 'rndc_designate_bind_t0.key'])
+        # nothing changed, so no restart
+        self.restart_services.reset_mock()
+        self.assertFalse(a.render_rndc_keys())
+        self.assertFalse(self.restart_services.called)
+        # departed backends lose their key unless it is still to come
+        del keys['designate_bind_t0']
+        pending.add('designate_bind_t0')
+        self.assertFalse(a.render_rndc_keys())
+        pending.clear()
+        with open(os.path.join(tmpdir, 'rndc.key'), 'w') as f:
+            f.write('shared key')
+        self.assertTrue(a.render_rndc_keys())
+        self.restart_services.assert_called_once_with(['designate-worker'])
+        self.assertEqual(sorted(os.listdir(tmpdir)),
+                         ['rndc.key', 'rndc_10_0_0_10.key'])
 
-        relation = mock.MagicMock()
+    def test_render_rndc_keys_malformed(self):
+        self.key_dir()
+        self.patch(designate.DesignateCharm, 'rndc_keys',
+                   side_effect=ValueError('bad'))
         self.patch(designate.DesignateCharm, 'write_key_file')
-        self.patch(designate.relations, 'endpoint_from_flag',
-                   side_effect=fake_endpoint_from_flag)
-
-        designate.DesignateConfigurationAdapter(relation)
-        d = designate.DesignateCharm()
-        d.render_relation_rndc_keys()
-        calls = [
-            mock.call('designate_bind_t1', 'rndckey1'),
-            mock.call('designate_bind_t0', 'rndckey2'),
-        ]
+        self.patch(designate.hookenv, 'log')
+        a = designate.DesignateCharm(release='mitaka')
+        self.assertFalse(a.render_rndc_keys())
+        self.assertFalse(self.write_key_file.called)
 
-        self.write_key_file.assert_has_calls(calls)
+    def test_backend_targets(self):
+        dns_backend = mock.MagicMock()
+        dns_backend.slave_ips.return_value = [
+            {'unit': 'designate-bind/0', 'address': '10.0.0.20'}]
+        self.patch(designate.relations, 'endpoint_from_flag',
+                   return_value=dns_backend)
+        self.patch(designate, 'configured_pools', return_value={})
+        self.patch(designate.DesignateCharm, 'options',
+                   new_callable=mock.PropertyMock)
+        self.options.return_value.pool_config = [
+            {'nameserver': 'nameserver_10_0_0_10',
+             'pool_target': 'nameserver_10_0_0_10',
+             'address': '10.0.0.10',
+             'rndc_key_file': '/etc/designate/rndc_10_0_0_10.key',
+             'pool': 'default',
+             'catalog': True}]
+        a = designate.DesignateCharm(release='mitaka')
+        self.assertEqual(a.backend_targets(), [
+            {'name': 'nameserver_designate_bind',
+             'address': '10.0.0.20',
+             'rndc_key_file': '/etc/designate/rndc_designate_bind.key',
+             'catalog': False},
+            {'name': 'nameserver_10_0_0_10',
+             'address': '10.0.0.10',
+             'rndc_key_file': '/etc/designate/rndc_10_0_0_10.key',
+             'catalog': True}])
 
     def test_get_domain_id(self):
         self.patch(designate.DesignateCharm, 'ensure_api_responding')
-        self.patch(designate.subprocess, 'check_output')
-        self.check_output.return_value = b'hi\n'
+        client = mock.MagicMock()
+        client.get_zone_id.return_value = 'hi'
+        self.patch(designate.designate_api, 'get_client', return_value=client)
         self.assertEqual(designate.DesignateCharm.get_domain_id('domain'),
                          'hi')
-        self.check_output.assert_called_with(
-            ['reactive/designate_utils.py',
-             'domain-get', '--domain-name', 'domain'])
+        self.get_client.assert_called_with('/root/novarc')
+        client.get_zone_id.assert_called_with('domain')
 
     def test_create_domain(self):
         self.patch(designate.DesignateCharm, 'ensure_api_responding')
-        self.patch(designate.subprocess, 'check_call')
+        client = mock.MagicMock()
+        self.patch(designate.designate_api, 'get_client', return_value=client)
         designate.DesignateCharm.create_domain('domain', 'email')
-        self.check_call.assert_called_with(
-            ['reactive/designate_utils.py',
-             'domain-create', '--domain-name', 'domain',
-             '--email', 'email'])
+        client.create_zone.assert_called_with('domain', 'email')
 
     def test_create_server(self):
-        self.patch(designate.subprocess, 'check_call')
         self.patch(designate.DesignateCharm, 'ensure_api_responding')
+        client = mock.MagicMock()
+        self.patch(designate.designate_api, 'get_client', return_value=client)
         designate.DesignateCharm.create_server('nameservername')
-        self.check_call.assert_called_with(
-            ['reactive/designate_utils.py',
-             'server-create', '--server-name',
-             'nameservername'])
+        client.create_server.assert_called_with('nameservername')
+
+    def test_ensure_api_responding(self):
+        client = mock.MagicMock()
+        self.patch(designate.designate_api, 'get_client', return_value=client)
+        self.patch(designate.designate_api, 'wait_until_ready')
+        designate.DesignateCharm.ensure_api_responding()
+        self.wait_until_ready.assert_called_once_with(client)
+
+    def test_ensure_token_cache_secret(self):
+        self.patch(designate.hookenv, 'is_leader', return_value=True)
+        self.patch(designate.hookenv, 'leader_get', return_value=None)
+        self.patch(designate.hookenv, 'leader_set')
+        self.patch(designate.host, 'pwgen', return_value='s3cret')
+        designate.DesignateCharm.ensure_token_cache_secret()
+        self.pwgen.assert_called_once_with(32)
+        self.leader_set.assert_called_once_with(
+            {'token-cache-secret': 's3cret'})
+        # an existing secret is kept, and only the leader generates one
+        self.leader_set.reset_mock()
+        self.leader_get.return_value = 'old'
+        designate.DesignateCharm.ensure_token_cache_secret()
+        self.leader_get.return_value = None
+        self.is_leader.return_value = False
+        designate.DesignateCharm.ensure_token_cache_secret()
+        self.assertFalse(self.leader_set.called)
 
     def test_domain_init_done(self):
         self.patch(designate.hookenv, 'leader_get')
@@ -355,6 +1190,30 @@ class TestDesignateCharm(Helper):
         a = designate.DesignateCharm(release='mitaka')
         self.assertFalse(a.domain_init_done())
 
+    def test_provision_servers_and_domains(self):
+        self.patch(designate.DesignateCharm, 'ensure_api_responding')
+        client = mock.MagicMock()
+        results = [
+            designate.designate_api.ProvisionResult(
+                'server', 'ns1.', 'sid1', 'exists', None),
+            designate.designate_api.ProvisionResult(
+                'zone', 'novadomain', 'zid1', 'created', None)]
+        client.ensure_servers_and_zones.return_value = results
+        self.patch(designate.designate_api, 'get_client', return_value=client)
+        self.assertEqual(
+            designate.DesignateCharm.provision_servers_and_domains(
+                ['ns1.'], [('novadomain', 'novaemail')]),
+            results)
+        self.ensure_api_responding.assert_called_once_with()
+        client.ensure_servers_and_zones.assert_called_once_with(
+            ['ns1.'], [('novadomain', 'novaemail')])
+        client.ensure_servers_and_zones.return_value = [
+            designate.designate_api.ProvisionResult(
+                'server', 'ns1.', None, 'failed', 'boom')]
+        with self.assertRaises(designate.designate_api.DesignateAPIError):
+            designate.DesignateCharm.provision_servers_and_domains(
+                ['ns1.'], [])
+
     def test_create_initial_servers_and_domains(self):
         test_config = {
             'nameservers': 'dnsserverrec1. dnsserverrec2',
@@ -363,13 +1222,10 @@ class TestDesignateCharm(Helper):
             'neutron-domain': 'neutrondomain',
             'neutron-domain-email': 'neutronemail',
         }
-        self.patch(designate.DesignateCharm, 'ensure_api_responding')
-        self.ensure_api_responding.return_value = True
         self.patch(designate.hookenv, 'is_leader', return_value=True)
         self.patch(designate.hookenv, 'leader_set')
         self.patch(designate.hookenv, 'leader_get', return_value=False)
-        self.patch(designate.DesignateCharm, 'create_server')
-        self.patch(designate.DesignateCharm, 'create_domain')
+        self.patch(designate.DesignateCharm, 'provision_servers_and_domains')
 
         @contextlib.contextmanager
         def fake_check_zone_ids(a, b):
@@ -379,37 +1235,167 @@ class TestDesignateCharm(Helper):
         with mock.patch.object(designate.hookenv, 'config',
                                side_effect=FakeConfig(test_config)):
             designate.DesignateCharm.create_initial_servers_and_domains()
-            self.create_server.assert_has_calls([mock.call('dnsserverrec1.'),
-                                                 mock.call('dnsserverrec2.')])
-            calls = [
-                mock.call('novadomain', 'novaemail'),
-                mock.call('neutrondomain', 'neutronemail')]
-            self.create_domain.assert_has_calls(calls)
+            self.provision_servers_and_domains.assert_called_once_with(
+                ['dnsserverrec1.', 'dnsserverrec2.'],
+                [('novadomain', 'novaemail'),
+                 ('neutrondomain', 'neutronemail')])
+            self.leader_set.assert_called_once_with(
+                {'create_initial_servers_and_domains': 'done'})
+
+    def test_get_domain_ids(self):
+        self.patch(designate.DesignateCharm, 'ensure_api_responding')
+        client = mock.MagicMock()
+        client.get_zone_ids.return_value = {'novadom': 'novaid1'}
+        self.patch(designate.designate_api, 'get_client', return_value=client)
+        self.assertEqual(
+            designate.DesignateCharm.get_domain_ids('novadom', None),
+            {'novadom': 'novaid1', None: None})
+        client.get_zone_ids.assert_called_once_with(['novadom'])
+        self.ensure_api_responding.assert_called_once_with()
+        self.ensure_api_responding.reset_mock()
+        self.assertEqual(designate.DesignateCharm.get_domain_ids(None),
+                         {None: None})
+        self.assertFalse(self.ensure_api_responding.called)
 
     def test_check_zone_ids_change(self):
         self.patch(designate.hookenv, 'leader_set')
-        DOMAIN_LOOKSUPS = ['novaid1', 'neutronid1', 'novaid1', 'neutronid2']
+        self.patch(designate.hookenv, 'leader_get', return_value=None)
+        self.addCleanup(designate.DesignateCharm._resolved_domain_ids.clear)
+        DOMAIN_LOOKSUPS = [
+            {'novadom': 'novaid1', 'neutrondom': 'neutronid2'},
+            {'novadom': 'novaid1', 'neutrondom': 'neutronid1'}]
 
-        def fake_get_domain_id(a):
+        def fake_get_domain_ids(*domains):
             return DOMAIN_LOOKSUPS.pop()
-        self.patch(designate.DesignateCharm, 'get_domain_id',
-                   side_effect=fake_get_domain_id)
+        self.patch(designate.DesignateCharm, 'get_domain_ids',
+                   side_effect=fake_get_domain_ids)
         with designate.DesignateCharm.check_zone_ids('novadom', 'neutrondom'):
             pass
-        self.leader_set.assert_called_once_with({'domain-init-done': mock.ANY})
+        self.get_domain_ids.assert_called_with('novadom', 'neutrondom')
+        self.leader_set.assert_called_once_with({
+            'domain-init-done': mock.ANY,
+            'domain-ids': '{"neutrondom": "neutronid2", "novadom": "novaid1"}',
+        })
 
     def test_check_zone_ids_nochange(self):
         self.patch(designate.hookenv, 'leader_set')
-        DOMAIN_LOOKSUPS = ['novaid1', 'neutronid1', 'novaid1', 'neutronid1']
+        self.patch(designate.hookenv, 'leader_get',
+                   return_value='{"neutrondom": "neutronid1", '
+                                '"novadom": "novaid1"}')
+        DOMAIN_LOOKSUPS = [
+            {'novadom': 'novaid1', 'neutrondom': 'neutronid1'},
+            {'novadom': 'novaid1', 'neutrondom': 'neutronid1'}]
 
-        def fake_get_domain_id(a):
+        def fake_get_domain_ids(*domains):
             return DOMAIN_LOOKSUPS.pop()
-        self.patch(designate.DesignateCharm, 'get_domain_id',
-                   side_effect=fake_get_domain_id)
+        self.patch(designate.DesignateCharm, 'get_domain_ids',
+                   side_effect=fake_get_domain_ids)
         with designate.DesignateCharm.check_zone_ids('novadom', 'neutrondom'):
             pass
         self.assertFalse(self.leader_set.called)
 
+    def test_resolve_domain_id(self):
+        self.addCleanup(designate.DesignateCharm._resolved_domain_ids.clear)
+        self.patch(designate.hookenv, 'leader_get',
+                   return_value='{"novadom": "novaid1"}')
+        self.patch(designate.hookenv, 'is_leader', return_value=False)
+        self.patch(designate.DesignateCharm, 'get_domain_id',
+                   return_value='apiid')
+        self.assertEqual(
+            designate.DesignateCharm.resolve_domain_id('novadom'), 'novaid1')
+        self.assertIsNone(
+            designate.DesignateCharm.resolve_domain_id('neutrondom'))
+        self.assertIsNone(designate.DesignateCharm.resolve_domain_id(None))
+        self.assertFalse(self.get_domain_id.called)
+        # memoized for the rest of the hook
+        designate.DesignateCharm.resolve_domain_id('novadom')
+        self.assertEqual(self.leader_get.call_count, 2)
+
+    def test_resolve_domain_id_leader(self):
+        self.addCleanup(designate.DesignateCharm._resolved_domain_ids.clear)
+        self.patch(designate.hookenv, 'leader_get', return_value=None)
+        self.patch(designate.hookenv, 'is_leader', return_value=True)
+        self.patch(designate.DesignateCharm, 'get_domain_id',
+                   return_value='apiid')
+        self.assertEqual(
+            designate.DesignateCharm.resolve_domain_id('novadom'), 'apiid')
+        designate.DesignateCharm.resolve_domain_id('novadom')
+        self.get_domain_id.assert_called_once_with('novadom')
+
+    def test_ensure_domain_ids_published(self):
+        self.addCleanup(designate.DesignateCharm._resolved_domain_ids.clear)
+        test_config = {
+            'nova-domain': 'novadom',
+            'neutron-domain': 'neutrondom',
+        }
+        self.patch(designate.hookenv, 'is_leader', return_value=True)
+        self.patch(designate.hookenv, 'leader_set')
+        self.patch(designate.hookenv, 'leader_get',
+                   return_value='{"novadom": "novaid1"}')
+        self.patch(designate.DesignateCharm, 'get_domain_ids',
+                   return_value={'neutrondom': 'neutronid1'})
+        with mock.patch.object(designate.hookenv, 'config',
+                               side_effect=FakeConfig(test_config)):
+            designate.DesignateCharm.ensure_domain_ids_published()
+            self.get_domain_ids.assert_called_once_with('neutrondom')
+            self.leader_set.assert_called_once_with({
+                'domain-init-done': mock.ANY,
+                'domain-ids': '{"neutrondom": "neutronid1", '
+                              '"novadom": "novaid1"}',
+            })
+            self.is_leader.return_value = False
+            self.get_domain_ids.reset_mock()
+            designate.DesignateCharm.ensure_domain_ids_published()
+            self.assertFalse(self.get_domain_ids.called)
+
+    def test_update_pools(self):
+        self.patch(designate.hookenv, 'is_leader', return_value=True)
+        self.patch(designate.hookenv, 'leader_get', return_value='oldhash')
+        self.patch(designate.hookenv, 'leader_set')
+        self.patch(designate.host, 'file_hash', return_value='newhash')
+        self.patch(designate.hook_metrics, 'check_call')
+        a = designate.DesignateCharm(release='mitaka')
+        a.update_pools()
+        self.check_call.assert_called_once_with(
+            ['designate-manage', 'pool', 'update'], timeout=60)
+        self.leader_set.assert_called_once_with({'pool-yaml-hash': 'newhash'})
+
+    def test_update_pools_unchanged(self):
+        self.patch(designate.hookenv, 'is_leader', return_value=True)
+        self.patch(designate.hookenv, 'leader_get', return_value='samehash')
+        self.patch(designate.hookenv, 'leader_set')
+        self.patch(designate.host, 'file_hash', return_value='samehash')
+        self.patch(designate.hook_metrics, 'check_call')
+        a = designate.DesignateCharm(release='mitaka')
+        a.update_pools()
+        self.assertFalse(self.check_call.called)
+        self.assertFalse(self.leader_set.called)
+        # nothing to push before pools.yaml has been rendered
+        self.file_hash.return_value = None
+        self.leader_get.return_value = None
+        a.update_pools()
+        self.assertFalse(self.check_call.called)
+
+    def test_update_pools_failed(self):
+        self.patch(designate.hookenv, 'is_leader', return_value=True)
+        self.patch(designate.hookenv, 'leader_get', return_value='oldhash')
+        self.patch(designate.hookenv, 'leader_set')
+        self.patch(designate.host, 'file_hash', return_value='newhash')
+        self.patch(designate.hook_metrics, 'check_call')
+        self.check_call.side_effect = designate.subprocess.TimeoutExpired(
+            'designate-manage', 60)
+        a = designate.DesignateCharm(release='mitaka')
+        a.update_pools()
+        # the hash is not recorded so that the next hook tries again
+        self.assertFalse(self.leader_set.called)
+
+    def test_update_pools_not_leader(self):
+        self.patch(designate.hookenv, 'is_leader', return_value=False)
+        self.patch(designate.hook_metrics, 'check_call')
+        a = designate.DesignateCharm(release='mitaka')
+        a.update_pools()
+        self.assertFalse(self.check_call.called)
+
     def test_render_nrpe(self):
         self.patch_object(designate.nrpe, 'add_init_service_checks')
         charm_instance = designate.DesignateCharm(release='queens')
@@ -555,3 +1541,9 @@ class TestDesignateQueensCharm(Helper):
         a.run_upgrade()
         self.run_upgrade.assert_called_once_with(interfaces_list=None)
         endpoint.request_restart.assert_called_once_with()
+
+    def test_supports_catalog_zones(self):
+        a = designate.DesignateCharmQueens(release='queens')
+        self.assertFalse(a.supports_catalog_zones())
+        a = designate.DesignateCharmCaracal(release='caracal')
+        self.assertTrue(a.supports_catalog_zones())
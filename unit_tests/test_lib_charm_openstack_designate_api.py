@@ -0,0 +1,584 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+import charm.openstack.designate_api as designate_api
+
+V3_CREDS = {
+    'OS_AUTH_URL': 'http://keystone:5000/v3',
+    'OS_USERNAME': 'designate',
+    'OS_PASSWORD': 'secret',
+    'OS_USER_DOMAIN_NAME': 'default',
+    'OS_PROJECT_DOMAIN_NAME': 'default',
+    'OS_PROJECT_NAME': 'services',
+    'OS_IDENTITY_API_VERSION': '3',
+    'OS_DNS_ENDPOINT': 'http://10.0.0.10:9001',
+}
+
+V2_CREDS = {
+    'OS_AUTH_URL': 'http://keystone:5000/v2.0',
+    'OS_TENANT_NAME': 'services',
+    'OS_USERNAME': 'designate',
+    'OS_PASSWORD': 'secret',
+    'OS_DNS_ENDPOINT': 'http://10.0.0.10:9001/',
+}
+
+
+def fake_response(status_code=200, json=None, headers=None):
+    resp = mock.MagicMock()
+    resp.status_code = status_code
+    resp.json.return_value = json
+    resp.headers = headers or {}
+    resp.text = ''
+    return resp
+
+
+class TestDesignateClient(unittest.TestCase):
+
+    def setUp(self):
+        self.session = mock.MagicMock()
+        patcher = mock.patch.object(designate_api.requests, 'Session',
+                                    return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_environment(self):
+        text_file_data = '\n'.join(["export a=b", "export c=d=e", ""])
+        with mock.patch('builtins.open',
+                        mock.mock_open(read_data=text_file_data),
+                        create=True) as m:
+            m.return_value.__iter__.return_value = text_file_data.splitlines()
+            self.assertEqual(
+                designate_api.get_environment({}, rc_file='rcfile'),
+                {'a': 'b', 'c': 'd=e'})
+            m.assert_called_once_with('rcfile', 'r')
+
+    def test_authenticate_v3(self):
+        self.session.request.return_value = fake_response(
+            201, headers={'X-Subject-Token': 'tok1'},
+            json={'token': {'expires_at': '2030-01-01T00:00:00.000000Z'}})
+        client = designate_api.DesignateClient(V3_CREDS)
+        self.assertEqual(client.authenticate(), 'tok1')
+        self.session.request.assert_called_once_with(
+            'POST', 'http://keystone:5000/v3/auth/tokens',
+            timeout=30, json=mock.ANY)
+        body = self.session.request.call_args[1]['json']
+        self.assertEqual(
+            body['auth']['scope']['project']['name'], 'services')
+
+    def test_authenticate_v2(self):
+        self.session.request.return_value = fake_response(
+            200, json={'access': {'token': {
+                'id': 'tok2', 'expires': '2030-01-01T00:00:00Z'}}})
+        client = designate_api.DesignateClient(V2_CREDS)
+        self.assertEqual(client.authenticate(), 'tok2')
+        self.session.request.assert_called_once_with(
+            'POST', 'http://keystone:5000/v2.0/tokens',
+            timeout=30, json=mock.ANY)
+
+    def test_request_reuses_token(self):
+        client = designate_api.DesignateClient(V2_CREDS)
+        client.token = 'tok'
+        self.session.request.return_value = fake_response(
+            200, json={'zones': []})
+        client.request('GET', '/v2/zones')
+        client.request('GET', '/v2/zones')
+        self.session.request.assert_called_with(
+            'GET', 'http://10.0.0.10:9001/v2/zones',
+            timeout=30, headers={'X-Auth-Token': 'tok'})
+        self.assertEqual(self.session.request.call_count, 2)
+
+    def test_request_reauthenticates_on_401(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'expired'
+        self.session.request.side_effect = [
+            fake_response(401),
+            fake_response(201, headers={'X-Subject-Token': 'fresh'},
+                          json={'token': {'expires_at': '2030-01-01Z'}}),
+            fake_response(200, json={'zones': []}),
+        ]
+        client.request('GET', '/v2/zones')
+        self.assertEqual(client.token, 'fresh')
+        self.session.request.assert_called_with(
+            'GET', 'http://10.0.0.10:9001/v2/zones',
+            timeout=30, headers={'X-Auth-Token': 'fresh'})
+
+    def test_request_error(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        self.session.request.return_value = fake_response(500)
+        with self.assertRaises(designate_api.DesignateAPIError) as ctx:
+            client.request('GET', '/v2/zones')
+        self.assertEqual(ctx.exception.status_code, 500)
+
+    def test_request_connection_error(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        self.session.request.side_effect = (
+            designate_api.requests.ConnectionError('refused'))
+        with self.assertRaises(designate_api.DesignateAPIError):
+            client.request('GET', '/v2/zones')
+
+    def test_iter_zones_pages(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        self.session.request.side_effect = [
+            fake_response(200, json={
+                'zones': [{'id': 'id1', 'name': 'frodo.com.', 'serial': 1}],
+                'links': {'next': 'https://public:9001/v2/zones'
+                                  '?limit=1&marker=id1'}}),
+            fake_response(200, json={
+                'zones': [{'id': 'id2', 'name': 'bilbo.com.', 'serial': 2}],
+                'links': {}}),
+        ]
+        self.assertEqual([z['id'] for z in client.iter_zones(limit=1)],
+                         ['id1', 'id2'])
+        self.session.request.assert_has_calls([
+            mock.call('GET', 'http://10.0.0.10:9001/v2/zones', timeout=30,
+                      headers={'X-Auth-Token': 'tok'},
+                      params={'limit': 1}),
+            mock.call('GET', 'http://10.0.0.10:9001/v2/zones', timeout=30,
+                      headers={'X-Auth-Token': 'tok'},
+                      params={'limit': '1', 'marker': 'id1'}),
+        ])
+
+    def test_get_zones(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        self.session.request.return_value = fake_response(200, json={
+            'zones': [{'id': 'id1', 'name': 'frodo.com.', 'serial': 1},
+                      {'id': 'id2', 'name': 'bilbo.com.', 'serial': 2}]})
+        self.assertEqual(client.get_zones(), {
+            'frodo.com.': {'id': 'id1', 'serial': 1},
+            'bilbo.com.': {'id': 'id2', 'serial': 2}})
+
+    def test_get_zone_id(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        self.session.request.return_value = fake_response(200, json={
+            'zones': [{'id': 'id2', 'name': 'bilbo.com.', 'serial': 2}]})
+        self.assertEqual(client.get_zone_id('bilbo.com.'), 'id2')
+        self.session.request.assert_called_once_with(
+            'GET', 'http://10.0.0.10:9001/v2/zones', timeout=30,
+            headers={'X-Auth-Token': 'tok'},
+            params={'name': 'bilbo.com.', 'limit': 1})
+        self.session.request.return_value = fake_response(
+            200, json={'zones': []})
+        self.assertIsNone(client.get_zone_id('sam.com.'))
+
+    def test_create_zone(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        self.session.request.side_effect = [
+            fake_response(200, json={'zones': []}),
+            fake_response(202, json={'id': 'newid'}),
+        ]
+        self.assertEqual(client.create_zone('frodo.com.', 'a@b.com'),
+                         'newid')
+        self.session.request.assert_called_with(
+            'POST', 'http://10.0.0.10:9001/v2/zones',
+            timeout=30, headers={'X-Auth-Token': 'tok'},
+            json={'name': 'frodo.com.', 'email': 'a@b.com'})
+
+    def test_delete_zone(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        self.session.request.side_effect = [
+            fake_response(200, json={'zones': [
+                {'id': 'id1', 'name': 'frodo.com.', 'serial': 1}]}),
+            fake_response(202),
+        ]
+        client.delete_zone('frodo.com.')
+        self.session.request.assert_called_with(
+            'DELETE', 'http://10.0.0.10:9001/v2/zones/id1', timeout=30,
+            headers={'X-Auth-Token': 'tok'})
+
+    def test_create_zone_exists(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        self.session.request.return_value = fake_response(200, json={
+            'zones': [{'id': 'id1', 'name': 'frodo.com.', 'serial': 1}]})
+        self.assertEqual(client.create_zone('frodo.com.', 'a@b.com'), 'id1')
+        self.assertEqual(self.session.request.call_count, 1)
+
+    def test_create_server(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        self.session.request.side_effect = [
+            fake_response(200, json={'servers': [
+                {'id': 'sid1', 'name': 'ns1.example.com.'}]}),
+            fake_response(200, json={'id': 'sid2'}),
+        ]
+        self.assertEqual(client.create_server('ns2.example.com.'), 'sid2')
+        self.session.request.assert_called_with(
+            'POST', 'http://10.0.0.10:9001/v1/servers',
+            timeout=30, headers={'X-Auth-Token': 'tok'},
+            json={'name': 'ns2.example.com.'})
+
+    def test_run_concurrently(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+
+        def fail():
+            raise designate_api.DesignateAPIError('boom')
+        results = client.run_concurrently(
+            [lambda: 1, fail, lambda: 3], limit=2)
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], designate_api.DesignateAPIError)
+        self.assertEqual(results[2], 3)
+        self.assertEqual(client.run_concurrently([]), [])
+
+    def test_get_zone_ids(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        zone_ids = {'nova.com.': 'zid1'}
+        with mock.patch.object(client, 'get_zone_id',
+                               side_effect=zone_ids.get):
+            self.assertEqual(client.get_zone_ids(['nova.com.', 'x.com.']),
+                             {'nova.com.': 'zid1', 'x.com.': None})
+
+    def test_ensure_servers_and_zones(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+
+        def fake_request(method, url, **kwargs):
+            if url.endswith('/v1/servers'):
+                if method == 'GET':
+                    return fake_response(200, json={'servers': [
+                        {'id': 'sid1', 'name': 'ns1.example.com.'}]})
+                return fake_response(200, json={'id': 'sid2'})
+            if method == 'GET':
+                if kwargs['params']['name'] == 'nova.com.':
+                    return fake_response(200, json={'zones': [
+                        {'id': 'zid1', 'name': 'nova.com.', 'serial': 1}]})
+                return fake_response(200, json={'zones': []})
+            return fake_response(500)
+        self.session.request.side_effect = fake_request
+        results = client.ensure_servers_and_zones(
+            ['ns1.example.com.', 'ns2.example.com.'],
+            [('nova.com.', 'a@b.com'), ('neutron.com.', 'a@b.com')])
+        self.assertEqual(
+            [(r.kind, r.name, r.id, r.status) for r in results],
+            [('server', 'ns1.example.com.', 'sid1', 'exists'),
+             ('server', 'ns2.example.com.', 'sid2', 'created'),
+             ('zone', 'nova.com.', 'zid1', 'exists'),
+             ('zone', 'neutron.com.', None, 'failed')])
+        self.assertIsNotNone(results[-1].error)
+        # one server listing, one server create, two zone lookups and one
+        # failed zone create
+        self.assertEqual(self.session.request.call_count, 5)
+
+    def test_ensure_servers_and_zones_server_order(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'tok'
+        created = []
+
+        def fake_request(method, url, **kwargs):
+            if url.endswith('/v1/servers'):
+                if method == 'GET':
+                    return fake_response(200, json={'servers': [
+                        {'id': 'sid2', 'name': 'ns2.example.com.'}]})
+                created.append(kwargs['json']['name'])
+                if kwargs['json']['name'] == 'ns3.example.com.':
+                    return fake_response(500)
+                return fake_response(200, json={
+                    'id': 'id-' + kwargs['json']['name']})
+            return fake_response(200, json={'zones': []})
+        self.session.request.side_effect = fake_request
+        servers = ['ns4.example.com.', 'ns2.example.com.',
+                   'ns3.example.com.', 'ns1.example.com.']
+        results = client.ensure_servers_and_zones(servers, [])
+        # servers are created one at a time in the order configured, and a
+        # failure does not stop the ones after it
+        self.assertEqual(created, ['ns4.example.com.', 'ns3.example.com.',
+                                   'ns1.example.com.'])
+        self.assertEqual([(r.name, r.status) for r in results],
+                         [('ns4.example.com.', 'created'),
+                          ('ns2.example.com.', 'exists'),
+                          ('ns3.example.com.', 'failed'),
+                          ('ns1.example.com.', 'created')])
+
+    def test_healthcheck(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        self.session.request.return_value = fake_response(200)
+        client.healthcheck()
+        self.session.request.assert_called_once_with(
+            'GET', 'http://10.0.0.10:9001/healthcheck', timeout=30)
+        self.assertIsNone(client.token)
+        self.session.request.return_value = fake_response(503)
+        with self.assertRaises(designate_api.DesignateAPIError):
+            client.healthcheck()
+
+    def test_authenticate_uses_token_cache(self):
+        cache = mock.MagicMock()
+        cache.get.return_value = 'cachedtok'
+        client = designate_api.DesignateClient(V3_CREDS, token_cache=cache)
+        self.assertEqual(client.authenticate(), 'cachedtok')
+        self.assertFalse(self.session.request.called)
+        cache.get.return_value = None
+        self.session.request.return_value = fake_response(
+            201, headers={'X-Subject-Token': 'tok1'},
+            json={'token': {'expires_at': '2030-01-01T00:00:00Z'}})
+        self.assertEqual(client.authenticate(), 'tok1')
+        cache.set.assert_called_once_with('tok1', 1893456000.0)
+
+    def test_request_401_bypasses_token_cache(self):
+        cache = mock.MagicMock()
+        cache.get.return_value = 'revoked'
+        client = designate_api.DesignateClient(V3_CREDS, token_cache=cache)
+        self.session.request.side_effect = [
+            fake_response(401),
+            fake_response(201, headers={'X-Subject-Token': 'fresh'},
+                          json={'token': {'expires_at': '2030-01-01Z'}}),
+            fake_response(200, json={'zones': []}),
+        ]
+        client.request('GET', '/v2/zones')
+        self.assertEqual(client.token, 'fresh')
+        cache.get.assert_called_once_with()
+        cache.invalidate.assert_called_once_with()
+        cache.set.assert_called_once_with('fresh', mock.ANY)
+
+    def test_request_401_refreshes_token_once(self):
+        client = designate_api.DesignateClient(V3_CREDS)
+        client.token = 'revoked'
+        barrier = threading.Barrier(4)
+        logins = []
+
+        def fake_request(method, url, headers=None, **kwargs):
+            if url.endswith('/auth/tokens'):
+                logins.append(url)
+                return fake_response(
+                    201, headers={'X-Subject-Token': 'fresh'},
+                    json={'token': {'expires_at': '2030-01-01Z'}})
+            if headers['X-Auth-Token'] == 'revoked':
+                # make every request fail before any of them re-authenticates
+                barrier.wait(timeout=5)
+                return fake_response(401)
+            return fake_response(200, json={'zones': []})
+        self.session.request.side_effect = fake_request
+        results = client.run_concurrently(
+            [lambda: client.request('GET', '/v2/zones')] * 4, limit=4)
+        self.assertEqual([r.status_code for r in results], [200] * 4)
+        self.assertEqual(len(logins), 1)
+        self.assertEqual(client.token, 'fresh')
+
+    def test_from_rc_file_token_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        rc_file = os.path.join(tmpdir, 'novarc')
+        with open(rc_file, 'w') as f:
+            f.write('export OS_USERNAME=designate\n')
+        cache_file = os.path.join(tmpdir, 'cache')
+        client = designate_api.DesignateClient.from_rc_file(
+            rc_file, token_cache_file=cache_file)
+        self.assertEqual(client.credentials, {'OS_USERNAME': 'designate'})
+        self.assertEqual(client.token_cache.path, cache_file)
+        key = client.token_cache.key
+        with open(rc_file, 'w') as f:
+            f.write('export OS_USERNAME=other\n')
+        client = designate_api.DesignateClient.from_rc_file(
+            rc_file, token_cache_file=cache_file)
+        self.assertNotEqual(client.token_cache.key, key)
+        client = designate_api.DesignateClient.from_rc_file(rc_file)
+        self.assertIsNone(client.token_cache)
+
+    def test_get_client(self):
+        self.addCleanup(designate_api._clients.clear)
+        with mock.patch.object(designate_api.DesignateClient, 'from_rc_file',
+                               return_value='client') as from_rc_file:
+            client = designate_api.get_client('rcfile')
+            self.assertIs(designate_api.get_client('rcfile'), client)
+            from_rc_file.assert_called_once_with(
+                'rcfile', token_cache_file='/root/.designate-token-cache.json')
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'cache')
+        for obj, attr, new in (
+                (designate_api.time, 'time', mock.MagicMock(
+                    return_value=1000)),
+                (designate_api.hookenv, 'log', mock.MagicMock())):
+            patcher = mock.patch.object(obj, attr, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_set_get(self):
+        cache = designate_api.TokenCache('key1', path=self.path, margin=60)
+        self.assertIsNone(cache.get())
+        cache.set('tok', 2000)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(cache.get(), 'tok')
+        self.assertEqual(os.listdir(self.tmpdir), ['cache'])
+
+    def test_get_near_expiry(self):
+        cache = designate_api.TokenCache('key1', path=self.path, margin=60)
+        cache.set('tok', 1050)
+        self.assertIsNone(cache.get())
+
+    def test_get_other_key(self):
+        designate_api.TokenCache('key1', path=self.path).set('tok', 5000)
+        cache = designate_api.TokenCache('key2', path=self.path)
+        self.assertIsNone(cache.get())
+
+    def test_get_corrupt(self):
+        with open(self.path, 'w') as f:
+            f.write('not json')
+        self.assertIsNone(designate_api.TokenCache('key1',
+                                                   path=self.path).get())
+
+    def test_invalidate(self):
+        cache = designate_api.TokenCache('key1', path=self.path)
+        cache.set('tok', 5000)
+        cache.invalidate()
+        self.assertFalse(os.path.exists(self.path))
+        cache.invalidate()
+        self.assertFalse(designate_api.hookenv.log.called)
+
+    def test_set_concurrently(self):
+        cache = designate_api.TokenCache('key1', path=self.path)
+        threads = [threading.Thread(target=cache.set, args=('tok', 5000))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.get(), 'tok')
+        self.assertEqual(os.listdir(self.tmpdir), ['cache'])
+        self.assertFalse(designate_api.hookenv.log.called)
+
+    def test_io_errors_ignored(self):
+        cache = designate_api.TokenCache(
+            'key1', path=os.path.join(self.tmpdir, 'missing', 'cache'))
+        cache.set('tok', 5000)
+        self.assertIsNone(cache.get())
+        os.mkdir(self.path)
+        cache = designate_api.TokenCache('key1', path=self.path)
+        self.assertIsNone(cache.get())
+        cache.set('tok', 5000)
+        cache.invalidate()
+        self.assertEqual(designate_api.hookenv.log.call_count, 4)
+        self.assertEqual(os.listdir(self.tmpdir), ['cache'])
+
+
+class TestHealthcheckEndpoint(unittest.TestCase):
+
+    def test_healthcheck(self):
+        endpoint = designate_api.HealthcheckEndpoint(
+            'http://127.0.0.1:9001/healthcheck')
+        with mock.patch.object(designate_api.requests, 'get',
+                               return_value=fake_response()) as get:
+            endpoint.check_ready()
+            get.assert_called_once_with('http://127.0.0.1:9001/healthcheck',
+                                        timeout=5)
+            get.return_value = fake_response(status_code=503)
+            with self.assertRaises(designate_api.DesignateAPIError):
+                endpoint.check_ready()
+            get.side_effect = designate_api.requests.ConnectionError('down')
+            with self.assertRaises(designate_api.DesignateAPIError):
+                endpoint.check_ready()
+
+
+class TestReadinessProbe(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [0.0]
+        patches = [
+            mock.patch.object(designate_api.time, 'monotonic',
+                              side_effect=lambda: self.now[0]),
+            mock.patch.object(designate_api.time, 'sleep',
+                              side_effect=self.fake_sleep),
+            mock.patch.object(designate_api.random, 'uniform',
+                              side_effect=lambda low, high: high),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def fake_sleep(self, seconds):
+        self.now[0] += seconds
+
+    def test_wait_backs_off_until_ready(self):
+        client = mock.MagicMock()
+        client.check_ready.side_effect = [
+            designate_api.DesignateAPIError('down'),
+            designate_api.DesignateAPIError('down'),
+            None]
+        probe = designate_api.ReadinessProbe(budget=60, base_delay=1)
+        self.assertEqual(probe.wait(client), 2)
+        self.assertTrue(probe.ready)
+        designate_api.time.sleep.assert_has_calls([mock.call(1),
+                                                   mock.call(2)])
+        # no further probing once the API has answered
+        self.assertEqual(probe.wait(client), 0)
+        self.assertEqual(client.check_ready.call_count, 3)
+
+    def test_wait_shares_budget(self):
+        client = mock.MagicMock()
+        client.check_ready.side_effect = designate_api.DesignateAPIError('x')
+        probe = designate_api.ReadinessProbe(budget=10, base_delay=1,
+                                             max_delay=4)
+        with self.assertRaises(designate_api.DesignateAPIError):
+            probe.wait(client)
+        self.assertEqual(self.now[0], 10)
+        # a second caller in the same hook gets a single attempt
+        client.check_ready.reset_mock()
+        with self.assertRaises(designate_api.DesignateAPIError):
+            probe.wait(client)
+        client.check_ready.assert_called_once_with()
+
+    def test_wait_for_central(self):
+        session = mock.MagicMock()
+        session.request.side_effect = [
+            fake_response(200),
+            fake_response(503),
+            fake_response(200),
+            fake_response(200, json={'zones': []})]
+        with mock.patch.object(designate_api.requests, 'Session',
+                               return_value=session):
+            client = designate_api.DesignateClient(V2_CREDS)
+        client.token = 'tok'
+        probe = designate_api.ReadinessProbe(budget=60, base_delay=1)
+        # /healthcheck answers before central does
+        self.assertEqual(probe.wait(client), 1)
+        self.assertTrue(probe.ready)
+        self.assertEqual(
+            [c[0] for c in session.request.call_args_list],
+            [('GET', 'http://10.0.0.10:9001/healthcheck'),
+             ('GET', 'http://10.0.0.10:9001/v2/zones'),
+             ('GET', 'http://10.0.0.10:9001/healthcheck'),
+             ('GET', 'http://10.0.0.10:9001/v2/zones')])
+        session.request.assert_called_with(
+            'GET', 'http://10.0.0.10:9001/v2/zones', timeout=30,
+            headers={'X-Auth-Token': 'tok'}, params={'limit': 1})
+
+    def test_wait_raises_non_transient_errors(self):
+        client = mock.MagicMock()
+        client.check_ready.side_effect = designate_api.DesignateAPIError(
+            'forbidden', status_code=403)
+        probe = designate_api.ReadinessProbe(budget=60, base_delay=1)
+        with self.assertRaises(designate_api.DesignateAPIError):
+            probe.wait(client)
+        client.check_ready.assert_called_once_with()
+        self.assertFalse(designate_api.time.sleep.called)
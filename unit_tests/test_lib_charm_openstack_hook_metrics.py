@@ -0,0 +1,178 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import inspect
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from unittest import mock
+
+import charms.reactive.bus as bus
+
+import charm.openstack.hook_metrics as hook_metrics
+
+
+class TestHookMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'metrics', 'hook.jsonl')
+        self.config = {'hook-metrics': True}
+        for obj, attr, new in (
+                (hook_metrics, 'METRICS_FILE', self.path),
+                (hook_metrics.write_record, '__defaults__',
+                 (self.path, hook_metrics.MAX_FILE_SIZE)),
+                (hook_metrics.hookenv, 'config', self.config.get),
+                (hook_metrics.os, 'environ',
+                 {'JUJU_CONTEXT_ID': 'designate/0-config-changed-1'})):
+            patcher = mock.patch.object(obj, attr, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def records(self):
+        return hook_metrics.read_records(self.path)
+
+    def test_record_disabled(self):
+        self.config['hook-metrics'] = False
+        with hook_metrics.record(hook_metrics.HANDLER, 'h1'):
+            pass
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_record(self):
+        with hook_metrics.record(hook_metrics.API, 'healthcheck') as entry:
+            entry['retries'] = 2
+        records = self.records()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['hook'], 'designate/0-config-changed-1')
+        self.assertEqual(records[0]['kind'], 'api')
+        self.assertEqual(records[0]['name'], 'healthcheck')
+        self.assertEqual(records[0]['retries'], 2)
+        self.assertEqual(records[0]['status'], 'ok')
+        self.assertIn('duration', records[0])
+
+    def test_record_exception(self):
+        with self.assertRaises(KeyError):
+            with hook_metrics.record(hook_metrics.HANDLER, 'h1'):
+                raise KeyError('boom')
+        self.assertEqual(self.records()[0]['status'], 'KeyError')
+
+    def test_write_record_rotates(self):
+        hook_metrics.write_record({'n': 1}, path=self.path, max_size=1)
+        hook_metrics.write_record({'n': 2}, path=self.path, max_size=1)
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertEqual(self.records(), [{'n': 1}, {'n': 2}])
+
+    def test_write_record_failure_ignored(self):
+        with mock.patch.object(hook_metrics.os, 'makedirs',
+                               side_effect=PermissionError('denied')):
+            hook_metrics.write_record({'n': 1}, path=self.path)
+        self.assertEqual(self.records(), [])
+
+    def test_read_records_skips_bad_lines(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{"n": 1}\n{"n": \n')
+        self.assertEqual(self.records(), [{'n': 1}])
+
+    def test_timed(self):
+        def handler(a, b=None):
+            return a
+        wrapped = hook_metrics.timed(handler)
+        self.assertEqual(wrapped('x'), 'x')
+        self.assertEqual(wrapped.__name__, 'handler')
+        self.assertEqual(bus._action_id(wrapped), bus._action_id(handler))
+        self.assertEqual(inspect.signature(wrapped),
+                         inspect.signature(handler))
+        self.assertEqual(self.records()[0]['name'], 'handler')
+
+    def test_reactive_bus_helpers(self):
+        # timed() relies on these private charms.reactive helpers, and on
+        # them preferring the ids set on the handler to their own
+        def handler():
+            pass
+        for helper in (bus._action_id, bus._short_action_id):
+            self.assertTrue(callable(helper))
+            self.assertIsInstance(helper(handler), str)
+        handler._action_id = 'action'
+        handler._short_action_id = 'short'
+        self.assertEqual(bus._action_id(handler), 'action')
+        self.assertEqual(bus._short_action_id(handler), 'short')
+
+    def test_check_call(self):
+        with mock.patch.object(hook_metrics.subprocess, 'check_call') as cc:
+            hook_metrics.check_call(['designate-manage', 'pool', 'update'],
+                                    timeout=60)
+            cc.assert_called_once_with(
+                ['designate-manage', 'pool', 'update'], timeout=60)
+        record = self.records()[0]
+        self.assertEqual(record['kind'], 'command')
+        self.assertEqual(record['name'], 'designate-manage pool update')
+        self.assertEqual(record['status'], 0)
+
+    def test_check_call_failure(self):
+        with mock.patch.object(hook_metrics.subprocess, 'check_call',
+                               side_effect=subprocess.CalledProcessError(
+                                   3, 'cmd')):
+            with self.assertRaises(subprocess.CalledProcessError):
+                hook_metrics.check_call(['cmd'])
+        self.assertEqual(self.records()[0]['status'], 3)
+
+    def test_check_call_timeout(self):
+        with mock.patch.object(hook_metrics.subprocess, 'check_call',
+                               side_effect=subprocess.TimeoutExpired(
+                                   'cmd', 60)):
+            with self.assertRaises(subprocess.TimeoutExpired):
+                hook_metrics.check_call(['cmd'])
+        self.assertEqual(self.records()[0]['status'], 'timeout')
+
+    def test_summarise(self):
+        records = [
+            {'hook': 'h1', 'kind': 'handler', 'name': 'old',
+             'duration': 100.0, 'status': 'ok', 'retries': 0},
+            {'hook': 'h2', 'kind': 'handler', 'name': 'fast',
+             'duration': 0.5, 'status': 'ok', 'retries': 0},
+            {'hook': 'h2', 'kind': 'command', 'name': 'cmd',
+             'duration': 4.0, 'status': 1, 'retries': 0},
+            {'hook': 'h3', 'kind': 'handler', 'name': 'slow',
+             'duration': 3.0, 'status': 'ok', 'retries': 1},
+            {'hook': 'h3', 'kind': 'handler', 'name': 'fast',
+             'duration': 1.5, 'status': 'ValueError', 'retries': 0},
+        ]
+        summary = hook_metrics.summarise(records, hooks=2, limit=5)
+        self.assertEqual(summary['handler'], [
+            {'name': 'slow', 'count': 1, 'total': 3.0, 'max': 3.0,
+             'failures': 0, 'retries': 1},
+            {'name': 'fast', 'count': 2, 'total': 2.0, 'max': 1.5,
+             'failures': 1, 'retries': 0},
+        ])
+        self.assertEqual(summary['command'], [
+            {'name': 'cmd', 'count': 1, 'total': 4.0, 'max': 4.0,
+             'failures': 1, 'retries': 0},
+        ])
+        summary = hook_metrics.summarise(records, hooks=2, limit=1)
+        self.assertEqual([i['name'] for i in summary['handler']], ['slow'])
+
+    def test_format_summary(self):
+        output = hook_metrics.format_summary({'command': [
+            {'name': 'cmd', 'count': 1, 'total': 4.0, 'max': 4.0,
+             'failures': 1, 'retries': 0}]})
+        self.assertEqual(list(output.keys()), ['command'])
+        self.assertIn('cmd', output['command'])
+        self.assertIn('4.000s total', output['command'])
+        json.dumps(output)
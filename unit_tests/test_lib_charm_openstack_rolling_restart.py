@@ -0,0 +1,142 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+
+from unittest import mock
+
+import charm.openstack.rolling_restart as rolling_restart
+
+
+class FakeKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+    def unset(self, key):
+        self.pop(key, None)
+
+    def flush(self):
+        pass
+
+
+class TestRollingRestart(unittest.TestCase):
+
+    def setUp(self):
+        self.kv = FakeKV()
+        self.leader_data = {}
+        self.relation_data = {'designate/0': {}, 'designate/1': {},
+                              'designate/2': {}}
+        self.local_unit = 'designate/0'
+        hookenv = rolling_restart.hookenv
+        for obj, attr, new in (
+                (rolling_restart.unitdata, 'kv', lambda: self.kv),
+                (hookenv, 'relation_ids', lambda reltype: ['cluster:1']),
+                (hookenv, 'related_units', self.related_units),
+                (hookenv, 'local_unit', lambda: self.local_unit),
+                (hookenv, 'relation_get', self.relation_get),
+                (hookenv, 'relation_set', self.relation_set),
+                (hookenv, 'leader_get', self.leader_data.get),
+                (hookenv, 'leader_set', self.leader_set),
+                (hookenv, 'log', mock.MagicMock())):
+            patcher = mock.patch.object(obj, attr, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def related_units(self, rid):
+        return sorted(u for u in self.relation_data if u != self.local_unit)
+
+    def relation_get(self, attribute=None, unit=None, rid=None):
+        return dict(self.relation_data[unit])
+
+    def relation_set(self, relation_id=None, relation_settings=None):
+        self.relation_data[self.local_unit].update(relation_settings)
+
+    def leader_set(self, settings):
+        for key, value in settings.items():
+            if value is None:
+                self.leader_data.pop(key, None)
+            else:
+                self.leader_data[key] = value
+
+    def test_has_peers(self):
+        self.assertTrue(rolling_restart.has_peers())
+        self.relation_data = {'designate/0': {}}
+        self.assertFalse(rolling_restart.has_peers())
+
+    def test_request(self):
+        rolling_restart.request(['designate-api'])
+        nonce = self.relation_data['designate/0']['restart-request']
+        rolling_restart.request(['designate-api', 'designate-worker'])
+        self.assertEqual(rolling_restart.pending(),
+                         ['designate-api', 'designate-worker'])
+        # one request covers everything queued until it is done
+        self.assertEqual(self.relation_data['designate/0']['restart-request'],
+                         nonce)
+
+    def test_request_after_restart(self):
+        rolling_restart.request(['designate-api'])
+        rolling_restart.mark_restarted()
+        self.assertTrue(rolling_restart.restarted())
+        rolling_restart.request(['designate-api'])
+        self.assertTrue(rolling_restart.restarted())
+        rolling_restart.request(['designate-worker'])
+        self.assertFalse(rolling_restart.restarted())
+
+    def test_grant_next_slot(self):
+        self.assertIsNone(rolling_restart.grant_next_slot())
+        self.relation_data['designate/2']['restart-request'] = 'r2'
+        self.relation_data['designate/1']['restart-request'] = 'r1'
+        self.assertEqual(rolling_restart.grant_next_slot(),
+                         {'unit': 'designate/1', 'request': 'r1'})
+        self.assertEqual(json.loads(self.leader_data['restart-slot']),
+                         {'unit': 'designate/1', 'request': 'r1'})
+        # the slot stays put until its holder is done
+        self.assertEqual(rolling_restart.grant_next_slot()['unit'],
+                         'designate/1')
+        self.relation_data['designate/1']['restart-done'] = 'r1'
+        self.assertEqual(rolling_restart.grant_next_slot(),
+                         {'unit': 'designate/2', 'request': 'r2'})
+        self.relation_data['designate/2']['restart-done'] = 'r2'
+        self.assertIsNone(rolling_restart.grant_next_slot())
+        self.assertNotIn('restart-slot', self.leader_data)
+
+    def test_grant_next_slot_round_robin(self):
+        self.leader_data['restart-slot'] = json.dumps(
+            {'unit': 'designate/1', 'request': 'old'})
+        for unit in self.relation_data:
+            self.relation_data[unit]['restart-request'] = unit
+        self.assertEqual(rolling_restart.grant_next_slot()['unit'],
+                         'designate/2')
+
+    def test_grant_next_slot_holder_departed(self):
+        self.leader_data['restart-slot'] = json.dumps(
+            {'unit': 'designate/2', 'request': 'r2'})
+        self.relation_data['designate/1']['restart-request'] = 'r1'
+        del self.relation_data['designate/2']
+        self.assertEqual(rolling_restart.grant_next_slot()['unit'],
+                         'designate/1')
+
+    def test_holds_slot_and_complete(self):
+        rolling_restart.request(['designate-api'])
+        self.assertFalse(rolling_restart.holds_slot())
+        rolling_restart.grant_next_slot()
+        self.assertTrue(rolling_restart.holds_slot())
+        rolling_restart.complete()
+        self.assertEqual(rolling_restart.pending(), [])
+        self.assertFalse(rolling_restart.holds_slot())
+        data = self.relation_data['designate/0']
+        self.assertEqual(data['restart-done'], data['restart-request'])
+        self.assertIsNone(rolling_restart.grant_next_slot())